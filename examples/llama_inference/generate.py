@@ -17,6 +17,7 @@ import model as fast
 import mp_utils
 import sample_utils
 import torch
+from prefix_cache import PrefixCache
 from stats import Stats
 from tokenizer import Tokenizer
 
@@ -33,6 +34,12 @@ class GenArgs:
     temperature: float = 0.6
     top_p: float = 0.9
 
+    prefix_cache_bytes: int = 0
+    """
+    Memory budget to keep the keys and values of prompt
+    prefixes across calls to ``generate_all``, 0 to disable.
+    """
+
 
 class FastGen:
     GRAPH_WARMUPS: int = 3
@@ -95,12 +102,22 @@ class FastGen:
         self.model_args = model_args
         self.model = model
         self.tokenizer = tokenizer
+        self.prefix_cache: Optional[PrefixCache] = None
+        if args.prefix_cache_bytes > 0:
+            self.prefix_cache = PrefixCache(model_args, args.prefix_cache_bytes)
 
     @torch.inference_mode()
     def generate_all(
         self, prompts: list[list[int]], use_cuda_graphs: bool
     ) -> Tuple[Stats, list[list[int]]]:
         bs = len(prompts)
+        prefix = None
+        if self.prefix_cache is not None:
+            # Only process the tokens after the cached prefixes
+            matches = [self.prefix_cache.match(p) for p in prompts]
+            full_prompts = prompts
+            prompts = [p[m.length :] for p, m in zip(prompts, matches)]
+            prefix = self.prefix_cache.make_prefix(matches, [len(p) for p in prompts])
         prompt_lens = [len(p) for p in prompts]
         max_prompt_length = max(prompt_lens)
         gen_length = self.gen_args.gen_length
@@ -122,8 +139,6 @@ class FastGen:
         graph = torch.cuda.CUDAGraph()
 
         # Input tensors to the cuda graph
-        q_seqstart = bias.q_seqinfo.seqstart
-        kv_seqlen = bias.k_seqinfo.seqlen
         tokens = torch.IntTensor(sum(prompts, [])).cuda()
         out_tokens = torch.zeros((max_seq_length, bs), dtype=torch.int)
 
@@ -140,6 +155,7 @@ class FastGen:
                     token_values=tokens,
                     attn_bias=bias,
                     cache=cache,
+                    prefix=prefix,
                 )
             elif niter == self.GRAPH_WARMUPS + 1:
                 recording_kwargs = {}
@@ -152,6 +168,7 @@ class FastGen:
                         token_values=tokens,
                         attn_bias=bias,
                         cache=cache,
+                        prefix=prefix,
                     )
                 graph.replay()
                 # synchronize to get accurate timings
@@ -176,17 +193,23 @@ class FastGen:
 
             # Update attention bias state for decoding rounds
             if niter == 0:
-                q_seqstart.copy_(torch.arange(bs + 1, dtype=torch.int))
-                bias.q_seqinfo.min_seqlen = 1
-                bias.q_seqinfo.max_seqlen = 1
-                bias.q_seqinfo.seqstart_py = q_seqstart.tolist()
                 tokens = tokens[:bs]
-
-            kv_seqlen.add_(kv_seqlen < max_seq_length)
+                if self.prefix_cache is not None:
+                    prefix = self.prefix_cache.make_prefix(matches, [1] * bs)
+                    # Cache the prompts for the next requests, the
+                    # decoded tokens keep using the private caches
+                    matches = [
+                        self.prefix_cache.insert(p, m, cache, i * max_seq_length)
+                        for i, (p, m) in enumerate(zip(full_prompts, matches))
+                    ]
+            bias.advance(1)
 
             tokens.copy_(next_token)
 
         stats.end_phase(tokens=gen_length * bs)
+        if self.prefix_cache is not None:
+            for m in matches:
+                self.prefix_cache.release(m)
 
         def trim_answer(prompt, tokens):
             """Trim the answer to end it on an eos token."""
@@ -15,6 +15,7 @@ from xformers.ops import RMSNorm, fmha, rope_padded
 from xformers.ops.fmha.attn_bias import (
     BlockDiagonalCausalWithOffsetPaddedKeysMask as AttnBias,
 )
+from xformers.ops.fmha.attn_bias import PagedBlockDiagonalPaddedKeysMask
 
 
 @dataclass
@@ -48,6 +49,27 @@ class ModelArgs:
 LayerCache = Tuple[torch.Tensor, torch.Tensor]
 
 
+@dataclass
+class Prefix:
+    """
+    Keys and values of cached prompt prefixes (see ``prefix_cache.py``).
+    The caches passed to the model then only hold the tokens
+    following the prefixes.
+    """
+
+    cache: list[LayerCache]
+    """Per layer, the pages holding the prefixes"""
+
+    attn_bias: PagedBlockDiagonalPaddedKeysMask
+    """
+    Attention of the queries to their prefix. Consecutive sequences
+    sharing a prefix are grouped in a single block.
+    """
+
+    seqlen: torch.Tensor
+    """Length of the prefix of each sequence"""
+
+
 class Attention(nn.Module):
     def __init__(
         self,
@@ -103,6 +125,7 @@ class Attention(nn.Module):
         cache: LayerCache,
         attn_bias: AttnBias,
         position_index: Optional[torch.Tensor],
+        prefix: Optional[Tuple[LayerCache, Prefix]] = None,
     ) -> torch.Tensor:
         # x.shape is (sum(seq_lens), dim)
         #
@@ -135,13 +158,32 @@ class Attention(nn.Module):
             cache_v=cache_v,
             attn_bias=attn_bias,
             theta=self.rope_theta,
+            first_seqpos=None if prefix is None else prefix[1].seqlen,
         )
 
         # rope_padded() updated the caches, so we
         # call attention directly
-        output = fmha.memory_efficient_attention_forward(
-            xq, cache_k, cache_v, attn_bias
-        )
+        if prefix is None:
+            output = fmha.memory_efficient_attention_forward(
+                xq, cache_k, cache_v, attn_bias
+            )
+        else:
+            # Attend separately to the shared prefixes and to
+            # the private tokens, and combine both using the
+            # log-sum-exps
+            (prefix_k, prefix_v), prefix_info = prefix
+            out_prefix, lse_prefix = fmha.memory_efficient_attention_partial(
+                xq, prefix_k, prefix_v, prefix_info.attn_bias
+            )
+            out_private, lse_private = fmha.memory_efficient_attention_partial(
+                xq, cache_k, cache_v, attn_bias
+            )
+            output, _ = fmha.merge_attentions(
+                [out_prefix, out_private],
+                [lse_prefix, lse_private],
+                write_lse=False,
+                output_dtype=xq.dtype,
+            )
         output = output.reshape(output_shape)
         if position_index is not None:
             output = output[position_index]
@@ -245,6 +287,7 @@ class TransformerBlock(nn.Module):
         x: torch.Tensor,
         cache: LayerCache,
         attn_bias: AttnBias,
+        prefix: Optional[Tuple[LayerCache, Prefix]] = None,
     ) -> torch.Tensor:
         position_index = None
         if self.is_last_layer and attn_bias.q_seqinfo.max_seqlen > 1:
@@ -255,6 +298,7 @@ class TransformerBlock(nn.Module):
             cache,
             attn_bias,
             position_index=position_index,
+            prefix=prefix,
         )
         if position_index is not None:
             x = x[position_index]
@@ -294,12 +338,14 @@ class Transformer(nn.Module):
         token_values: torch.Tensor,
         attn_bias: AttnBias,
         cache: list[LayerCache],
+        prefix: Optional[Prefix] = None,
     ) -> torch.Tensor:
         h_parallel = self.tok_embeddings(token_values)
         h = mp_utils.all_gather(h_parallel)
 
         for i, layer in enumerate(self.layers):
-            h = layer(h, cache[i], attn_bias)
+            layer_prefix = None if prefix is None else (prefix.cache[i], prefix)
+            h = layer(h, cache[i], attn_bias, layer_prefix)
 
         logits_parallel = self.output(self.norm(h))
         logits = mp_utils.all_gather(logits_parallel)
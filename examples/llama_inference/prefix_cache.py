@@ -0,0 +1,275 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+import itertools
+from typing import Optional, Sequence, Union
+
+import mp_utils
+import torch
+from model import LayerCache, ModelArgs, Prefix, make_cache
+
+from xformers.ops.fmha.attn_bias import PagedBlockDiagonalPaddedKeysMask
+
+
+class _Node:
+    """
+    A node of the radix tree. The edge leading to the node is
+    labelled with ``tokens``, whose keys and values are stored
+    in ``pages``; there is always a whole number of pages.
+    """
+
+    def __init__(
+        self, tokens: tuple[int, ...], pages: list[int], parent: Optional["_Node"]
+    ):
+        self.tokens = tokens
+        self.pages = pages
+        self.parent = parent
+        self.children: dict[tuple[int, ...], "_Node"] = {}
+        self.length: int = len(tokens) + (parent.length if parent else 0)
+        self.last_use = 0
+        self.users = 0
+
+    def path_pages(self) -> list[int]:
+        pages = []
+        node: Optional[_Node] = self
+        while node is not None:
+            pages = node.pages + pages
+            node = node.parent
+        return pages
+
+
+class PrefixCache:
+    """
+    Keeps the keys and values of prompt prefixes, so that requests
+    starting with the same tokens (eg a system prompt) don't
+    recompute them.
+
+    Prefixes are stored in a radix tree whose edges are whole pages
+    of tokens, and their keys and values live in pages of a
+    preallocated pool (in the layout of ``PagedBlockDiagonal*``
+    biases). When the pool is full, the least recently used
+    prefixes not used by a running batch are evicted.
+
+    Usage:
+        1. ``match`` every prompt to find its longest cached prefix,
+        2. ``make_prefix`` to pass to ``Transformer.forward_with_attn_bias``
+           with the remaining (private) tokens of the prompts,
+        3. once the prompts are processed, ``insert`` them from
+           the private cache so that later requests can reuse them,
+        4. ``release`` the matches when the generation is done.
+    """
+
+    def __init__(
+        self,
+        args: ModelArgs,
+        max_bytes: int,
+        page_size: int = 256,
+        device: Optional[Union[str, torch.device]] = None,
+        dtype: Optional[torch.dtype] = None,
+    ):
+        """
+        Args:
+            args (ModelArgs): the model configuration.
+            max_bytes (int): memory budget of the cache, across all layers.
+            page_size (int): number of tokens per page, prefixes are
+                cached with this granularity.
+            device (torch.device, optional): the device on which
+                the cache should be allocated.
+            dtype (torch.dtype, optional): the dtype to use for
+                cache entries (defaults to the default dtype).
+        """
+        n_kv_heads = args.n_kv_heads
+        if n_kv_heads is None:
+            n_kv_heads = args.n_heads
+        n_local_kv_heads = n_kv_heads // mp_utils.get_world_size()
+        head_dim = args.dim // args.n_heads
+        if dtype is None:
+            dtype = torch.get_default_dtype()
+        element_size = torch.empty([], dtype=dtype).element_size()
+        page_bytes = (
+            2 * args.n_layers * page_size * n_local_kv_heads * head_dim * element_size
+        )
+        self.num_pages = max_bytes // page_bytes
+        assert self.num_pages > 0, "budget too small for a single page"
+        self.page_size = page_size
+        self.cache: list[LayerCache] = make_cache(
+            args, self.num_pages * page_size, device=device, dtype=dtype
+        )
+        self._free_pages = list(range(self.num_pages - 1, -1, -1))
+        self._root = _Node((), [], None)
+        self._clock = itertools.count(1)
+
+    @property
+    def num_cached_tokens(self) -> int:
+        return (self.num_pages - len(self._free_pages)) * self.page_size
+
+    def _page_key(self, tokens: Sequence[int], start: int) -> tuple[int, ...]:
+        return tuple(tokens[start : start + self.page_size])
+
+    def _split(self, node: _Node, num_pages: int) -> _Node:
+        """Splits the edge to ``node`` after ``num_pages`` pages"""
+        n_tokens = num_pages * self.page_size
+        assert node.parent is not None
+        head = _Node(node.tokens[:n_tokens], node.pages[:num_pages], node.parent)
+        head.last_use, head.users = node.last_use, node.users
+        node.parent.children[self._page_key(head.tokens, 0)] = head
+        node.tokens = node.tokens[n_tokens:]
+        node.pages = node.pages[num_pages:]
+        node.parent = head
+        head.children[self._page_key(node.tokens, 0)] = node
+        return head
+
+    def _walk(self, node: _Node, tokens: Sequence[int], end: int) -> _Node:
+        """
+        Follows ``tokens[node.length:end]`` down the tree from ``node``,
+        as far as they are cached
+        """
+        while node.length + self.page_size <= end:
+            child = node.children.get(self._page_key(tokens, node.length))
+            if child is None:
+                break
+            # Count the pages of the edge which match the tokens
+            num_pages = 1
+            while num_pages < len(child.pages):
+                start = node.length + num_pages * self.page_size
+                if start + self.page_size > end or self._page_key(
+                    child.tokens, num_pages * self.page_size
+                ) != self._page_key(tokens, start):
+                    break
+                num_pages += 1
+            if num_pages < len(child.pages):
+                child = self._split(child, num_pages)
+            node = child
+        return node
+
+    def match(self, tokens: Sequence[int]) -> _Node:
+        """
+        Finds the longest cached prefix of ``tokens``, leaving at least
+        one token to process. The prefix can't be evicted until
+        it is released with ``release``.
+        """
+        node = self._walk(self._root, tokens, len(tokens) - 1)
+        self._acquire(node)
+        return node
+
+    def _acquire(self, node: _Node) -> None:
+        now = next(self._clock)
+        it: Optional[_Node] = node
+        while it is not None:
+            it.users += 1
+            it.last_use = now
+            it = it.parent
+
+    def release(self, node: _Node) -> None:
+        """Allows a prefix returned by ``match`` or ``insert`` to be evicted"""
+        it: Optional[_Node] = node
+        while it is not None:
+            it.users -= 1
+            it = it.parent
+
+    def _evict(self, num_pages: int) -> bool:
+        """
+        Frees pages from the least recently used prefixes. Nothing is
+        evicted if the prefixes in use leave fewer than ``num_pages``.
+        """
+        if len(self._free_pages) >= num_pages:
+            return True
+        # Users are counted along the whole path, so every node without
+        # users can eventually be evicted (leaves first)
+        num_evictable = 0
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children.values())
+            if node.users == 0 and node is not self._root:
+                num_evictable += len(node.pages)
+        if len(self._free_pages) + num_evictable < num_pages:
+            return False
+        while len(self._free_pages) < num_pages:
+            leaves = []
+            stack = [self._root]
+            while stack:
+                node = stack.pop()
+                stack.extend(node.children.values())
+                if not node.children and node.users == 0 and node is not self._root:
+                    leaves.append(node)
+            if not leaves:
+                return False
+            lru = min(leaves, key=lambda n: n.last_use)
+            assert lru.parent is not None
+            del lru.parent.children[self._page_key(lru.tokens, 0)]
+            self._free_pages.extend(lru.pages)
+        return True
+
+    def insert(
+        self,
+        tokens: Sequence[int],
+        prefix: _Node,
+        cache: list[LayerCache],
+        cache_start: int,
+    ) -> _Node:
+        """
+        Caches the prompt ``tokens``, whose prefix ``prefix`` (as returned by
+        ``match``) is already cached and whose other tokens are at position
+        ``cache_start`` in the layer caches ``cache``.
+        Only whole pages are cached. The returned node replaces ``prefix``,
+        and should be released instead.
+        """
+        end = len(tokens) // self.page_size * self.page_size
+        # Another prompt may have cached (part of) the tokens in the meantime
+        node = self._walk(prefix, tokens, end)
+        self._acquire(node)
+        self.release(prefix)
+        num_pages = (end - node.length) // self.page_size
+        if num_pages == 0 or not self._evict(num_pages):
+            return node
+        pages = [self._free_pages.pop() for _ in range(num_pages)]
+        dst = (
+            torch.tensor(pages)[:, None] * self.page_size + torch.arange(self.page_size)
+        ).flatten()
+        dst = dst.to(self.cache[0][0].device)
+        src_start = cache_start + node.length - prefix.length
+        src_end = src_start + num_pages * self.page_size
+        for (pool_k, pool_v), (cache_k, cache_v) in zip(self.cache, cache):
+            # The caches are expanded over the heads of a group, write
+            # in the underlying storage
+            pool_k[0, :, :, 0].index_copy_(0, dst, cache_k[0, src_start:src_end, :, 0])
+            pool_v[0, :, :, 0].index_copy_(0, dst, cache_v[0, src_start:src_end, :, 0])
+        child = _Node(tuple(tokens[node.length : end]), pages, node)
+        node.children[self._page_key(child.tokens, 0)] = child
+        self._acquire(child)
+        self.release(node)
+        return child
+
+    def make_prefix(self, prefixes: Sequence[_Node], q_seqlen: Sequence[int]) -> Prefix:
+        """
+        Creates the ``Prefix`` for a batch of sequences, where the i-th
+        sequence has ``q_seqlen[i]`` queries after the prefix ``prefixes[i]``.
+        The queries of consecutive sequences with the same prefix attend
+        to the prefix at once.
+        """
+        device = self.cache[0][0].device
+        group_q_seqlen: list[int] = []
+        group_prefixes: list[_Node] = []
+        for node, n in zip(prefixes, q_seqlen):
+            if group_prefixes and group_prefixes[-1] is node:
+                group_q_seqlen[-1] += n
+            else:
+                group_prefixes.append(node)
+                group_q_seqlen.append(n)
+        tables = [node.path_pages() for node in group_prefixes]
+        width = max([len(pages) for pages in tables] + [1])
+        block_tables = torch.zeros([len(tables), width], dtype=torch.int32)
+        for i, pages in enumerate(tables):
+            block_tables[i, : len(pages)] = torch.tensor(pages, dtype=torch.int32)
+        attn_bias = PagedBlockDiagonalPaddedKeysMask.from_seqlens(
+            q_seqlen=group_q_seqlen,
+            kv_seqlen=[node.length for node in group_prefixes],
+            block_tables=block_tables.to(device),
+            page_size=self.page_size,
+            device=device,
+        )
+        seqlen = torch.tensor([node.length for node in prefixes], dtype=torch.int32)
+        return Prefix(cache=self.cache, attn_bias=attn_bias, seqlen=seqlen.to(device))
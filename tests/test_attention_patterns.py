@@ -4,11 +4,14 @@
 # LICENSE file in the root directory of this source tree.
 
 import itertools
+import math
 
 import pytest
 import torch
 
 import xformers.components.attention.attention_patterns as AP
+import xformers.components.attention.sparsity_config as sparsity_config
+from xformers.components.attention import SparseCS
 from xformers.components.attention.sparsity_config import (
     BigBirdSparsityConfig,
     BSLongformerSparsityConfig,
@@ -16,6 +19,8 @@ from xformers.components.attention.sparsity_config import (
     FixedSparsityConfig,
     VariableSparsityConfig,
 )
+from xformers.ops import fmha
+from xformers.sparse import BlockSparseTensor
 
 
 # baseline implementations
@@ -342,6 +347,47 @@ def test_layout_to_pattern():
     )
 
 
+def _block_sparsify_tensor_ref(x, mask, block_size):
+    ret = torch.empty(
+        (x.size(0), mask.sum(), block_size, block_size), dtype=x.dtype, device=x.device
+    )
+    for idx, (h, i, j) in enumerate(zip(*mask.nonzero(as_tuple=True))):
+        ret[:, idx, :, :] = x[
+            :,
+            h,
+            i * block_size : (i + 1) * block_size,
+            j * block_size : (j + 1) * block_size,
+        ]
+    return ret
+
+
+def test_block_sparsify_tensor():
+    torch.manual_seed(0)
+    B, H, block_size = 2, 3, 16
+    layout = torch.rand(H, 6, 5) < 0.5
+    x = torch.randn(B, H, 6 * block_size, 5 * block_size)
+
+    values = AP.block_sparsify_tensor(x, layout, block_size)
+    assert torch.equal(values, _block_sparsify_tensor_ref(x, layout, block_size))
+    assert torch.equal(
+        AP.block_sparsify_tensor(x.transpose(-2, -1), layout.transpose(-2, -1), 16),
+        _block_sparsify_tensor_ref(
+            x.transpose(-2, -1).contiguous(), layout.transpose(-2, -1), 16
+        ),
+    )
+
+    # Round trip
+    pattern = AP.layout_to_pattern(layout, block_size).bool()
+    assert torch.equal(
+        AP.block_densify_tensor(values, layout), x.masked_fill(~pattern, 0)
+    )
+    assert torch.equal(
+        AP.block_densify_tensor(values, layout, float("-inf")),
+        x.masked_fill(~pattern, float("-inf")),
+    )
+    assert torch.equal(BlockSparseTensor(values, layout).to_dense(), x * pattern)
+
+
 def test_dense_sparsity_config():
     sc = DenseSparsityConfig(num_heads=1, block_size=16)
     with pytest.raises(expected_exception=ValueError):
@@ -473,3 +519,150 @@ def test_variable_sparsity_config():
         VariableSparsityConfig(num_heads=1, global_block_end_indices=[])
     with pytest.raises(expected_exception=ValueError):
         VariableSparsityConfig(num_heads=1, global_block_end_indices=[-1])
+
+
+def test_fixed_sparsity_config_unidirectional():
+    sc = FixedSparsityConfig(
+        num_heads=2,
+        different_layout_per_head=True,
+        num_local_blocks=2,
+        attention="unidirectional",
+        num_different_global_patterns=2,
+    )
+    layout = sc.make_layout(80)
+    assert torch.equal(
+        layout,
+        torch.tensor(
+            [
+                [
+                    [1, 0, 0, 0, 0],
+                    [1, 1, 0, 0, 0],
+                    [0, 1, 1, 0, 0],
+                    [0, 1, 1, 1, 0],
+                    [0, 1, 0, 1, 1],
+                ],
+                [
+                    [1, 0, 0, 0, 0],
+                    [1, 1, 0, 0, 0],
+                    [1, 0, 1, 0, 0],
+                    [1, 0, 1, 1, 0],
+                    [1, 0, 1, 0, 1],
+                ],
+            ]
+        ),
+    )
+
+
+def test_sparsity_config_layout_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XFORMERS_SPARSITY_LAYOUT_CACHE", str(tmp_path))
+    sc = BSLongformerSparsityConfig(num_heads=4, global_block_indices=[0, 3])
+    layout = sc.make_layout(256)
+    assert layout.shape == (4, 16, 16) and layout.dtype == torch.int64
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # Callers can modify the returned layouts
+    layout.zero_()
+    same_config = BSLongformerSparsityConfig(num_heads=4, global_block_indices=[0, 3])
+    assert torch.equal(same_config.make_layout(256), sc._make_layout(256))
+
+    # Loaded from disk
+    sparsity_config._layout_cache.clear()
+    assert torch.equal(same_config.make_layout(256), sc._make_layout(256))
+
+    other_config = BSLongformerSparsityConfig(num_heads=4, global_block_indices=[1])
+    assert not torch.equal(other_config.make_layout(256), sc._make_layout(256))
+    sc.make_layout(512)
+    assert len(list(tmp_path.iterdir())) == 3
+
+    # Random layouts are not cached
+    assert not BigBirdSparsityConfig(num_heads=1).is_deterministic()
+    BigBirdSparsityConfig(num_heads=1).make_layout(256)
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def _lazy_patterns(n: int):
+    torch.manual_seed(0)
+    is_global = torch.rand(n) < 0.1
+    causal = AP.BandPattern((n, n), None, 0)
+    return [
+        AP.BandPattern((n, n), 3, 3),
+        causal,
+        AP.BandPattern((n, n + 7), 2, None),
+        AP.GroupPattern.windows(n, 5) & causal,
+        AP.GroupPattern.windows(n, 6) & AP.BandPattern((n, n), 2, 0),
+        AP.GlobalTokenPattern(is_global) | AP.BandPattern((n, n), 1, 1),
+        ~AP.BandPattern((n, n), 4, 2) & AP.GlobalTokenPattern(is_global),
+        AP.DensePattern(torch.rand(n, n) < 0.3) | ~AP.GroupPattern.windows(n, 7),
+        AP.AxialPattern(8, n // 8) & ~AP.Dilated2DPattern(8, n // 8, 2),
+        AP.GroupPattern(AP._swin_window_ids(8, n // 8, 2, 1)),
+        AP.LocalNDPattern(8, n // 8, distance=2.5),
+        AP.LocalNDPattern(4, 2, n // 8, distance=1.5, p=1),
+        AP.LocalNDPattern(8, n // 8, distance=2, p=math.inf) | causal,
+        AP.Dilated2DPattern(8, n // 8, 3),
+        AP.LayoutPattern(torch.rand(n // 8, n // 8) < 0.4, 8) & causal,
+    ]
+
+
+@pytest.mark.parametrize("n", [16, 64, 80])
+def test_lazy_patterns(n: int):
+    assert torch.equal(AP.BandPattern((n, n), 2, 2).to_dense(), _local_1d_pattern(n, 5))
+    assert torch.equal(
+        AP.AxialPattern(8, n // 8).to_dense(),
+        AP.local_nd_pattern(8, n // 8, distance=2, p=0),
+    )
+    for pattern in _lazy_patterns(n):
+        dense = pattern.to_dense()
+        assert dense.shape == pattern.shape
+        for block_size in [1, 5, 16]:
+            rows, cols = pattern.nonzero(block_size)
+            assert torch.equal(torch.stack([rows, cols]), dense.nonzero().T)
+        if pattern.shape[1] % 8 == 0:
+            assert torch.equal(pattern.to_layout(8), AP.pattern_to_layout(dense, 8))
+        sparse_cs = pattern.to_sparse_cs()
+        ref = SparseCS(dense)
+        assert torch.equal(sparse_cs.row_offsets, ref.row_offsets)
+        assert torch.equal(sparse_cs.column_indices, ref.column_indices)
+        assert torch.equal(sparse_cs.row_indices, ref.row_indices)
+
+
+def test_lazy_pattern_grid_bounds():
+    # Only the blocks on the boundary of the grid patterns are evaluated
+    for pattern in [
+        AP.AxialPattern(32, 32),
+        AP.LocalNDPattern(32, 32, distance=4),
+        AP.Dilated2DPattern(32, 32, 2),
+    ]:
+        full, partial = pattern._blocks(16)
+        dense = pattern.to_dense()
+        assert partial.sum() <= partial.numel() // 2
+        blocks = dense.view(64, 16, 64, 16).transpose(1, 2).flatten(2)
+        assert blocks.all(-1)[full].all()
+        assert not blocks.any(-1)[~(full | partial)].any()
+
+
+def test_lazy_pattern_to_attn_bias():
+    n = 40
+    causal = AP.BandPattern((n, n), None, 0)
+    windows = AP.GroupPattern.windows(n, 8)
+    for pattern, bias_type in [
+        (AP.BandPattern((n, n), None, None), type(None)),
+        (causal, fmha.attn_bias.LowerTriangularMask),
+        (
+            AP.BandPattern((n, n), 3, 5),
+            fmha.attn_bias.LocalAttentionFromBottomRightMask,
+        ),
+        (windows, fmha.attn_bias.BlockDiagonalMask),
+        (windows & causal, fmha.attn_bias.BlockDiagonalCausalMask),
+        (
+            AP.BandPattern((n, n), 2, 0) & windows,
+            fmha.attn_bias.BlockDiagonalCausalLocalAttentionMask,
+        ),
+    ]:
+        bias = pattern.to_attn_bias()
+        assert type(bias) is bias_type
+        if bias is not None:
+            assert torch.equal(bias.materialize((n, n)) == 0, pattern.to_dense())
+    with pytest.raises(ValueError):
+        (causal | windows).to_attn_bias()
+    with pytest.raises(ValueError):
+        AP.GroupPattern(torch.arange(n) % 3).to_attn_bias()
@@ -4,10 +4,11 @@
 # LICENSE file in the root directory of this source tree.
 
 import math
-from typing import Tuple
+from typing import Dict, Tuple
 
 import pytest
 import torch
+from torch import nn
 
 from xformers.components import (
     InputProjection,
@@ -331,6 +332,77 @@ def test_inproj(proj_bias: bool, same_sizes: bool, same_settings: bool):
     _ = multi_head(query=q, key=k, value=v)
 
 
+@pytest.mark.parametrize("proj_bias", [False, True])
+@pytest.mark.parametrize("requires_head_dimension", [False, True])
+@pytest.mark.parametrize("use_separate_proj_weight", [False, True])
+def test_inproj_packed(
+    proj_bias: bool, requires_head_dimension: bool, use_separate_proj_weight: bool
+):
+    torch.manual_seed(0)
+    in_params = InputProjectionConfig(MODEL, MODEL, proj_bias)
+
+    def get_multi_head(pack_weights: bool) -> MultiHeadDispatch:
+        attention = build_attention({"name": "scaled_dot_product", "dropout": 0.0})
+        attention.requires_head_dimension = requires_head_dimension
+        in_proj = InputProjection(
+            in_params,
+            in_params,
+            in_params,
+            use_separate_proj_weight=use_separate_proj_weight,
+            pack_weights=pack_weights,
+        )
+        return MultiHeadDispatch(
+            dim_model=MODEL,
+            num_heads=4,
+            attention=attention,
+            in_proj_container=in_proj,
+        )
+
+    ref = get_multi_head(pack_weights=False)
+    multi_head = get_multi_head(pack_weights=True)
+    in_proj = multi_head.in_proj_container
+    assert (in_proj.qkv_proj is not None) == use_separate_proj_weight
+
+    # The separate weights are packed when loading them
+    multi_head.load_state_dict(ref.state_dict())
+    if use_separate_proj_weight:
+        assert "in_proj_container.qkv_proj.weight" in multi_head.state_dict()
+        assert not any("q_proj" in key for key in multi_head.state_dict())
+
+    x, y = torch.randn(BATCH, SEQ, MODEL), torch.randn(BATCH, SEQ // 2, MODEL)
+    for query, key in ((x, x), (y, x)):
+        out_ref = ref(query, key, key)
+        out = multi_head(query, key, key)
+        assert torch.allclose(out, out_ref, atol=1e-6)
+
+        out_ref.sum().backward()
+        out.sum().backward()
+
+    # The gradients of the packed weights are those of the separate ones
+    def get_grads(module: nn.Module) -> Dict[str, torch.Tensor]:
+        grads = {}
+        for name, p in module.named_parameters():
+            assert p.grad is not None, name
+            grads[name] = p.grad
+        return grads
+
+    grads, grads_ref = get_grads(multi_head), get_grads(ref)
+    for name in ("weight", "bias"):
+        names = [f"in_proj_container.{p}_proj.{name}" for p in "qkv"]
+        if use_separate_proj_weight and names[0] in grads_ref:
+            grads_ref[f"in_proj_container.qkv_proj.{name}"] = torch.cat(
+                [grads_ref.pop(n) for n in names]
+            )
+    assert grads.keys() == grads_ref.keys()
+    for name, grad in grads.items():
+        assert torch.allclose(grad, grads_ref[name], atol=1e-5), name
+
+    # Queries can be projected on their own, eg for decoding
+    assert torch.allclose(
+        in_proj.project_query(y), ref.in_proj_container.project_query(y), atol=1e-6
+    )
+
+
 @pytest.mark.parametrize("heads", [1, 4])
 @pytest.mark.parametrize("attention_name", ATTENTION_REGISTRY.keys())
 @pytest.mark.parametrize("device", DEVICES)
@@ -502,4 +574,43 @@ def test_torch_script_ability(
     assert torch.allclose(res, res_traced)
 
 
+@pytest.mark.parametrize("use_rotary_embeddings", [False, True])
+@pytest.mark.parametrize("causal", [True, False])
+@pytest.mark.parametrize(
+    "attention_name", ["favor", "linformer", "nystrom", "scaled_dot_product"]
+)
+def test_incremental_decoding(
+    attention_name: str, causal: bool, use_rotary_embeddings: bool
+):
+    torch.manual_seed(42)
+    S = 10
+
+    attention = build_attention(
+        {
+            "name": attention_name,
+            "dropout": 0.0,
+            "causal": causal,
+            "seq_len": SEQ,
+            "dim_head": MODEL // 2,
+            "num_heads": 2,
+            "num_landmarks": 4,
+        }
+    )
+    multi_head = MultiHeadDispatch(
+        dim_model=MODEL,
+        num_heads=2,
+        attention=attention,
+        use_rotary_embeddings=use_rotary_embeddings,
+    ).eval()
+    x = torch.randn(BATCH, S, MODEL)
+
+    # Token by token, each output is the one of the sequence so far
+    state = multi_head.init_state()
+    for i in range(S):
+        y, state = multi_head.step(x[:, i : i + 1], state=state)
+        ref = multi_head(x[:, : i + 1])[:, -1:]
+        assert torch.allclose(y, ref, atol=1e-5), i
+    assert state.position == S
+
+
 # TODO: way more unit tests..
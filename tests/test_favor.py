@@ -163,5 +163,70 @@ def test_favor_approximation_accuracy(feature, causal, normalize_inputs, device)
         torch.sum(approx_attention_result).backward()
 
 
+@pytest.mark.parametrize("chunk_size", [1, 7, 32, 128])
+def test_favor_causal_chunks(chunk_size):
+    torch.random.manual_seed(0)
+    B, S, F, E = 3, 50, 16, 8
+    q_prime, k_prime = torch.rand(B, S, F), torch.rand(B, S, F)
+    v = torch.randn(B, S, E)
+    for x in (q_prime, k_prime, v):
+        x.requires_grad_(True)
+
+    # Reference: quadratic causal attention with the kernel k'^T q'
+    scores = (q_prime @ k_prime.transpose(-2, -1)).tril()
+    ref = (scores @ v) / scores.sum(-1, keepdim=True)
+    grads_ref = torch.autograd.grad(ref.sum(), (q_prime, k_prime, v))
+
+    att_raw, att_norm, state = FavorAttention._causal_attention(
+        k_prime, q_prime, v, chunk_size=chunk_size
+    )
+    att = att_raw / att_norm
+    assert torch.allclose(att, ref, atol=1e-5)
+    assert torch.allclose(state.kv, k_prime.transpose(-2, -1) @ v, atol=1e-4)
+    assert torch.allclose(state.k_sum, k_prime.sum(1), atol=1e-4)
+
+    grads = torch.autograd.grad(att.sum(), (q_prime, k_prime, v))
+    for g, g_ref in zip(grads, grads_ref):
+        assert torch.allclose(g, g_ref, atol=1e-4)
+
+
+@pytest.mark.parametrize("feature", ["sm_orf", "sm_hyp", "sm_reg"])
+def test_favor_step(feature):
+    torch.random.manual_seed(0)
+    query, key, value = (torch.randn(2, 20, 10) for _ in range(3))
+
+    attention = FavorAttention(
+        dropout=0.0,
+        causal=True,
+        dim_head=10,
+        feature_map_type=FeatureMapType(feature),
+        causal_chunk_size=8,
+    )
+    ref = attention(query, key, value)
+
+    # Decode token by token, then by chunks of tokens
+    outputs, state = [], None
+    for i in range(20):
+        att, state = attention.step(
+            query[:, i : i + 1], key[:, i : i + 1], value[:, i : i + 1], state
+        )
+        outputs.append(att)
+    assert torch.allclose(torch.cat(outputs, dim=1), ref, atol=1e-5)
+
+    att_0, state = attention.step(query[:, :12], key[:, :12], value[:, :12])
+    att_1, _ = attention.step(query[:, 12:], key[:, 12:], value[:, 12:], state)
+    assert torch.allclose(torch.cat([att_0, att_1], dim=1), ref, atol=1e-5)
+
+    # The features are not redrawn in the middle of a sequence
+    attention.feature_map.iter_before_redraw = 2
+    _, state = attention.step(query[:, :1], key[:, :1], value[:, :1])
+    features = attention.feature_map.features
+    for i in range(1, 5):
+        _, state = attention.step(
+            query[:, i : i + 1], key[:, i : i + 1], value[:, i : i + 1], state
+        )
+    assert attention.feature_map.features is features
+
+
 if __name__ == "__main__":
     _plot_distribution(SMOrf)
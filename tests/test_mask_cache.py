@@ -0,0 +1,116 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import pytest
+import torch
+
+from xformers.components.attention import AttentionMask, LocalAttention, RandomAttention
+from xformers.components.attention.mask_cache import (
+    MaskCache,
+    clear_mask_cache,
+    get_causal_mask,
+    mask_cache_info,
+)
+
+cuda_only = pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+
+
+@pytest.fixture(autouse=True)
+def _clear_mask_cache():
+    clear_mask_cache()
+    yield
+    clear_mask_cache()
+
+
+def test_mask_cache_lru():
+    mask_bytes = 16 * 16 * 4
+    cache = MaskCache(max_bytes=2 * mask_bytes)
+    calls = []
+
+    def create(seq_len):
+        def _create(device):
+            calls.append(seq_len)
+            return AttentionMask.make_causal(seq_len, device=device)
+
+        return _create
+
+    cpu = torch.device("cpu")
+    m0 = cache.get(("causal", 16, 0), cpu, create(16))
+    assert cache.get(("causal", 16, 0), cpu, create(16)) is m0
+    cache.get(("causal", 16, 1), cpu, create(16))
+    assert cache.info()[:4] == (1, 2, 2, 2 * mask_bytes)
+    assert cache.info().hit_rate == 1 / 3
+
+    # The least recently used mask is evicted to stay under the size limit
+    cache.get(("causal", 16, 0), cpu, create(16))
+    cache.get(("causal", 16, 2), cpu, create(16))
+    assert cache.info().num_masks == 2
+    assert cache.get(("causal", 16, 0), cpu, create(16)) is m0
+    cache.get(("causal", 16, 1), cpu, create(16))
+    assert len(calls) == 4
+
+    # Masks larger than the cache are not kept
+    cache.get(("causal", 32), cpu, create(32))
+    cache.get(("causal", 32), cpu, create(32))
+    assert calls[-2:] == [32, 32]
+    assert cache.nbytes <= cache.max_bytes
+
+    cache.clear()
+    assert cache.info()[:4] == (0, 0, 0, 0)
+
+
+def test_get_causal_mask():
+    mask = get_causal_mask(8, 4)
+    assert mask.is_causal
+    assert (mask.to_bool()[0] == torch.ones(8, 4, dtype=torch.bool).tril()).all()
+    assert get_causal_mask(8, 4) is mask
+    assert get_causal_mask(8, 4, dtype=torch.float16) is not mask
+    assert mask_cache_info()[:3] == (1, 2, 2)
+
+
+@pytest.mark.parametrize("force_sparsity", [False, True])
+def test_local_attention_shares_masks(force_sparsity: bool):
+    layers = [
+        LocalAttention(window_size=5, force_sparsity=force_sparsity) for _ in range(3)
+    ]
+    for seq_len in (32, 64, 32, 64):
+        x = torch.rand(2, seq_len, 8)
+        for layer in layers:
+            layer(x, x, x)
+
+    # One mask per sequence length, built once for all the layers
+    assert mask_cache_info().num_masks == 2
+    assert mask_cache_info().misses == 2
+    assert layers[0].attention_mask is layers[1].attention_mask
+
+
+def test_random_attention_constant_masks():
+    layer = RandomAttention(dropout=0.0, r=0.3, force_sparsity=True)
+    other = RandomAttention(dropout=0.0, r=0.3, force_sparsity=True)
+    x32, x64 = torch.rand(1, 32, 8), torch.rand(1, 64, 8)
+
+    layer(x32, x32, x32)
+    mask = layer.rand_attention_mask.to_dense()
+    layer(x64, x64, x64)
+    assert layer.rand_attention_mask.shape[1] == 64
+    layer(x32, x32, x32)
+    assert torch.equal(layer.rand_attention_mask.to_dense(), mask)
+    assert mask_cache_info().misses == 2
+
+    # Each layer has its own random mask
+    other(x32, x32, x32)
+    assert mask_cache_info().misses == 3
+    assert not torch.equal(other.rand_attention_mask.to_dense(), mask)
+
+
+@cuda_only
+def test_mask_cache_devices():
+    cpu_mask = get_causal_mask(16)
+    cuda_mask = get_causal_mask(16, device=torch.device("cuda"))
+    assert cuda_mask.device.type == "cuda"
+    assert torch.equal(cuda_mask.values.cpu(), cpu_mask.values)
+    assert get_causal_mask(16, device=torch.device("cuda", 0)) is cuda_mask
+    assert mask_cache_info().num_masks == 2
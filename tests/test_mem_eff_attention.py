@@ -1255,7 +1255,11 @@ def test_grad_checkpointing(
     x.mean().backward()
 
 
-@pytest.mark.parametrize("op", ALL_FW_OPS, ids=[op.NAME for op in ALL_FW_OPS])
+@pytest.mark.parametrize(
+    "op",
+    [op for op in ALL_FW_OPS if "cpu" not in op.SUPPORTED_DEVICES],
+    ids=[op.NAME for op in ALL_FW_OPS if "cpu" not in op.SUPPORTED_DEVICES],
+)
 def test_unsupported_cpu(op: Type[fmha.AttentionFwOpBase]):
     q = torch.empty([1, 1, 1, 32])
     with pytest.raises(ValueError):
@@ -1382,6 +1386,185 @@ def test_attn_bias_blockdiag_batched() -> None:
         assert_allclose(q1, q2)
 
 
+@pytest.mark.parametrize(
+    "bias_type, block_bias",
+    [
+        (fmha.attn_bias.BlockDiagonalMask, None),
+        (fmha.attn_bias.BlockDiagonalCausalMask, fmha.attn_bias.LowerTriangularMask()),
+        (
+            fmha.attn_bias.BlockDiagonalCausalFromBottomRightMask,
+            fmha.attn_bias.LowerTriangularFromBottomRightMask(),
+        ),
+    ],
+)
+def test_attn_bias_blockdiag_materialize(bias_type, block_bias) -> None:
+    q_seqlen, kv_seqlen = [3, 1, 4, 2], [5, 2, 4, 3]
+    attn_bias = bias_type.from_seqlens(q_seqlen, kv_seqlen)
+    as_tensor = attn_bias.materialize((2, 10, 14))
+    assert as_tensor.shape == (2, 10, 14)
+    expected = torch.full([10, 14], -math.inf)
+    for (q_start, q_end), (k_start, k_end) in zip(
+        attn_bias.q_seqinfo.intervals(), attn_bias.k_seqinfo.intervals()
+    ):
+        shape = (q_end - q_start, k_end - k_start)
+        expected[q_start:q_end, k_start:k_end] = (
+            torch.zeros(shape) if block_bias is None else block_bias.materialize(shape)
+        )
+    assert_allclose(as_tensor[1], expected)
+
+    as_bool = attn_bias.materialize((10, 14), dtype=torch.bool)
+    assert as_bool.dtype == torch.bool
+    assert torch.equal(as_bool, expected != -math.inf)
+    rows = attn_bias.materialize((2, 10, 14), q_range=(3, 8))
+    assert rows.shape == (2, 5, 14)
+    assert_allclose(rows[0], expected[3:8])
+
+
+def test_attn_bias_paged_materialize() -> None:
+    page_size, kv_padding = 4, 12
+    q_seqlen, kv_seqlen = [2, 1, 3], [7, 12, 3]
+    attn_bias = fmha.attn_bias.BlockDiagonalCausalWithOffsetPaddedKeysMask.from_seqlens(
+        q_seqlen, kv_padding, kv_seqlen, device=torch.device("cpu")
+    )
+    block_tables = torch.tensor([[5, 1, 7], [0, 8, 2], [4, 3, 6]])
+    paged_bias = attn_bias.make_paged(
+        block_tables,
+        page_size,
+        paged_type=fmha.attn_bias.PagedBlockDiagonalCausalWithOffsetPaddedKeysMask,
+    )
+    as_tensor = attn_bias.materialize((6, 36))
+    assert isinstance(
+        paged_bias, fmha.attn_bias.PagedBlockDiagonalCausalWithOffsetPaddedKeysMask
+    )
+    paged = paged_bias.materialize((6, 36))
+    assert paged.shape == (6, 36)
+    # Logical key `i` of sequence `b` lives in physical page `block_tables[b, i // page_size]`
+    physical_keys = (
+        block_tables[:, :, None] * page_size + torch.arange(page_size)
+    ).flatten()
+    assert_allclose(paged[:, physical_keys], as_tensor)
+
+    rows = paged_bias.materialize((6, 36), dtype=torch.bool, q_range=(1, 4))
+    assert torch.equal(rows, paged[1:4] != -math.inf)
+
+
+def test_attn_bias_from_seqlens_tensor() -> None:
+    device = torch.device("cpu")
+    q_seqlen, kv_seqlen, kv_seqstarts = [3, 1, 4], [5, 2, 4], [0, 6, 9, 14]
+    q_seqlen_t, kv_seqlen_t = torch.tensor(q_seqlen), torch.tensor(kv_seqlen)
+    constructors = [
+        lambda q, k: fmha.attn_bias.BlockDiagonalMask.from_seqlens(q, k, device=device),
+        lambda q, k: fmha.attn_bias.BlockDiagonalCausalWithOffsetPaddedKeysMask.from_seqlens(
+            q, 6, k, device=device
+        ),
+        lambda q, k: fmha.attn_bias.BlockDiagonalGappyKeysMask.from_seqlens(
+            q,
+            kv_seqstarts if isinstance(k, list) else torch.tensor(kv_seqstarts),
+            k,
+            device=device,
+        ),
+    ]
+    for constructor in constructors:
+        ref = constructor(q_seqlen, kv_seqlen)
+        bias = constructor(q_seqlen_t, kv_seqlen_t)
+        block_diagonal_types = (
+            fmha.attn_bias.BlockDiagonalMask,
+            fmha.attn_bias.BlockDiagonalPaddedKeysMask,
+            fmha.attn_bias.BlockDiagonalGappyKeysMask,
+        )
+        assert isinstance(ref, block_diagonal_types)
+        assert isinstance(bias, block_diagonal_types)
+        for seqinfo, ref_seqinfo in [
+            (bias.q_seqinfo, ref.q_seqinfo),
+            (bias.k_seqinfo, ref.k_seqinfo),
+        ]:
+            # Python-side metadata is only computed when needed
+            assert "seqstart_py" not in seqinfo.__dict__
+            assert torch.equal(seqinfo.seqstart, ref_seqinfo.seqstart)
+            assert seqinfo.seqstart.dtype == torch.int32
+            assert seqinfo.seqstart_py == ref_seqinfo.seqstart_py
+            assert seqinfo.min_seqlen == ref_seqinfo.min_seqlen
+            assert seqinfo.max_seqlen == ref_seqinfo.max_seqlen
+        shape = (sum(q_seqlen), ref.k_seqinfo.seqstart_py[-1])
+        assert torch.equal(bias.materialize(shape), ref.materialize(shape))
+
+    # Values can be provided to avoid computing them
+    bias = fmha.attn_bias.BlockDiagonalMask.from_seqlens(q_seqlen_t, device=device)
+    bias.q_seqinfo.max_seqlen = 4
+    assert bias.q_seqinfo.max_seqlen == 4
+    assert "seqstart_py" not in bias.q_seqinfo.__dict__
+    assert bias.to(device).q_seqinfo is bias.q_seqinfo
+
+
+@pytest.mark.parametrize("paged", [False, True])
+def test_attn_bias_padded_keys_update_inplace(paged: bool) -> None:
+    torch.manual_seed(0)
+    device = torch.device("cpu")
+    bias_type = fmha.attn_bias.BlockDiagonalCausalWithOffsetPaddedKeysMask
+    padding, page_size, num_heads, K = 16, 4, 2, 32
+    block_tables = torch.randperm(4 * padding // page_size).reshape(4, -1)
+
+    def make_bias(q_seqlen, kv_seqlen):
+        bias = bias_type.from_seqlens(q_seqlen, padding, kv_seqlen, device=device)
+        if paged:
+            bias = bias.make_paged(
+                block_tables,
+                page_size,
+                paged_type=fmha.attn_bias.PagedBlockDiagonalCausalWithOffsetPaddedKeysMask,
+            )
+        return bias
+
+    def check(bias, q_seqlen, kv_seqlen):
+        ref = make_bias(q_seqlen, kv_seqlen)
+        for seqinfo, ref_seqinfo in [
+            (bias.q_seqinfo, ref.q_seqinfo),
+            (bias.k_seqinfo, ref.k_seqinfo),
+        ]:
+            assert torch.equal(seqinfo.seqstart, ref_seqinfo.seqstart)
+            assert seqinfo.seqstart_py == ref_seqinfo.seqstart_py
+            assert seqinfo.min_seqlen == ref_seqinfo.min_seqlen
+            assert seqinfo.max_seqlen == ref_seqinfo.max_seqlen
+        assert torch.equal(bias.k_seqinfo.seqlen, ref.k_seqinfo.seqlen)
+        assert list(bias.k_seqinfo.seqlen_py) == list(ref.k_seqinfo.seqlen_py)
+        q = torch.randn([1, sum(q_seqlen), num_heads, K])
+        kv = torch.randn([1, 4 * padding, num_heads, K])
+        assert_allclose(
+            fmha.memory_efficient_attention_forward(q, kv, kv, bias),
+            fmha.memory_efficient_attention_forward(q, kv, kv, ref),
+        )
+
+    bias = make_bias([3, 5, 1, 2], [3, 5, 1, 2])
+    seqlen_buffer = bias.k_seqinfo.seqlen
+    seqstart_buffer = bias.q_seqinfo.seqstart
+    bias.advance()
+    check(bias, [1] * 4, [4, 6, 2, 3])
+    bias.advance(2)
+    check(bias, [2] * 4, [6, 8, 4, 5])
+    bias.retire_sequences([1])
+    bias.advance(torch.tensor([1, 1, 1, 1]))
+    check(bias, [1] * 4, [7, 0, 5, 6])
+    bias.append_sequences([1], [11])
+    bias.advance(5)
+    check(bias, [5] * 4, [12, 16, 10, 11])
+    # The bias still uses the same buffers
+    assert bias.k_seqinfo.seqlen is seqlen_buffer
+    assert bias.q_seqinfo.seqstart is seqstart_buffer
+
+    # The keys must fit in the padding
+    with pytest.raises(ValueError):
+        bias.advance(1)
+    check(bias, [5] * 4, [12, 16, 10, 11])
+
+    # Sequences appended without any key yet still grow
+    bias.retire_sequences([1, 2])
+    bias.append_sequences([1], [0])
+    bias.advance(3)
+    check(bias, [3] * 4, [15, 3, 0, 14])
+    bias.append_sequences(torch.tensor([2]), torch.tensor([0]))
+    bias.advance(1)
+    check(bias, [1] * 4, [16, 4, 1, 15])
+
+
 def test_attn_bias_blockdiag_crossattn_causal() -> None:
     # Q / KV have different seqlen
     list_q = [
@@ -2162,6 +2345,156 @@ def test_dispatch_decoding_bmghk() -> None:
     ), "Should not use SplitK if B is big"
 
 
+def test_dispatch_cpu() -> None:
+    q = torch.empty([1, 8, 4, 64])
+    kv = torch.empty([1, 256, 4, 64])
+    inp = fmha.Inputs(q, kv, kv, attn_bias=fmha.attn_bias.LowerTriangularMask())
+    assert fmha.dispatch._dispatch_fw(inp, False) is fmha.cpu.FwOp
+    assert fmha.dispatch._dispatch_fw(inp, True) is fmha.cpu.FwOp
+    assert fmha.dispatch._dispatch_bw(inp, varlen_lse_packed=None) is fmha.cpu.BwOp
+
+
+def test_dispatch_cache() -> None:
+    fmha._clear_dispatch_cache()
+    q = torch.empty([1, 8, 4, 64])
+    kv = torch.empty([1, 256, 4, 64])
+    causal = fmha.attn_bias.LowerTriangularMask()
+    for _ in range(3):
+        inp = fmha.Inputs(q, kv, kv, attn_bias=causal)
+        assert fmha.dispatch._dispatch_fw(inp, False) is fmha.cpu.FwOp
+    info = fmha._get_dispatch_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (2, 1, 1)
+
+    # Different signatures are dispatched separately
+    fmha.dispatch._dispatch_fw(fmha.Inputs(q, kv, kv, attn_bias=causal), True)
+    fmha.dispatch._dispatch_fw(fmha.Inputs(q, kv, kv), False)
+    fmha.dispatch._dispatch_fw(fmha.Inputs(q, kv, kv, scale=0.5), False)
+    fmha.dispatch._dispatch_fw(fmha.Inputs(q.half(), kv.half(), kv.half()), False)
+    fmha.dispatch._dispatch_bw(fmha.Inputs(q, kv, kv), varlen_lse_packed=None)
+    kv_t = torch.empty([1, 4, 256, 64]).transpose(1, 2)
+    fmha.dispatch._dispatch_fw(fmha.Inputs(q, kv_t, kv_t), False)
+    for q_seqlen, kv_seqlen in [([8], [256]), ([4, 4], [128, 128])]:
+        bias = fmha.attn_bias.BlockDiagonalMask.from_seqlens(q_seqlen, kv_seqlen)
+        fmha.dispatch._dispatch_fw(fmha.Inputs(q, kv, kv, attn_bias=bias), False)
+    info = fmha._get_dispatch_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (2, 9, 9)
+
+    # Unsupported inputs are not cached
+    with pytest.raises(NotImplementedError):
+        fmha.dispatch._dispatch_fw(fmha.Inputs(q, kv.half(), kv.half()), False)
+    assert fmha._get_dispatch_cache_info().currsize == 9
+
+    # Least recently used entries are evicted first
+    try:
+        fmha._set_dispatch_cache_maxsize(2)
+        assert fmha._get_dispatch_cache_info().currsize == 2
+        fmha.dispatch._dispatch_fw(fmha.Inputs(q, kv, kv, attn_bias=causal), False)
+        assert fmha._get_dispatch_cache_info().currsize == 2
+    finally:
+        fmha._set_dispatch_cache_maxsize(256)
+
+    fmha._set_use_fa3(fmha._get_use_fa3())
+    info = fmha._get_dispatch_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (0, 0, 0)
+
+
+def test_dispatch_cache_no_sync() -> None:
+    fmha._clear_dispatch_cache()
+    bias = fmha.attn_bias.BlockDiagonalPaddedKeysMask.from_seqlens(
+        q_seqlen=torch.ones([4], dtype=torch.int32),
+        kv_padding=64,
+        kv_seqlen=torch.tensor([3, 5, 0, 7]),
+    )
+    bias.q_seqinfo.min_seqlen = bias.q_seqinfo.max_seqlen = 1
+    q = torch.empty([1, 4, 2, 32])
+    kv = torch.empty([1, 256, 2, 32])
+    for _ in range(3):
+        inp = fmha.Inputs(q, kv, kv, attn_bias=bias)
+        assert fmha.dispatch._dispatch_fw(inp, False) is fmha.cpu.FwOp
+        bias.advance(1)
+    info = fmha._get_dispatch_cache_info()
+    assert (info.hits, info.misses) == (2, 1)
+
+    # The python-side lengths were never copied from the tensors
+    assert sorted(bias.q_seqinfo.__dict__) == ["max_seqlen", "min_seqlen", "seqstart"]
+    assert sorted(bias.k_seqinfo.__dict__) == [
+        "_active",
+        "padding",
+        "seqlen",
+        "seqstart",
+    ]
+
+    # Each lazy field is computed on its own
+    assert bias.k_seqinfo.max_seqlen == 10
+    assert "seqlen_py" not in bias.k_seqinfo.__dict__
+    assert bias.q_seqinfo.seqstart_py == [0, 1, 2, 3, 4]
+    assert bias.k_seqinfo.seqlen_py == [6, 8, 0, 10]
+
+    # Varlen batches only differ by the alignment of queries and keys
+    fmha._clear_dispatch_cache()
+    q = torch.empty([1, 16, 2, 32])
+    for seqlens in [[3, 5, 8], [5, 3, 8], [8, 5, 3]]:
+        varlen_bias = fmha.attn_bias.BlockDiagonalCausalMask.from_seqlens(seqlens)
+        inp = fmha.Inputs(q, q, q, attn_bias=varlen_bias)
+        assert fmha.dispatch._dispatch_fw(inp, False) is fmha.cpu.FwOp
+    varlen_bias = fmha.attn_bias.BlockDiagonalCausalMask.from_seqlens(
+        [3, 5, 8], [8, 5, 3]
+    )
+    fmha.dispatch._dispatch_fw(fmha.Inputs(q, q, q, attn_bias=varlen_bias), False)
+    info = fmha._get_dispatch_cache_info()
+    assert (info.hits, info.misses) == (2, 2)
+
+
+def test_cpu_partial() -> None:
+    torch.manual_seed(0)
+    q = torch.randn([2, 300, 3, 32])
+    k = torch.randn([2, 700, 3, 32])
+    v = torch.randn([2, 700, 3, 16])
+    attn_bias = fmha.attn_bias.LowerTriangularFromBottomRightMask()
+    out, lse = fmha.memory_efficient_attention_partial(q, k, v, attn_bias)
+    assert out.dtype == torch.float32
+    ref = ref_attention_bmhk_for_test(q, k, v, attn_bias)
+    assert_allclose(out, ref, atol=2e-5)
+    ref_lse = (
+        (q.transpose(1, 2) @ k.permute(0, 2, 3, 1) / 32**0.5)
+        + attn_bias.materialize((1, 1, 300, 700))
+    ).logsumexp(-1)
+    assert_allclose(lse, ref_lse, atol=2e-5)
+
+
+def test_cpu_garbage_in_padding() -> None:
+    # The padding of the keys/values is never read, even if it holds NaN
+    torch.manual_seed(0)
+    padding, kv_seqlen, q_seqlen = 16, [5, 16, 1], [3, 2, 1]
+    attn_bias = fmha.attn_bias.BlockDiagonalCausalWithOffsetPaddedKeysMask.from_seqlens(
+        q_seqlen, padding, kv_seqlen, device=torch.device("cpu")
+    )
+    q = torch.randn([1, sum(q_seqlen), 2, 32], requires_grad=True)
+    k = torch.randn([1, padding * len(kv_seqlen), 2, 32])
+    v = torch.randn([1, padding * len(kv_seqlen), 2, 16])
+    is_padding = attn_bias.materialize((q.shape[1], k.shape[1])).isinf().all(0)
+    k_nan, v_nan = [
+        x.masked_fill(is_padding[:, None, None], math.nan).requires_grad_(True)
+        for x in (k, v)
+    ]
+    k, v = [
+        x.masked_fill(is_padding[:, None, None], 0.0).requires_grad_(True)
+        for x in (k, v)
+    ]
+    op = fmha.MemoryEfficientAttentionCpuOp
+    out = fmha.memory_efficient_attention(q, k_nan, v_nan, attn_bias, op=op)
+    ref = fmha.memory_efficient_attention(q, k, v, attn_bias, op=op)
+    assert out.isfinite().all()
+    assert_allclose(out, ref)
+
+    grad = torch.randn_like(out)
+    grads = torch.autograd.grad(out, (q, k_nan, v_nan), grad)
+    grads_ref = torch.autograd.grad(ref, (q, k, v), grad)
+    for name, g, g_ref in zip("qkv", grads, grads_ref):
+        assert g.isfinite().all(), name
+        assert_allclose(g, g_ref, msg=f"d{name}")
+
+
 shapes_triton_splitk = [
     (1, 8, 2**16, 1, 128, 128),
     (1, 4, 2**16, 1, 128, 128),
@@ -3294,6 +3627,209 @@ def test_merge_attentions_against_ref(
         )
 
 
+@pytest.mark.parametrize("bmghk", (False, True))
+@pytest.mark.parametrize("grad_var", ("lse", "attn", None))
+def test_attention_accumulator(bmghk: bool, grad_var: Optional[str]) -> None:
+    torch.manual_seed(0)
+    split_k, B, M, G, N_H_L, D_H = 5, 2, 17, 2 if bmghk else 1, 3, 16
+    attn_split = torch.randn([split_k, B, M, G, N_H_L, D_H])
+    lse_split = torch.randn([split_k, B, G, N_H_L, M]) * 10
+    # Some queries don't attend to any key in some chunks
+    lse_split[0, :, :, :, :3] = -math.inf
+    lse_split[1:3, :, :, :, 1] = -math.inf
+    if not bmghk:
+        attn_split = attn_split[:, :, :, 0]
+        lse_split = lse_split[:, :, 0]
+    attn_split.requires_grad_(grad_var is not None)
+    lse_split.requires_grad_(grad_var is not None)
+
+    attn_out_ref, lse_out_ref = _merge_attentions_ref(attn_split, lse_split)
+    accumulator = fmha.AttentionAccumulator(output_dtype=torch.float16)
+    for attn, lse in zip(attn_split, lse_split):
+        accumulator.add(attn, lse)
+    attn_out, lse_out = accumulator.finalize()
+    assert lse_out is not None
+    assert attn_out.dtype == torch.float16 and accumulator.num_chunks == split_k
+    torch.testing.assert_close(attn_out.float(), attn_out_ref, rtol=1e-3, atol=1e-3)
+    torch.testing.assert_close(lse_out, lse_out_ref, rtol=1e-4, atol=1e-4)
+    # On CPU, merge_attentions is implemented with the accumulator
+    attn_out2, _ = fmha.merge_attentions(attn_split, lse_split, write_lse=True)
+    torch.testing.assert_close(attn_out2, attn_out_ref, rtol=1e-4, atol=1e-4)
+
+    if grad_var is not None:
+        out, out_ref = (
+            (attn_out.float(), attn_out_ref)
+            if grad_var == "attn"
+            else (lse_out, lse_out_ref)
+        )
+        grad = torch.randn_like(out_ref)
+        inputs = [attn_split, lse_split]
+        grads = torch.autograd.grad(out, inputs, grad, allow_unused=True)
+        grads_ref = torch.autograd.grad(out_ref, inputs, grad, allow_unused=True)
+        for x, g, g_ref in zip(inputs, grads, grads_ref):
+            zeros = torch.zeros_like(x)
+            torch.testing.assert_close(
+                zeros if g is None else g,
+                zeros if g_ref is None else g_ref,
+                rtol=1e-3,
+                atol=1e-3,
+            )
+
+
+def _chunked_attention_inputs(bias_type):
+    B, M, N, H, K = 2, 37, 101, 3, 16
+    if bias_type in (None, torch.Tensor) or not issubclass(
+        bias_type, fmha.attn_bias.VARLEN_BIASES
+    ):
+        q = torch.randn([B, M, H, K])
+        k = torch.randn([B, N, H, K])
+        v = torch.randn([B, N, H, K])
+        if bias_type is torch.Tensor:
+            return q, k, v, torch.randn([B, H, M, N])
+        if bias_type is fmha.attn_bias.LocalAttentionFromBottomRightMask:
+            return q, k, v, bias_type(10, 3)
+        return q, k, v, None if bias_type is None else bias_type()
+    q_seqlen, kv_seqlen = [5, 20, 12], [30, 45, 31]
+    q = torch.randn([1, sum(q_seqlen), H, K])
+    if bias_type is fmha.attn_bias.PagedBlockDiagonalCausalWithOffsetPaddedKeysMask:
+        page_size, pages_per_row = 16, 3
+        block_tables = torch.randperm(9, dtype=torch.int32).view(3, pages_per_row)
+        k, v = torch.randn([2, 1, 9 * page_size, H, K])
+        return (
+            q,
+            k,
+            v,
+            bias_type.from_seqlens(
+                q_seqlen, kv_seqlen, block_tables, page_size, device="cpu"
+            ),
+        )
+    if bias_type is fmha.attn_bias.BlockDiagonalCausalWithOffsetPaddedKeysMask:
+        k, v = torch.randn([2, 1, 3 * 50, H, K])
+        return (
+            q,
+            k,
+            v,
+            bias_type.from_seqlens(q_seqlen, 50, kv_seqlen, device="cpu"),
+        )
+    k, v = torch.randn([2, 1, sum(kv_seqlen), H, K])
+    return q, k, v, bias_type.from_seqlens(q_seqlen, kv_seqlen, device="cpu")
+
+
+@pytest.mark.parametrize(
+    "bias_type",
+    [
+        None,
+        torch.Tensor,
+        fmha.attn_bias.LowerTriangularMask,
+        fmha.attn_bias.LowerTriangularFromBottomRightMask,
+        fmha.attn_bias.LocalAttentionFromBottomRightMask,
+        fmha.attn_bias.BlockDiagonalMask,
+        fmha.attn_bias.BlockDiagonalCausalFromBottomRightMask,
+        fmha.attn_bias.BlockDiagonalCausalWithOffsetPaddedKeysMask,
+        fmha.attn_bias.PagedBlockDiagonalCausalWithOffsetPaddedKeysMask,
+    ],
+    ids=lambda x: "none" if x is None else x.__name__,
+)
+def test_chunked_attention(bias_type) -> None:
+    torch.manual_seed(0)
+    q, k, v, attn_bias = _chunked_attention_inputs(bias_type)
+    op = fmha.MemoryEfficientAttentionCpuOp
+    ref = xformers.ops.memory_efficient_attention_forward(q, k, v, attn_bias, op=op[0])
+    out = fmha.chunked_memory_efficient_attention(
+        q, k, v, attn_bias, kv_chunk=16, q_chunk=9, op=op
+    )
+    assert_allclose(out, ref, atol=1e-5, rtol=1e-5)
+
+    q, k, v = [x.requires_grad_(True) for x in (q, k, v)]
+    grad = torch.randn_like(ref)
+    out = fmha.chunked_memory_efficient_attention(
+        q, k, v, attn_bias, kv_chunk=16, q_chunk=9, op=op
+    )
+    grads = torch.autograd.grad(out, (q, k, v), grad)
+    ref = xformers.ops.memory_efficient_attention(q, k, v, attn_bias, op=op)
+    grads_ref = torch.autograd.grad(ref, (q, k, v), grad)
+    for name, g, g_ref in zip("qkv", grads, grads_ref):
+        assert_allclose(g, g_ref, atol=1e-5, rtol=1e-5, msg=f"d{name}")
+
+
+@pytest.mark.parametrize("q_chunk", [None, 16, 24])
+def test_chunked_attention_causal_chunks(q_chunk) -> None:
+    # The causally masked chunks use a structured bias instead of a tensor
+    torch.manual_seed(0)
+    q, k, v, attn_bias = _chunked_attention_inputs(fmha.attn_bias.LowerTriangularMask)
+    chunker = fmha._AttentionChunker(q, k, v, attn_bias, 16, q_chunk, False)
+    tensor_biases: List[Tuple[int, int]] = []
+    for q0, q1 in chunker.query_chunks():
+        assert q1 - q0 <= (q_chunk or 16)
+        for k0, _, _, _, bias in chunker.key_chunks(q[:, q0:q1], q0):
+            if isinstance(bias, torch.Tensor):
+                tensor_biases.append((q0, k0))
+    # Only the chunks not aligned on the diagonal need a tensor
+    if q_chunk == 24:
+        assert tensor_biases == [(0, 0), (0, 16), (24, 16), (24, 32)]
+    else:
+        assert tensor_biases == [(32, 32)]
+
+    op = fmha.MemoryEfficientAttentionCpuOp
+    ref = xformers.ops.memory_efficient_attention_forward(q, k, v, attn_bias, op=op[0])
+    out = fmha.chunked_memory_efficient_attention(
+        q, k, v, attn_bias, kv_chunk=16, q_chunk=q_chunk, op=op
+    )
+    assert_allclose(out, ref, atol=1e-5, rtol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "bias_type",
+    [
+        fmha.attn_bias.LowerTriangularMask,
+        fmha.attn_bias.LowerTriangularFromBottomRightMask,
+        fmha.attn_bias.LocalAttentionFromBottomRightMask,
+        fmha.attn_bias.BlockDiagonalMask,
+        fmha.attn_bias.BlockDiagonalCausalFromBottomRightMask,
+        fmha.attn_bias.BlockDiagonalCausalWithOffsetPaddedKeysMask,
+        fmha.attn_bias.PagedBlockDiagonalCausalWithOffsetPaddedKeysMask,
+    ],
+    ids=lambda x: x.__name__,
+)
+def test_attn_bias_flops(bias_type) -> None:
+    q, k, v, attn_bias = _chunked_attention_inputs(bias_type)
+    v = v[..., :8]
+    B, M, H, K = q.shape
+    mask = attn_bias.materialize((M, k.shape[1])) == 0
+    num_pairs = int(mask.sum())
+    assert attn_bias.flops(q.shape, k.shape, v.shape) == 2 * B * H * num_pairs * (K + 8)
+    num_keys = int(mask.any(0).sum())
+    assert attn_bias.bytes_accessed(q.shape, k.shape, v.shape, 4) == 4 * B * (
+        M * H * (K + 8) + num_keys * H * (K + 8)
+    )
+    # BMGHK
+    G = 2
+    q, k, v = [x[:, :, None].expand(-1, -1, G, -1, -1) for x in (q, k, v)]
+    assert attn_bias.flops(q.shape, k.shape, v.shape) == 2 * B * G * H * num_pairs * (
+        K + 8
+    )
+
+
+def test_attn_bias_flops_closed_form(monkeypatch) -> None:
+    # Counted from the python-side lengths, without building any range
+    def no_ranges(*args, **kwargs):
+        raise AssertionError("Should not build the key ranges")
+
+    monkeypatch.setattr(fmha.attn_bias, "_get_key_ranges", no_ranges)
+    seqlens = [4096] * 64
+    causal_bias = fmha.attn_bias.BlockDiagonalCausalMask.from_seqlens(seqlens)
+    shape = (1, sum(seqlens), 1, 64)
+    assert causal_bias.flops(shape, shape, shape) == 2 * 64 * (4096 * 4097 // 2) * 128
+    local_bias = fmha.attn_bias.BlockDiagonalCausalLocalAttentionPaddedKeysMask.from_seqlens_local(
+        q_seqlen=[1, 3], kv_padding=8, kv_seqlen=[5, 8], window_size=4
+    )
+    q_shape, k_shape = (1, 4, 1, 64), (1, 16, 1, 64)
+    assert local_bias.flops(q_shape, k_shape, k_shape) == 2 * (4 + 4 + 4 + 4) * 128
+    assert local_bias.bytes_accessed(q_shape, k_shape, k_shape, 1) == (
+        2 * 4 * 64 + (4 + 6) * 128
+    )
+
+
 def _merge_attentions_ref(attn_split, lse_split):
     """
     attn_split: [split_k, B, M, (G,) H, Kq]
@@ -0,0 +1,135 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import pytest
+import torch
+
+from xformers.components import InputProjection
+from xformers.factory import xFormer, xFormerConfig
+
+BATCH = 2
+SEQ = 16
+EMB = 32
+VOCAB = 64
+
+
+def _config(residual_norm_style: str, self_attention: str, use_rotary: bool):
+    base = {
+        "dim_model": EMB,
+        "residual_norm_style": residual_norm_style,
+        "use_triton": False,
+        "feedforward_config": {
+            "name": "MLP",
+            "dropout": 0.0,
+            "activation": "gelu",
+            "hidden_layer_multiplier": 2,
+        },
+        "position_encoding_config": {
+            "name": "vocab",
+            "seq_len": SEQ,
+            "vocab_size": VOCAB,
+        },
+    }
+    attention = {"dropout": 0.0, "seq_len": SEQ}
+    return [
+        {
+            **base,
+            "block_type": "encoder",
+            "num_layers": 2,
+            "multi_head_config": {
+                "num_heads": 4,
+                "residual_dropout": 0.0,
+                "attention": {"name": "scaled_dot_product", **attention},
+            },
+        },
+        {
+            **base,
+            "block_type": "decoder",
+            "num_layers": 2,
+            "multi_head_config_masked": {
+                "num_heads": 4,
+                "residual_dropout": 0.0,
+                "use_rotary_embeddings": use_rotary,
+                "attention": {"name": self_attention, "causal": True, **attention},
+            },
+            "multi_head_config_cross": {
+                "num_heads": 4,
+                "residual_dropout": 0.0,
+                "attention": {"name": "scaled_dot_product", **attention},
+            },
+        },
+    ]
+
+
+@pytest.mark.parametrize("use_rotary", [False, True])
+@pytest.mark.parametrize("self_attention", ["scaled_dot_product", "favor"])
+@pytest.mark.parametrize("residual_norm_style", ["pre", "post", "deepnorm"])
+def test_incremental_decoding(
+    residual_norm_style: str, self_attention: str, use_rotary: bool
+):
+    torch.manual_seed(0)
+    model = xFormer.from_config(
+        xFormerConfig(_config(residual_norm_style, self_attention, use_rotary))
+    ).eval()
+
+    src = torch.randint(0, VOCAB, (BATCH, SEQ))
+    tgt = torch.randint(0, VOCAB, (BATCH, SEQ))
+
+    # Count the memory projections
+    cross_projections = []
+    for decoder in model.decoders:
+        cross_proj = next(
+            m for m in decoder.wrap_cross.modules() if isinstance(m, InputProjection)
+        )
+        project_key_value = cross_proj.project_key_value
+
+        def counting_project_key_value(*args, project_key_value=project_key_value):
+            cross_projections.append(None)
+            return project_key_value(*args)
+
+        cross_proj.project_key_value = counting_project_key_value  # type: ignore
+
+    with torch.no_grad():
+        ref = model(src, tgt)
+        cross_projections.clear()
+
+        state = None
+        outputs = []
+        for i in range(SEQ):
+            y, state = model.step(tgt[:, i : i + 1], src=src, state=state)
+            outputs.append(y)
+
+    # The memory is projected once per decoder block for the whole sequence
+    assert len(cross_projections) == len(model.decoders)
+    assert torch.allclose(torch.cat(outputs, dim=1), ref, atol=1e-5, rtol=1e-4)
+
+    # Prefill a prompt, then decode one token at a time
+    with torch.no_grad():
+        y, state = model.step(tgt[:, : SEQ // 2], src=src)
+        y_next, _ = model.step(tgt[:, SEQ // 2 : SEQ // 2 + 1], state=state)
+    assert torch.allclose(y, ref[:, : SEQ // 2], atol=1e-5, rtol=1e-4)
+    assert torch.allclose(y_next, ref[:, SEQ // 2 : SEQ // 2 + 1], atol=1e-5, rtol=1e-4)
+
+
+@pytest.mark.parametrize("stacks", ["encoder", "encoder+decoder"])
+def test_forward_plan(stacks: str):
+    torch.manual_seed(0)
+    config = [
+        c
+        for c in _config("pre", "scaled_dot_product", use_rotary=False)
+        if c["block_type"] in stacks
+    ]
+    model = xFormer.from_config(xFormerConfig(config)).eval()
+    assert model.has_encoder == ("encoder" in stacks)
+    assert model.has_decoder == ("decoder" in stacks)
+
+    src = torch.randint(0, VOCAB, (BATCH, SEQ))
+    src_copy = src.clone()
+    with torch.no_grad():
+        y = model(src)
+
+    assert y is not None and y.shape == (BATCH, SEQ, EMB)
+    assert torch.equal(src, src_copy)
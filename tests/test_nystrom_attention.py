@@ -8,6 +8,7 @@ import pytest
 import torch
 
 from xformers.components.attention import NystromAttention, ScaledDotProduct
+from xformers.components.attention.mask_cache import clear_mask_cache, mask_cache_info
 from xformers.components.attention.utils import maybe_merge_masks
 
 
@@ -150,3 +151,23 @@ def test_nystrom_attention(
 
     test_att_mask_ignored()
     test_masking()
+
+
+@pytest.mark.parametrize("num_landmarks", [4, 64])
+def test_nystrom_causal_masks_shared(num_landmarks: int):
+    clear_mask_cache()
+    layers = [
+        NystromAttention(
+            dropout=0.0, num_heads=2, num_landmarks=num_landmarks, causal=True
+        )
+        for _ in range(2)
+    ]
+    a = torch.rand(4, 16, 8)
+    for layer in layers:
+        layer(a, a, a)
+
+    # The layers reuse the masks built by the first one
+    info = mask_cache_info()
+    assert info.misses == (1 if num_landmarks >= 16 else 3)
+    assert info.hits == info.misses
+    clear_mask_cache()
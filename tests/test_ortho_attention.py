@@ -87,3 +87,60 @@ def test_ortho_attention(
 
     test_close_to_sdp()
     test_att_mask_ignored()
+
+
+def _kmeans_ref(x, K, num_iters, spherical):
+    B, N, D = x.shape
+    c = x[:, torch.randperm(N)[:K], :].clone()
+    for _ in range(num_iters):
+        if spherical:
+            cl = (x @ c.transpose(-2, -1)).argmax(-1)
+        else:
+            cl = ((x[:, :, None] - c[:, None]) ** 2).sum(-1).argmin(-1)
+        c.zero_()
+        c.scatter_add_(-2, cl[..., None].repeat(1, 1, D), x)
+        counts = c.new_full((B, K), 1e-6)
+        counts.scatter_add_(-1, cl, x.new_ones((B, N)))
+        c.divide_(counts.unsqueeze(-1))
+        if spherical:
+            c = torch.nn.functional.normalize(c, p=2, dim=-1)
+    return c
+
+
+@pytest.mark.parametrize("spherical", [False, True])
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_ortho_kmeans_chunked(spherical: bool, chunk_size: int):
+    x = torch.randn(2, 100, 16, dtype=torch.float64)
+    if spherical:
+        x = torch.nn.functional.normalize(x, p=2, dim=-1)
+    attention = OrthoFormerAttention(
+        dropout=0.0, num_landmarks=8, kmeans_chunk_size=chunk_size
+    )
+    kmeans = attention._kmeans_spherical if spherical else attention._kmeans
+
+    torch.manual_seed(0)
+    c = kmeans(x, 8, 5)
+    torch.manual_seed(0)
+    assert torch.allclose(c, _kmeans_ref(x, 8, 5, spherical))
+
+
+def test_ortho_kmeans_warm_start():
+    b, s, d = 4, 64, 16
+    a = torch.rand(b, s, d)
+    attention = OrthoFormerAttention(
+        dropout=0.0,
+        num_landmarks=8,
+        landmark_selection="kmeans",
+        kmeans_warm_start=True,
+    )
+    attention(a, a, a)
+    centroids = attention._kmeans_centroids
+    assert centroids is not None and centroids.shape == (b, 8, d)
+    assert "_kmeans_centroids" not in attention.state_dict()
+
+    # Starts from the landmarks of the previous call
+    assert torch.equal(attention._cluster_landmarks(a, num_iters=0), centroids)
+    # ... unless the shapes changed
+    landmarks = attention._cluster_landmarks(a[:2], num_iters=0)
+    assert landmarks.shape == (2, 8, d)
+    assert attention._kmeans_centroids.shape == (2, 8, d)
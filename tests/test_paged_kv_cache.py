@@ -0,0 +1,170 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+import math
+
+import pytest
+import torch
+
+import xformers.ops as xops
+from xformers.ops import PagedKVCache, fmha
+
+from .utils import assert_allclose
+
+PAGE_SIZE = 4
+H, D = 2, 8
+
+
+def _ref_decode(q, keys, values):
+    # q: [n_q, H, D], keys/values: [n_k, H, D], causal with offset
+    n_q, n_k = q.shape[0], keys.shape[0]
+    mask = fmha.attn_bias.LowerTriangularFromBottomRightMask().materialize(
+        (n_q, n_k), dtype=q.dtype
+    )
+    attn = torch.einsum("qhd,khd->hqk", q, keys) * q.shape[-1] ** -0.5 + mask
+    return torch.einsum("hqk,khd->qhd", attn.softmax(-1), values)
+
+
+def test_append_and_attention() -> None:
+    torch.manual_seed(0)
+    cache = PagedKVCache(16, PAGE_SIZE, H, D, dtype=torch.float32, device="cpu")
+    # The unused slots of the pools are never read
+    cache.cache_k.fill_(math.nan)
+    cache.cache_v.fill_(math.nan)
+    seqlens = {"a": 7, "b": 1, "c": 12}
+    kv = {}
+    for seq_id, n in seqlens.items():
+        k, v = torch.randn([2, n, H, D]).unbind(0)
+        cache.add_sequence(seq_id)
+        cache.append(seq_id, k, v)
+        kv[seq_id] = (k, v)
+    assert cache.num_free_pages == 16 - 2 - 1 - 3
+    for seq_id, (k, v) in kv.items():
+        k_cached, v_cached = cache.get_kv(seq_id)
+        assert torch.equal(k, k_cached) and torch.equal(v, v_cached)
+
+    q_seqlen = [3, 1, 2]
+    q = torch.randn([1, sum(q_seqlen), H, D])
+    attn_bias = cache.make_attn_bias(list(seqlens), q_seqlen)
+    assert isinstance(
+        attn_bias, fmha.attn_bias.PagedBlockDiagonalCausalWithOffsetPaddedKeysMask
+    )
+    out = xops.memory_efficient_attention_forward(
+        q, cache.cache_k, cache.cache_v, attn_bias, op=fmha.cpu.FwOp
+    )
+    ref = torch.cat(
+        [
+            _ref_decode(q_i, *kv[seq_id])
+            for seq_id, q_i in zip(seqlens, q[0].split(q_seqlen))
+        ]
+    )
+    assert_allclose(out[0], ref, atol=1e-5, rtol=1e-5)
+
+
+def test_fork_copy_on_write() -> None:
+    torch.manual_seed(0)
+    cache = PagedKVCache(8, PAGE_SIZE, H, D, device="cpu")
+    prompt_k, prompt_v = torch.randn([2, 6, H, D]).unbind(0)
+    cache.add_sequence(0)
+    cache.append(0, prompt_k, prompt_v)
+    cache.fork(0, 1)
+    cache.fork(0, 2, num_tokens=3)
+    assert cache.block_table(1) == cache.block_table(0)
+    assert cache.block_table(2) == cache.block_table(0)[:1]
+    assert cache.num_free_pages == 6
+
+    new = {i: torch.randn([2, 1, H, D]).unbind(0) for i in range(3)}
+    for i in range(3):
+        cache.append(i, *new[i])
+    # The partially filled pages were copied before being written to
+    assert cache.block_table(0)[0] == cache.block_table(1)[0]
+    assert cache.block_table(0)[0] != cache.block_table(2)[0]
+    assert cache.block_table(0)[1] != cache.block_table(1)[1]
+    for i, prefix in [(0, 6), (1, 6), (2, 3)]:
+        k, v = cache.get_kv(i)
+        assert torch.equal(k, torch.cat([prompt_k[:prefix], new[i][0]]))
+        assert torch.equal(v, torch.cat([prompt_v[:prefix], new[i][1]]))
+
+    cache.free_sequence(0)
+    cache.free_sequence(1)
+    cache.free_sequence(2)
+    assert cache.num_free_pages == 8 and len(cache) == 0
+
+
+def test_out_of_pages() -> None:
+    cache = PagedKVCache(2, PAGE_SIZE, H, D, device="cpu")
+    cache.add_sequence("a")
+    cache.reserve("a", 5)
+    cache.add_sequence("b")
+    with pytest.raises(RuntimeError):
+        cache.reserve("b", 1)
+    cache.free_sequence("a")
+    cache.reserve("b", 8)
+    assert cache.num_free_pages == 0
+
+
+def test_compact() -> None:
+    torch.manual_seed(0)
+    cache = PagedKVCache(12, PAGE_SIZE, H, D, device="cpu")
+    kv = {}
+    for i in range(4):
+        kv[i] = torch.randn([2, 3 * PAGE_SIZE - 1, H, D]).unbind(0)
+        cache.add_sequence(i)
+        cache.append(i, *kv[i])
+    cache.fork(3, 4, num_tokens=PAGE_SIZE + 1)
+    cache.free_sequence(0)
+    cache.free_sequence(2)
+    moved = cache.compact()
+    assert moved
+    used = sorted({p for i in [1, 3, 4] for p in cache.block_table(i)})
+    assert used == list(range(6))
+    assert cache.num_free_pages == 6
+    for i in [1, 3]:
+        k, v = cache.get_kv(i)
+        assert torch.equal(k, kv[i][0]) and torch.equal(v, kv[i][1])
+    k, _ = cache.get_kv(4)
+    assert torch.equal(k, kv[3][0][: PAGE_SIZE + 1])
+    # Newly allocated pages come from the end of the pool
+    cache.add_sequence(5)
+    cache.reserve(5, 1)
+    assert cache.block_table(5) == [6]
+
+
+def test_attn_bias_advance_and_gappy() -> None:
+    torch.manual_seed(0)
+    cache = PagedKVCache(
+        16, PAGE_SIZE, H, D, max_pages_per_seq=4, dtype=torch.float32, device="cpu"
+    )
+    kv = {i: torch.randn([2, n, H, D]).unbind(0) for i, n in enumerate([5, 9])}
+    for i, (k, v) in kv.items():
+        cache.add_sequence(i)
+        cache.append(i, k, v)
+    attn_bias = cache.make_attn_bias([0, 1], [1, 1])
+    assert isinstance(
+        attn_bias, fmha.attn_bias.PagedBlockDiagonalCausalWithOffsetPaddedKeysMask
+    )
+    assert attn_bias.block_tables.shape == (2, 4)
+    assert attn_bias.k_seqinfo.seqlen.tolist() == [5, 9]
+    # Decoding a token: write it, then update the bias in-place
+    for i in range(2):
+        cache.reserve(i, 1)
+        cache.append(i, *torch.randn([2, 1, H, D]).unbind(0))
+    attn_bias.advance(1)
+    new_bias = cache.make_attn_bias([0, 1], [1, 1])
+    assert torch.equal(attn_bias.k_seqinfo.seqlen, new_bias.k_seqinfo.seqlen)
+    assert torch.equal(attn_bias.block_tables, new_bias.block_tables)
+
+    gappy = cache.make_attn_bias(
+        [0, 1],
+        [1, 1],
+        fmha.attn_bias.PagedBlockDiagonalGappyKeysMask,
+        kv_seqstarts=[2, 4],
+    )
+    mask = gappy.materialize((2, 16 * PAGE_SIZE), dtype=torch.bool)
+    for i, start in enumerate([2, 4]):
+        slots = cache.slot_indices(i, start, cache.seqlen(i))
+        assert mask[i].nonzero()[:, 0].tolist() == sorted(slots.tolist())
+    with pytest.raises(ValueError):
+        cache.make_attn_bias([0], [1], kv_seqstarts=[0])
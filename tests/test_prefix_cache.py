@@ -0,0 +1,161 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+import importlib
+from pathlib import Path
+
+import pytest
+import torch
+
+from xformers.ops import fmha
+
+from .utils import assert_allclose
+
+EXAMPLE_DIR = Path(__file__).parent.parent / "examples" / "llama_inference"
+PAGE_SIZE = 2
+
+
+@pytest.fixture
+def prefix_cache(monkeypatch):
+    # The example imports its modules as top-level modules
+    monkeypatch.syspath_prepend(str(EXAMPLE_DIR))
+    mp_utils = importlib.import_module("mp_utils")
+    monkeypatch.setattr(mp_utils, "_WORLD_SIZE", 1)
+    return importlib.import_module("prefix_cache")
+
+
+def _make(prefix_cache, num_pages: int):
+    model = importlib.import_module("model")
+    args = model.ModelArgs(dim=8, n_layers=1, n_heads=2)
+    # Keys and values of 1 layer, 2 heads of dim 4 in float32
+    page_bytes = 2 * PAGE_SIZE * 2 * 4 * 4
+    cache = prefix_cache.PrefixCache(
+        args, num_pages * page_bytes, PAGE_SIZE, device="cpu", dtype=torch.float32
+    )
+    private = model.make_cache(args, 16, device="cpu", dtype=torch.float32)
+    for k, v in private:
+        k[0, :, :, 0].normal_()
+        v[0, :, :, 0].normal_()
+    return cache, private
+
+
+def test_match_insert_split(prefix_cache) -> None:
+    torch.manual_seed(0)
+    cache, private = _make(prefix_cache, num_pages=4)
+    assert cache.num_pages == 4
+
+    tokens = [1, 2, 3, 4, 5]
+    prefix = cache.match(tokens)
+    assert prefix.length == 0
+    node = cache.insert(tokens, prefix, private, cache_start=0)
+    # Only whole pages are cached
+    assert node.length == 4 and cache.num_cached_tokens == 4
+    pages = node.path_pages()
+    for (pool_k, pool_v), (k, v) in zip(cache.cache, private):
+        for i, page in enumerate(pages):
+            start = i * PAGE_SIZE
+            assert torch.equal(
+                pool_k[0, page * PAGE_SIZE : (page + 1) * PAGE_SIZE],
+                k[0, start : start + PAGE_SIZE],
+            )
+            assert torch.equal(
+                pool_v[0, page * PAGE_SIZE : (page + 1) * PAGE_SIZE],
+                v[0, start : start + PAGE_SIZE],
+            )
+    cache.release(node)
+
+    # At least one token is left to process
+    assert cache.match([1, 2, 3, 4]).length == 2
+    assert cache.match([1, 2, 3, 4, 9]).length == 4
+    # Diverging in the middle of an edge splits it
+    head = cache.match([1, 2, 7, 7, 7])
+    assert head.length == 2 and head.path_pages() == pages[:1]
+    assert list(head.children.values())[0].pages == pages[1:]
+    assert cache.num_cached_tokens == 4
+
+
+def _match_length(cache, tokens) -> int:
+    prefix = cache.match(tokens)
+    cache.release(prefix)
+    return prefix.length
+
+
+def test_evict(prefix_cache) -> None:
+    torch.manual_seed(0)
+    cache, private = _make(prefix_cache, num_pages=4)
+    tokens_a = [1, 2, 3, 4, 5]
+    node_a = cache.insert(tokens_a, cache.match(tokens_a), private, 0)
+    cache.release(node_a)
+    # Uses the first page of `node_a` more recently than the second one
+    assert _match_length(cache, [1, 2, 7, 7]) == 2
+
+    # The least recently used leaf is evicted to make room
+    tokens_b = [5, 6, 7, 8, 9, 10, 11]
+    node_b = cache.insert(tokens_b, cache.match(tokens_b), private, 0)
+    assert node_b.length == 6
+    assert cache.num_cached_tokens == 4 * PAGE_SIZE
+    assert _match_length(cache, tokens_a) == 2
+
+    # `node_b` is in use: only the page of [1, 2] could be evicted, which
+    # is not enough, so nothing is
+    tokens_c = [20, 21, 22, 23, 24]
+    node_c = cache.insert(tokens_c, cache.match(tokens_c), private, 0)
+    assert node_c.length == 0
+    cache.release(node_c)
+    assert _match_length(cache, [1, 2, 3]) == 2
+    assert _match_length(cache, tokens_c) == 0
+
+    # Once released, `node_b` is the least recently used and is evicted
+    cache.release(node_b)
+    node_c = cache.insert(tokens_c, cache.match(tokens_c), private, 0)
+    assert node_c.length == 4
+    cache.release(node_c)
+    assert _match_length(cache, tokens_b) == 0
+    assert _match_length(cache, [1, 2, 3]) == 2
+    # Nothing is in use anymore
+    assert cache._evict(cache.num_pages)
+    assert cache.num_cached_tokens == 0
+
+
+def test_prefix_attention(prefix_cache) -> None:
+    # Attending separately to the cached prefix and to the private tokens
+    # is the same as attending to the whole sequence
+    torch.manual_seed(0)
+    model = importlib.import_module("model")
+    cache, private = _make(prefix_cache, num_pages=4)
+    node = cache.insert([1, 2, 3, 4, 5], cache.match([1, 2, 3, 4, 5]), private, 0)
+    cache.release(node)
+
+    tokens = [1, 2, 3, 4, 9, 10, 11]
+    prefix_node = cache.match(tokens)
+    assert prefix_node.length == 4
+    num_private = len(tokens) - prefix_node.length
+    prefix = cache.make_prefix([prefix_node], [num_private])
+    prefix_k, prefix_v = prefix.cache[0]
+    private_k, private_v = [x[:, 8:] for x in private[0]]
+    private_bias = model.AttnBias.from_seqlens(
+        q_seqlen=[num_private], kv_padding=8, kv_seqlen=[num_private]
+    )
+    q = torch.randn([1, num_private, *private_k.shape[2:]])
+    out_prefix, lse_prefix = fmha.memory_efficient_attention_partial(
+        q, prefix_k, prefix_v, prefix.attn_bias
+    )
+    out_private, lse_private = fmha.memory_efficient_attention_partial(
+        q, private_k, private_v, private_bias
+    )
+    out, _ = fmha.merge_attentions(
+        [out_prefix, out_private], [lse_prefix, lse_private], write_lse=False
+    )
+
+    # The prefix was inserted from the first positions of `private`
+    k, v = [
+        torch.cat([x[:, : prefix_node.length], y[:, :num_private]], dim=1)
+        for x, y in zip(private[0], (private_k, private_v))
+    ]
+    ref = fmha.memory_efficient_attention_forward(
+        q, k, v, fmha.attn_bias.LowerTriangularFromBottomRightMask()
+    )
+    assert_allclose(out, ref, atol=1e-5, rtol=1e-5)
+    cache.release(prefix_node)
@@ -223,3 +223,24 @@ def test_analyze_prof_memeff(op, causal: bool) -> None:
         y = xops.memory_efficient_attention(x, x, x, attn_bias=bias, op=op)
     with assert_flops("memory_efficient_attention BW", match=fw_flops * 5 // 2):
         y.backward(y)
+
+
+def test_analyze_prof_attn_bias() -> None:
+    q_seqlen, kv_seqlen = [5, 20, 12], [30, 45, 31]
+    H, K = 3, 16
+    q = torch.randn([1, sum(q_seqlen), H, K], requires_grad=True)
+    k, v = torch.randn([2, 1, sum(kv_seqlen), H, K])
+    bias = fmha.attn_bias.BlockDiagonalCausalFromBottomRightMask.from_seqlens(
+        q_seqlen, kv_seqlen, device=torch.device("cpu")
+    )
+    num_pairs = sum(
+        n_q * n_k - n_q * (n_q - 1) // 2 for n_q, n_k in zip(q_seqlen, kv_seqlen)
+    )
+    fw_flops = 2 * 2 * H * num_pairs * K
+    # On CPU, the BW pass runs in the same thread as the FW pass
+    with assert_flops("memory_efficient_attention", match=fw_flops):
+        y = xops.memory_efficient_attention(
+            q, k, v, attn_bias=bias, op=fmha.MemoryEfficientAttentionCpuOp
+        )
+    with assert_flops("memory_efficient_attention BW", match=fw_flops * 5 // 2):
+        y.backward(y)
@@ -100,3 +100,64 @@ def test_increment(K: int, include_weight: bool, dtype: str):
     assert_allclose(out, baseline, atol=atol, rtol=rtol)
     assert_allclose(x, x_orig + y_orig, atol=atol, rtol=rtol)
     assert_allclose(y, y_orig, atol=atol, rtol=rtol)
+
+
+@pytest.mark.parametrize("include_weight", [True, False])
+@pytest.mark.parametrize("dtype", ["bf16", "f32"])
+def test_backward_cpu(include_weight: bool, dtype: str):
+    atol = 1e-5 if dtype == "f32" else 1e-2
+    rtol = 1e-4 if dtype == "f32" else 0.02
+    torch.manual_seed(1)
+    B, M, K = 3, 7, 273
+    dtype_ = DTYPES[dtype]
+
+    rms_layer = RMSNorm(K, include_weight=include_weight)
+    baseline_layer = RMSNormPytorch(K, include_weight=include_weight)
+    if include_weight:
+        torch.nn.init.normal_(rms_layer.weight)  # type: ignore
+        with torch.no_grad():
+            baseline_layer.weight.copy_(rms_layer.weight)  # type: ignore
+
+    x = torch.randn(B, M, K, dtype=dtype_, requires_grad=True)
+    x_ref = x.detach().clone().requires_grad_()
+    out = rms_layer(x)
+    baseline = baseline_layer(x_ref)
+    assert_allclose(out, baseline.to(out.dtype), atol=atol, rtol=rtol)
+
+    grad = torch.randn_like(out)
+    out.backward(grad)
+    baseline.backward(grad.to(baseline.dtype))
+    assert_allclose(x.grad, x_ref.grad, atol=atol, rtol=rtol)
+    if include_weight:
+        assert_allclose(
+            rms_layer.weight.grad,  # type: ignore
+            baseline_layer.weight.grad,  # type: ignore
+            atol=atol * K,
+            rtol=rtol,
+        )
+
+
+@pytest.mark.parametrize("include_weight", [True, False])
+def test_increment_backward_cpu(include_weight: bool):
+    torch.manual_seed(1)
+    B, M, K = 3, 7, 273
+    rms_layer = RMSNorm(K, include_weight=include_weight)
+    x_orig = torch.randn(B, M, K, requires_grad=True)
+    y = torch.randn(B, M, K, requires_grad=True)
+
+    # The in-place addition is done on a non-leaf tensor
+    x = x_orig * 2
+    out = rms_layer.increment_and_forward_(x, y)
+    assert_allclose(x, x_orig * 2 + y)
+    (out.sum() + x.square().sum()).backward()
+    grads = [x_orig.grad, y.grad]
+
+    x_orig.grad, y.grad = None, None
+    x_ref = x_orig * 2 + y
+    out_ref = RMSNormPytorch(K, include_weight=include_weight)
+    if include_weight:
+        with torch.no_grad():
+            out_ref.weight.copy_(rms_layer.weight)  # type: ignore
+    (out_ref(x_ref).sum() + x_ref.square().sum()).backward()
+    assert_allclose(grads[0], x_orig.grad, atol=1e-5, rtol=1e-4)
+    assert_allclose(grads[1], y.grad, atol=1e-5, rtol=1e-4)
@@ -3,13 +3,16 @@
 # This source code is licensed under the BSD license found in the
 # LICENSE file in the root directory of this source tree.
 
+import concurrent.futures
+
 import pytest
 import torch
 
 # needed to register custom ops
 import xformers  # noqa: F401
 from xformers.ops import masked_matmul
-from xformers.sparse import BlockSparseTensor, SparseCSRTensor
+from xformers.sparse import BlockSparseTensor, SparseCSRTensor, blocksparse_attention
+from xformers.sparse.utils import _CSRStructureCache, _round_nnz
 
 from .utils import disable_tf32
 
@@ -254,6 +257,145 @@ def test_sparse_softmax(tensor_type, device):
     ), f"{torch.max(torch.abs(a_grad- a_sparse.grad.to_dense()))}"
 
 
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+def test_csr_torch_kernels(dtype):
+    # Pure PyTorch kernels, used on CPU and when the sputnik kernels are not built
+    _seed()
+    C, H, W, L = 3, 48, 40, 16
+    atol = 1e-5 if dtype == torch.float32 else 5e-2
+    mask_sparse = _create_csr_tensor("cpu", torch.bool, (C, H, W), sparsity=0.7)
+    mask = mask_sparse.to_dense()
+    mask[:, 0] = False
+    mask_sparse = SparseCSRTensor.from_dense(mask)
+    mask = mask_sparse.to_dense()
+
+    a = torch.randn(C, H, L, dtype=dtype, requires_grad=True)
+    b = torch.randn(C, W, L, dtype=dtype, requires_grad=True)
+    v = torch.randn(C, W, L, dtype=dtype, requires_grad=True)
+    att = torch.softmax(masked_matmul(a, b.transpose(-2, -1), mask_sparse), dim=-1)
+    out = att @ v
+    assert out.dtype == dtype
+
+    a_gt, b_gt, v_gt = [t.detach().float().requires_grad_() for t in (a, b, v)]
+    att_gt = masked_matmul(a_gt, b_gt.transpose(-2, -1), mask)
+    # Rows without any key give zeros
+    att_gt = torch.softmax(att_gt, dim=-1).nan_to_num(0.0)
+    out_gt = att_gt @ v_gt
+
+    assert torch.allclose(att.to_dense().float(), att_gt, atol=atol)
+    assert torch.allclose(out.float(), out_gt, atol=atol)
+
+    grad = torch.randn_like(out_gt)
+    out.backward(grad.to(dtype))
+    out_gt.backward(grad)
+    for t, t_gt in [(a, a_gt), (b, b_gt), (v, v_gt)]:
+        assert torch.allclose(t.grad.float(), t_gt.grad, atol=atol * 10)
+
+
+@disable_tf32
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+def test_blocksparse_attention(causal, dtype):
+    _seed()
+    B, H, block_size, blocks, K = 2, 3, 16, 6, 8
+    M = block_size * blocks
+    atol = 1e-5 if dtype == torch.float32 else 3e-2
+    layout = torch.randint(2, (H, blocks, blocks))
+    layout[:, :, 0] = 1
+    layout[1, 2] = 0  # Some queries attend to nothing
+    q, k, v = [torch.randn(B, H, M, K).to(dtype).requires_grad_() for _ in range(3)]
+
+    out = blocksparse_attention(q, k, v, layout, causal=causal)
+    assert out.dtype == dtype
+
+    mask = torch.kron(layout, torch.ones(block_size, block_size)).bool()
+    if causal:
+        mask &= torch.ones(M, M, dtype=torch.bool).tril()
+    q_gt, k_gt, v_gt = [t.detach().float().requires_grad_() for t in (q, k, v)]
+    att = (q_gt @ k_gt.transpose(-2, -1)) / K**0.5
+    att = torch.softmax(att.masked_fill(~mask, float("-inf")), dim=-1)
+    out_gt = att.nan_to_num(0.0) @ v_gt
+    assert torch.allclose(out.float(), out_gt, atol=atol)
+
+    grad = torch.randn_like(out_gt)
+    out.backward(grad.to(dtype))
+    out_gt.backward(grad)
+    for t, t_gt in [(q, q_gt), (k, k_gt), (v, v_gt)]:
+        assert torch.allclose(t.grad.float(), t_gt.grad, atol=atol * 10)
+
+    if not causal and dtype == torch.float32:
+        # Same as the BlockSparseTensor path
+        layout[1, 2] = 1
+        mask_sparse = BlockSparseTensor(
+            torch.ones(B, int(layout.sum()), block_size, block_size), layout
+        )
+        att = masked_matmul(q / K**0.5, k.transpose(-2, -1), mask_sparse)
+        att = torch.softmax(att, dim=-1)
+        out = blocksparse_attention(q, k, v, layout)
+        assert torch.allclose(out, att @ v, atol=atol)
+
+
+def test_csr_structure_cache():
+    cache = _CSRStructureCache(max_bytes=2**20)
+    mask = _round_nnz(torch.rand(64, 48) > 0.7)
+    row_offsets = torch.nn.functional.pad(mask.sum(-1).cumsum(-1), (1, 0)).int()
+    column_indices = mask.nonzero()[:, 1].int()
+
+    s0 = cache.get(64, 48, row_offsets, column_indices)
+    # Same content, different tensors
+    s1 = cache.get(64, 48, row_offsets.clone(), column_indices.clone())
+    assert all(t0 is t1 for t0, t1 in zip(s0.tensors(), s1.tensors()))
+
+    # The hashes do not change when longer indices are seen
+    long_mask = torch.ones(300, 300, dtype=torch.bool)
+    cache.get(
+        300,
+        300,
+        torch.arange(0, 300 * 301, 300, dtype=torch.int32),
+        long_mask.nonzero()[:, 1].int(),
+    )
+    assert cache.get(64, 48, row_offsets.clone(), column_indices.clone()) is s0
+
+    # Concurrent lookups of the same pattern share the structure
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        structures = list(
+            executor.map(
+                lambda _: cache.get(
+                    64, 48, row_offsets.clone(), column_indices.clone()
+                ),
+                range(8),
+            )
+        )
+    assert all(s is s0 for s in structures)
+
+    assert cache.get(64, 48, s0.row_offsets, s0.column_indices) is s0
+    assert cache.get(64, 49, row_offsets, column_indices) is not s0
+    ref = SparseCSRTensor.from_dense(mask[None].float())
+    assert torch.equal(s0.row_offsets, ref._csr_row_offsets)
+    for t, t_ref in zip(s0.transp_info, ref._csr_transp_info):
+        assert torch.equal(t, t_ref)
+
+    # Least recently used structures are dropped
+    cache.max_bytes = cache.nbytes
+    cache.get(63, 48, row_offsets[:-1], column_indices[: row_offsets[-2]])
+    assert cache.get(64, 48, row_offsets, column_indices) is not s0
+
+    # Matrices with the same pattern share their indices
+    a = SparseCSRTensor.from_dense(mask[None].float())
+    b = SparseCSRTensor.from_dense(2 * mask[None].float())
+    assert a._csr_column_indices is b._csr_column_indices
+    assert torch.equal((a + b).to_dense(), 3 * mask[None].float())
+    at, bt = a.transpose(-2, -1), b.transpose(-2, -1)
+    assert at._csr_row_offsets is bt._csr_row_offsets
+    assert torch.equal(at.to_dense(), mask.T[None].float())
+
+    # Copies do not modify the shared indices
+    c = SparseCSRTensor.from_dense((torch.rand(1, 64, 48) > 0.5).float())
+    c.copy_(a)
+    assert torch.equal(c, a)
+    assert torch.equal(b.to_dense(), 2 * mask[None].float())
+
+
 @pytest.mark.parametrize("tensor_type", _tensor_types)
 @pytest.mark.parametrize("device", _devices)
 def test_deepcopy(tensor_type, device):
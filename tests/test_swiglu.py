@@ -467,3 +467,26 @@ def test_autocast_silu_bw_fused_compile() -> None:
         assert_allclose(
             a, b, msg="fw", atol=FORWARD_ATOL[dtype], rtol=FORWARD_RTOL[dtype]
         )
+
+
+@pytest.mark.parametrize("dtype", [torch.float, torch.bfloat16], ids=["f32", "bf16"])
+@pytest.mark.parametrize("bias", [False, True], ids=["nobias", "bias"])
+@pytest.mark.parametrize("num_tokens", [1, 300, 1100])
+def test_cpu_forward_backward(num_tokens: int, bias: bool, dtype: torch.dtype):
+    torch.manual_seed(num_tokens)
+    module = xsw.SwiGLU(in_features=64, hidden_features=96, bias=bias).to(dtype)
+    x = torch.randn([2, num_tokens, 64], dtype=dtype, requires_grad=True)
+    params = module._ordered_params()
+    assert xsw.SwiGLUOpDispatch.from_arguments(x, *params).op is xsw.SwiGLUPackedCPUOp
+
+    ref = xsw._eager_functional_swiglu(x, *params)
+    out = module(x)
+    assert_allclose(out, ref, atol=FORWARD_ATOL[dtype], rtol=FORWARD_RTOL[dtype])
+
+    grad = torch.randn_like(ref)
+    grads_ref = torch.autograd.grad(ref, [x, *module.parameters()], grad)
+    grads_out = torch.autograd.grad(out, [x, *module.parameters()], grad)
+    for gout, gref in zip(grads_out, grads_ref):
+        assert_allclose(
+            gout, gref, atol=BACKWARD_ATOL[dtype], rtol=BACKWARD_RTOL[dtype]
+        )
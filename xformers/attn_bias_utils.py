@@ -481,7 +481,7 @@ def pack_kv_cache(
 
     num_blocks_per_row = (MAX_T + BLOCK_N - 1) // BLOCK_N
     block_tables = (
-        torch.arange(num_blocks_per_row, device="cuda", dtype=torch.int32)
+        torch.arange(num_blocks_per_row, device=cache_k.device, dtype=torch.int32)
         .unsqueeze(0)
         .expand(B, num_blocks_per_row)
     )
@@ -490,7 +490,7 @@ def pack_kv_cache(
             torch.tensor(kv_seqlens_rounded).cumsum(dim=0)
             - torch.tensor(kv_seqlens_rounded)
         )
-        .to(device="cuda")
+        .to(device=cache_k.device)
         .unsqueeze(1)
     ) // BLOCK_N
     block_tables = (block_tables + seqstarts).contiguous().to(dtype=torch.int32)
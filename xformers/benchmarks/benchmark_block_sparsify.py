@@ -0,0 +1,100 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+import torch
+from torch.utils import benchmark
+
+import xformers.components.attention.attention_patterns as AP
+from xformers.sparse import BlockSparseTensor
+
+MIN_RUN_TIME = 1
+# B, H, seq, block_size, density
+SHAPES = [
+    (1, 8, 2048, 32, 0.25),
+    (1, 8, 4096, 32, 0.1),
+    (2, 4, 4096, 64, 0.1),
+]
+
+
+def block_sparsify_tensor_loop(x, mask, block_size):
+    ret = torch.empty(
+        (x.size(0), mask.sum(), block_size, block_size), dtype=x.dtype, device=x.device
+    )
+    for idx, (h, i, j) in enumerate(zip(*mask.nonzero(as_tuple=True))):
+        ret[:, idx, :, :] = x[
+            :,
+            h,
+            i * block_size : (i + 1) * block_size,
+            j * block_size : (j + 1) * block_size,
+        ]
+    return ret
+
+
+def block_densify_tensor_loop(values, layout):
+    block_size = values.shape[-1]
+    H, blocks_i, blocks_j = layout.shape
+    out = values.new_zeros(
+        (values.shape[0], H, blocks_i * block_size, blocks_j * block_size)
+    )
+    out_r = out.reshape(out.shape[0], H, blocks_i, block_size, blocks_j, block_size)
+    for idx, (h, i, j) in enumerate(zip(*layout.nonzero(as_tuple=True))):
+        out_r[:, h, i, :, j, :] = values[:, idx, :, :]
+    return out
+
+
+def layout_to_pattern_kron(layout, block_size):
+    return torch.kron(layout, torch.ones(block_size, block_size))
+
+
+def bench_block_sparsify():
+    device = torch.device("cpu")
+    results = []
+
+    for B, H, S, block_size, density in SHAPES:
+        torch.manual_seed(0)
+        n = S // block_size
+        layout = (torch.rand(H, n, n) < density).long()
+        x = torch.randn(B, H, S, S, device=device)
+        values = AP.block_sparsify_tensor(x, layout, block_size)
+        description = f"B={B}, H={H}, S={S}, block={block_size}, nnz={values.shape[1]}"
+        cases = [
+            ("sparsify", "loop", "block_sparsify_tensor_loop(x, layout, block_size)"),
+            ("sparsify", "gather", "AP.block_sparsify_tensor(x, layout, block_size)"),
+            ("densify", "loop", "block_densify_tensor_loop(values, layout)"),
+            ("densify", "scatter", "AP.block_densify_tensor(values, layout)"),
+            (
+                "densify",
+                "BlockSparseTensor",
+                "BlockSparseTensor(values, layout).to_dense()",
+            ),
+            ("layout_to_pattern", "kron", "layout_to_pattern_kron(layout, block_size)"),
+            ("layout_to_pattern", "expand", "AP.layout_to_pattern(layout, block_size)"),
+        ]
+        for label, sub_label, stmt in cases:
+            results.append(
+                benchmark.Timer(
+                    stmt=stmt,
+                    globals={
+                        "x": x,
+                        "values": values,
+                        "layout": layout,
+                        "block_size": block_size,
+                        "AP": AP,
+                        "BlockSparseTensor": BlockSparseTensor,
+                        "block_sparsify_tensor_loop": block_sparsify_tensor_loop,
+                        "block_densify_tensor_loop": block_densify_tensor_loop,
+                        "layout_to_pattern_kron": layout_to_pattern_kron,
+                    },
+                    label=label,
+                    sub_label=sub_label,
+                    description=description,
+                ).blocked_autorange(min_run_time=MIN_RUN_TIME)
+            )
+
+    compare = benchmark.Compare(results)
+    compare.print()
+
+
+bench_block_sparsify()
@@ -15,6 +15,8 @@ from xformers.components.attention.core import (
     _softmax,
     bmm,
 )
+from xformers.ops import masked_matmul
+from xformers.sparse import BlockSparseTensor, blocksparse_attention
 
 MIN_RUN_TIME = 1
 SHAPES = [[8, 8], [256, 1024], [128, 256]]
@@ -252,10 +254,78 @@ def bench_bmm():
     compare.print()
 
 
+def bench_blocksparse_attention():
+    min_run_time = MIN_RUN_TIME
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    block_size = 32
+    results = []
+
+    def blocksparse_tensor_attention(q, k, v, mask):
+        att = masked_matmul(q, k.transpose(-2, -1), mask)
+        return torch.softmax(att, dim=-1) @ v
+
+    def dense_attention(q, k, v, mask):
+        att = (q @ k.transpose(-2, -1)).masked_fill(~mask, float("-inf"))
+        return torch.softmax(att, dim=-1) @ v
+
+    for B, H, M, K in [(2, 8, 1024, 64), (1, 8, 4096, 64)]:
+        q, k, v = [
+            torch.randn(B, H, M, K, device=device, requires_grad=True) for _ in range(3)
+        ]
+        for density in [0.1, 0.3]:
+            blocks = M // block_size
+            layout = torch.rand(H, blocks, blocks, device=device) < density
+            layout[:, :, 0] = True
+            mask = BlockSparseTensor(
+                torch.ones(B, int(layout.sum()), block_size, block_size, device=device),
+                layout.long(),
+            )
+            dense_mask = torch.kron(
+                layout.float(), torch.ones(block_size, block_size, device=device)
+            ).bool()
+            for name, stmt, mask_ in [
+                ("dense", "dense_attention(q, k, v, mask)", dense_mask),
+                (
+                    "BlockSparseTensor",
+                    "blocksparse_tensor_attention(q, k, v, mask)",
+                    mask,
+                ),
+                (
+                    "blocksparse_attention",
+                    "blocksparse_attention(q, k, v, mask)",
+                    layout,
+                ),
+            ]:
+                for label, suffix in [("fw", ""), ("fw+bw", ".sum().backward()")]:
+                    results.append(
+                        benchmark.Timer(
+                            stmt=stmt + suffix,
+                            globals={
+                                "q": q,
+                                "k": k,
+                                "v": v,
+                                "mask": mask_,
+                                "dense_attention": dense_attention,
+                                "blocksparse_tensor_attention": blocksparse_tensor_attention,
+                                "blocksparse_attention": blocksparse_attention,
+                            },
+                            label=f"blocksparse attention {label} ({device.type})",
+                            sub_label=f"{name}: {density:0.2f}",
+                            description=f"B={B}, H={H}, M={M}, K={K}",
+                        ).blocked_autorange(min_run_time=min_run_time)
+                    )
+
+    compare = benchmark.Compare(results)
+    compare.print()
+
+
 if torch.version.hip:
     print("This benchmark could not be done on ROCM!")
+elif not torch.cuda.is_available():
+    bench_blocksparse_attention()
 else:
     bench_sddmm()
     bench_matmul_with_mask()
     bench_softmax()
     bench_bmm()
+    bench_blocksparse_attention()
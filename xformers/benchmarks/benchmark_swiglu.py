@@ -56,9 +56,26 @@ CASES = list(
 DTYPE2STR = {
     torch.bfloat16: "b16   ",
     torch.half: "f16   ",
+    torch.float: "f32   ",
     "autocast_half": "f16.ac",
 }
 
+# Inference-sized batches for the CPU
+CPU_SHAPES = [
+    (256, 1536, 2736),
+    (1024, 1536, 2736),
+    (4096, 1536, 2736),
+    (1024, 2048, 5632),
+]
+
+CPU_CASES = list(
+    product_dict(
+        shape=CPU_SHAPES,
+        dtype=[torch.float, torch.bfloat16],
+        bias=[True, False],
+    )
+)
+
 
 def benchmark_swiglu(shape, dtype, bias: bool):
     if dtype == "autocast_half":
@@ -156,8 +173,41 @@ def benchmark_swiglu_bw(shape, dtype, bias: bool):
     )
 
 
-if torch.version.hip:
+def benchmark_swiglu_cpu(shape, dtype, bias: bool):
+    x = torch.randn(shape[:2], dtype=dtype)
+    module = xsw.SwiGLU(in_features=shape[1], hidden_features=shape[2], bias=bias).to(
+        dtype
+    )
+
+    dtype_str = DTYPE2STR.get(dtype, dtype)
+    bstr = "bias" if bias else "nobi"
+    sub_label = f"{dtype_str} B={shape[0]}, I={shape[1]}, H={shape[2]} {bstr}"
+
+    params = module._ordered_params()
+
+    for op, description in [
+        (xsw.SwiGLUPackedCPUOp, xsw.SwiGLUPackedCPUOp.NAME),
+        (xsw.SwiGLUEagerOp, "eager"),
+    ]:
+        yield benchmark.Timer(
+            stmt="with torch.no_grad():\n    fn(x, *args)",
+            globals={
+                "x": x,
+                "args": params,
+                "fn": partial(xsw.swiglu, op=op),
+                "torch": torch,
+            },
+            label="swiglu_cpu_fw",
+            description=description,
+            sub_label=sub_label,
+        )
+
+
+if not torch.cuda.is_available():
+    benchmark_main_helper(benchmark_swiglu_cpu, CPU_CASES, min_run_time=min_run_time)
+elif torch.version.hip:
     print("This benchmark could not be done on ROCM!")
 else:
     benchmark_main_helper(benchmark_swiglu, CASES, min_run_time=min_run_time)
     benchmark_main_helper(benchmark_swiglu_bw, CASES, min_run_time=min_run_time)
+    benchmark_main_helper(benchmark_swiglu_cpu, CPU_CASES, min_run_time=min_run_time)
@@ -0,0 +1,145 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import itertools
+from typing import Optional
+
+import torch
+from torch.utils import benchmark
+
+from xformers.factory.model_factory import xFormer, xFormerConfig
+
+# Small batches, where the Python overhead of the forward is not hidden by the compute
+SHAPES = [
+    # Format: (batch, sequence length)
+    (1, 16),
+    (1, 64),
+    (4, 64),
+    (8, 128),
+]
+
+EMB = 64
+LAYERS = 4
+VOCAB = 256
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def _config(stacks: str, reversible: bool, seq: int):
+    common = {
+        "dim_model": EMB,
+        "num_layers": LAYERS,
+        "residual_norm_style": "pre",
+        "use_triton": False,
+        "feedforward_config": {
+            "name": "MLP",
+            "dropout": 0.0,
+            "activation": "gelu",
+            "hidden_layer_multiplier": 4,
+        },
+        "position_encoding_config": {
+            "name": "vocab",
+            "seq_len": seq,
+            "vocab_size": VOCAB,
+        },
+    }
+    attention = {
+        "num_heads": 4,
+        "residual_dropout": 0.0,
+        "attention": {"name": "scaled_dot_product", "dropout": 0.0, "seq_len": seq},
+    }
+
+    configs = []
+    if "encoder" in stacks:
+        configs.append(
+            {
+                **common,
+                "block_type": "encoder",
+                "reversible": reversible,
+                "multi_head_config": attention,
+            }
+        )
+    if "decoder" in stacks:
+        configs.append(
+            {
+                **common,
+                "block_type": "decoder",
+                "multi_head_config_masked": attention,
+                "multi_head_config_cross": attention,
+            }
+        )
+    return configs
+
+
+def previous_forward(
+    model: xFormer, src: torch.Tensor, tgt: Optional[torch.Tensor] = None
+) -> Optional[torch.Tensor]:
+    """The forward before the execution plan, with the parameter walk and the copies"""
+    if len(list(model.encoders.parameters())) > 0:
+        encoders = model.encoders
+        memory = src.clone()
+        if isinstance(encoders, torch.nn.ModuleList):
+            for encoder in encoders:
+                memory = encoder(memory)
+        else:
+            if model.rev_enc_pose_encoding:
+                memory = model.rev_enc_pose_encoding(src)
+            x = torch.cat([memory, memory], dim=-1)
+            x = encoders(x)
+            memory = torch.stack(x.chunk(2, dim=-1)).mean(dim=0)
+
+        if not model.decoders:
+            return memory
+
+    if len(model.decoders) > 0:
+        tgt = src.clone() if tgt is None else tgt
+        for decoder in model.decoders:
+            tgt = decoder(target=tgt, memory=memory)
+        return tgt
+
+    return None
+
+
+CASES = list(
+    itertools.product(
+        SHAPES,
+        [("encoder", False), ("encoder", True), ("encoder+decoder", False)],
+    )
+)
+
+
+def benchmark_xformer_forward():
+    results = []
+    for (B, S), (stacks, reversible) in CASES:
+        model = (
+            xFormer.from_config(xFormerConfig(_config(stacks, reversible, S)))
+            .to(device)
+            .eval()
+        )
+        src = torch.randint(0, VOCAB, (B, S), device=device)
+        sub_label = f"{stacks}{' (reversible)' if reversible else ''} B={B} S={S}"
+
+        for description, fn in [
+            ("previous", previous_forward),
+            ("plan", xFormer.forward),
+        ]:
+            results.append(
+                benchmark.Timer(
+                    stmt="fn(model, src)",
+                    setup="torch.set_grad_enabled(False)",
+                    globals={"fn": fn, "model": model, "src": src},
+                    label="xFormer forward (small batch latency)",
+                    description=description,
+                    sub_label=sub_label,
+                ).blocked_autorange(min_run_time=0.5)
+            )
+
+    compare = benchmark.Compare(results)
+    compare.print()
+
+
+if __name__ == "__main__":
+    benchmark_xformer_forward()
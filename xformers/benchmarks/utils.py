@@ -565,19 +565,21 @@ def benchmark_run_and_compare(
 
                 memory = math.inf
                 try:
-                    torch.cuda.synchronize()
-                    torch.cuda.reset_peak_memory_stats()
-                    mem_begin = torch.cuda.max_memory_allocated() / 2**20
+                    if env != "cpu":
+                        torch.cuda.synchronize()
+                        torch.cuda.reset_peak_memory_stats()
+                        mem_begin = torch.cuda.max_memory_allocated() / 2**20
                     benchmark_object._task_spec = replace(
                         benchmark_object._task_spec, env=env
                     )
                     measurement = benchmark_object.blocked_autorange(
                         min_run_time=min_run_time
                     )
-                    torch.cuda.synchronize()
                     results.append((metadata, measurement))
                     name = measurement.task_spec.description
-                    memory = torch.cuda.max_memory_allocated() / 2**20 - mem_begin
+                    if env != "cpu":
+                        torch.cuda.synchronize()
+                        memory = torch.cuda.max_memory_allocated() / 2**20 - mem_begin
                     measurement.mem_use = memory
                 except RuntimeError as e:
                     if not _is_oom_error(e):
@@ -5,17 +5,25 @@
 
 
 import math
-from typing import List
+from typing import Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 import torch
 
+from xformers.components.attention._sputnik_sparse import SparseCS
 from xformers.components.attention.sparsity_config import (
     BigBirdSparsityConfig,
     BSLongformerSparsityConfig,
     FixedSparsityConfig,
     VariableSparsityConfig,
 )
+from xformers.ops.fmha.attn_bias import (
+    AttentionBias,
+    BlockDiagonalMask,
+    LocalAttentionFromBottomRightMask,
+    LowerTriangularMask,
+)
+from xformers.sparse import SparseCSRTensor
 
 
 # generic nd cases
@@ -48,8 +56,7 @@ def local_nd_pattern(*sizes, distance, p=2.0):
 
 def axial_nd_pattern(*sizes):
     # axial is a special case with p=0 and distance=2
-    d = local_nd_distance(*sizes, p=0)
-    return d < 2
+    return AxialPattern(*sizes).to_dense()
 
 
 def random_pattern_from_probability_matrix(dist_matrix, nnz):
@@ -81,9 +88,11 @@ def global_token_pattern(attention_query_mask: torch.Tensor) -> torch.Tensor:
     return mask
 
 
-def random_pattern(attn_size: int, sparsity: float) -> torch.Tensor:
+def random_pattern(
+    attn_size: int, sparsity: float, generator: Optional[torch.Generator] = None
+) -> torch.Tensor:
     assert 0 < sparsity < 1
-    mask = torch.rand(attn_size, attn_size) > sparsity
+    mask = torch.rand(attn_size, attn_size, generator=generator) > sparsity
     return mask
 
 
@@ -92,13 +101,12 @@ def local_1d_pattern(attn_size: int, window_size: int) -> torch.Tensor:
     assert (
         window_size % 2 == 1
     ), "The window size is assumed to be odd (counts self-attention + 2 wings)"
-    h_win_size = window_size // 2 + 1
-    return local_nd_pattern(attn_size, distance=h_win_size, p=1.0)
+    h_win_size = window_size // 2
+    return BandPattern((attn_size, attn_size), h_win_size, h_win_size).to_dense()
 
 
 def causal_1d_pattern(attn_size: int) -> torch.Tensor:
-    mask = torch.tril(torch.ones(attn_size, attn_size, dtype=torch.bool))
-    return mask
+    return BandPattern((attn_size, attn_size), None, 0).to_dense()
 
 
 # 2d-specific cases
@@ -129,6 +137,11 @@ def axial_2d_pattern(H, W):
 
 
 def swin_attention_pattern(H, W, window_size, shift_size=0):
+    return GroupPattern(_swin_window_ids(H, W, window_size, shift_size)).to_dense()
+
+
+def _swin_window_ids(H, W, window_size, shift_size=0):
+    """Returns the window of each pixel"""
     assert H % window_size == 0
     assert W % window_size == 0
     assert 0 <= shift_size < window_size, "shift_size must in 0-window_size"
@@ -154,9 +167,7 @@ def swin_attention_pattern(H, W, window_size, shift_size=0):
     input_coords = torch.stack([i.flatten(), j.flatten()], 1).float()
     anchors_coords = torch.stack([ii.flatten(), jj.flatten()], 1).float()
 
-    anchor_id = torch.cdist(input_coords, anchors_coords, p=2).argmin(1)
-    mask = anchor_id[:, None] == anchor_id[None, :]
-    return mask
+    return torch.cdist(input_coords, anchors_coords, p=2).argmin(1)
 
 
 def dilated_2d_pattern(H, W, k=2):
@@ -165,29 +176,43 @@ def dilated_2d_pattern(H, W, k=2):
     Can be seen as a form of downsampling, where every pixel attends to a downsampled
     version of the input.
     """
-    d_h = local_nd_distance(H, W, p=1, weights=(1, 0))
-    d_w = local_nd_distance(H, W, p=1, weights=(0, 1))
-    d = (d_h.floor() % k == 0) & (d_w.floor() % k == 0)
-    return d
+    return Dilated2DPattern(H, W, k).to_dense()
 
 
 # Block sparse utils
+def _blocks_view(x: torch.Tensor, block_size: int) -> torch.Tensor:
+    """[B, H, M, N] -> [B, H, M // block_size, N // block_size, block_size, block_size]"""
+    B, H, M, N = x.shape
+    x = x.reshape(B, H, M // block_size, block_size, N // block_size, block_size)
+    return x.transpose(3, 4)
+
+
 def block_sparsify_tensor(x, mask, block_size):
     """
-    Block sparsify a tensor, given a mask and block size
+    Block sparsify a tensor, given a mask and block size.
+    Returns the `[B, nnz, block_size, block_size]` blocks of `x` (of shape [B, H, M, N])
+    which are set in the `[H, M // block_size, N // block_size]` mask, in the order of `mask.nonzero()`.
+    See :func:`block_densify_tensor` for the inverse
     """
-    ret = torch.empty(
-        (x.size(0), mask.sum(), block_size, block_size), dtype=x.dtype, device=x.device
-    )
+    h, i, j = [idx.to(x.device) for idx in mask.nonzero(as_tuple=True)]
+    return _blocks_view(x, block_size)[:, h, i, j]
 
-    for idx, (h, i, j) in enumerate(zip(*mask.nonzero(as_tuple=True))):
-        ret[:, idx, :, :] = x[
-            :,
-            h,
-            i * block_size : (i + 1) * block_size,
-            j * block_size : (j + 1) * block_size,
-        ]
-    return ret
+
+def block_densify_tensor(values, layout, fill_value=0.0):
+    """
+    Inverse of :func:`block_sparsify_tensor`: scatters the `[B, nnz, block_size, block_size]`
+    blocks `values` in a `[B, H, M, N]` tensor given the `[H, M // block_size, N // block_size]`
+    layout, filling the other blocks with `fill_value`.
+    Use `BlockSparseTensor(values, layout)` to keep them block-sparse instead.
+    """
+    block_size = values.shape[-1]
+    H, blocks_i, blocks_j = layout.shape
+    out = values.new_full(
+        (values.shape[0], H, blocks_i * block_size, blocks_j * block_size), fill_value
+    )
+    h, i, j = [idx.to(values.device) for idx in layout.nonzero(as_tuple=True)]
+    _blocks_view(out, block_size)[:, h, i, j] = values
+    return out
 
 
 def pattern_to_layout(mask: torch.Tensor, block_size: int) -> torch.Tensor:
@@ -292,4 +317,530 @@ def layout_to_pattern(layout: torch.Tensor, block_size: int):
     create a pattern of shape [heads, seq, seq] out of a blocksparse
     layout of shape [heads, seq/block_size, seq/block_size]
     """
-    return torch.kron(layout, torch.ones(block_size, block_size))
+    *heads, blocks_i, blocks_j = layout.shape
+    # Same dtype as `torch.kron(layout, torch.ones(block_size, block_size))`
+    layout = layout.to(torch.promote_types(layout.dtype, torch.get_default_dtype()))
+    pattern = layout[..., :, None, :, None].expand(
+        *heads, blocks_i, block_size, blocks_j, block_size
+    )
+    return pattern.reshape(*heads, blocks_i * block_size, blocks_j * block_size)
+
+
+# Lazy patterns
+def _nd_coords(sizes: Sequence[int], index: torch.Tensor) -> List[torch.Tensor]:
+    """Coordinates in a grid of shape `sizes` of the flattened (row-major) `index`"""
+    coords = []
+    for size in reversed(sizes):
+        coords.append(index % size)
+        index = index // size
+    return coords[::-1]
+
+
+def _block_starts_ends(size: int, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    starts = torch.arange(0, size, block_size)
+    return starts, (starts + block_size).clamp(max=size)
+
+
+def _block_min_max(
+    values: torch.Tensor, block_size: int
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Min and max of `values` over each block, the last block may be shorter"""
+    pad = (-values.shape[0]) % block_size
+    values = torch.cat([values, values[-1:].expand(pad)]).view(-1, block_size)
+    return values.amin(1), values.amax(1)
+
+
+def _grid_block_diff_ranges(
+    sizes: Sequence[int], block_size: int
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Bounds of `query_coord - key_coord` along each dimension of the grid, over the
+    pairs of blocks of consecutive tokens, of shape `[num_blocks, num_blocks, len(sizes)]`
+    """
+    coords = _nd_coords(sizes, torch.arange(math.prod(sizes)))
+    mins, maxs = zip(*[_block_min_max(c, block_size) for c in coords])
+    coord_min, coord_max = torch.stack(mins, 1), torch.stack(maxs, 1)
+    return (
+        coord_min[:, None] - coord_max[None],
+        coord_max[:, None] - coord_min[None],
+    )
+
+
+class Pattern:
+    r"""
+    A lazy attention pattern: a boolean `[num_queries, num_keys]` matrix defined by
+    a predicate on the query/key indices, which is never materialized as a whole.
+
+    Patterns are built from structured primitives (:class:`BandPattern`, :class:`GroupPattern`,
+    :class:`AxialPattern` ...), combined with `|`, `&` and `~`, and converted with
+    `to_sparse_cs`, `to_layout` or `to_attn_bias`. The conversions evaluate the pattern
+    block by block, using the structure of the primitives to skip the blocks which are
+    known to be empty or full, so that they only evaluate the predicate
+    on the "boundary" of the pattern.
+    """
+
+    #: Maximum number of elements evaluated at once
+    EVAL_CHUNK_NUMEL = 2**22
+
+    def __init__(self, shape: Tuple[int, int]) -> None:
+        self.shape = (int(shape[0]), int(shape[1]))
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        """
+        Whether the queries `rows` attend to the keys `cols`,
+        where `rows` and `cols` are broadcastable tensors of indices
+        """
+        raise NotImplementedError()
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns `(any, all)` for the blocks of `block_size x block_size` elements
+        (the last ones may be smaller), of shape `[num_row_blocks, num_col_blocks]`
+        or broadcastable to it: `any` is False only if the block is empty,
+        and `all` is True only if it is full.
+        The default says nothing, so that the blocks are evaluated elementwise.
+        """
+        shape = (
+            -(-self.shape[0] // block_size),
+            -(-self.shape[1] // block_size),
+        )
+        return torch.ones(shape, dtype=torch.bool), torch.zeros(shape, dtype=torch.bool)
+
+    def _check_shape(self, other: "Pattern") -> None:
+        if not isinstance(other, Pattern):
+            raise TypeError(f"Expected a Pattern, got {type(other)}")
+        if other.shape != self.shape:
+            raise ValueError(
+                f"Can't combine patterns of different shapes {self.shape} and {other.shape}"
+            )
+
+    def __or__(self, other: "Pattern") -> "Pattern":
+        self._check_shape(other)
+        return _UnionPattern(self, other)
+
+    def __and__(self, other: "Pattern") -> "Pattern":
+        self._check_shape(other)
+        return _IntersectionPattern(self, other)
+
+    def __invert__(self) -> "Pattern":
+        return _ComplementPattern(self)
+
+    def _blocks(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Returns the blocks which are full, and those which need to be evaluated"""
+        any_, all_ = self._block_bounds(block_size)
+        shape = (
+            -(-self.shape[0] // block_size),
+            -(-self.shape[1] // block_size),
+        )
+        any_, all_ = any_.expand(shape), all_.expand(shape)
+        return all_, any_ & ~all_
+
+    def _eval_blocks(
+        self, block_rows: torch.Tensor, block_cols: torch.Tensor, block_size: int
+    ) -> Iterator[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """
+        Evaluates the blocks `(block_rows[i], block_cols[i])` by chunks,
+        yields the rows/columns indices in the blocks and the mask
+        """
+        offsets = torch.arange(block_size)
+        chunk = max(1, self.EVAL_CHUNK_NUMEL // (block_size * block_size))
+        for start in range(0, block_rows.shape[0], chunk):
+            rows = block_rows[start : start + chunk, None, None] * block_size
+            cols = block_cols[start : start + chunk, None, None] * block_size
+            rows = rows + offsets[None, :, None]
+            cols = cols + offsets[None, None, :]
+            valid = (rows < self.shape[0]) & (cols < self.shape[1])
+            mask = self.mask(
+                rows.clamp(max=self.shape[0] - 1), cols.clamp(max=self.shape[1] - 1)
+            )
+            yield rows, cols, mask & valid
+
+    def to_dense(self) -> torch.Tensor:
+        """Materializes the pattern as a dense boolean tensor"""
+        rows = torch.arange(self.shape[0])[:, None]
+        cols = torch.arange(self.shape[1])[None]
+        return self.mask(rows, cols).expand(self.shape).clone()
+
+    def to_layout(self, block_size: int) -> torch.Tensor:
+        """
+        Returns the block-sparse layout covering the pattern,
+        as :func:`pattern_to_layout` does for a dense mask
+        """
+        assert (
+            self.shape[0] % block_size == 0 and self.shape[1] % block_size == 0
+        ), "We're only handling masks divisible by block_size"
+        full, partial = self._blocks(block_size)
+        layout = full.clone()
+        block_rows, block_cols = partial.nonzero(as_tuple=True)
+        chunk_start = 0
+        for _, _, mask in self._eval_blocks(block_rows, block_cols, block_size):
+            chunk_end = chunk_start + mask.shape[0]
+            layout[
+                block_rows[chunk_start:chunk_end], block_cols[chunk_start:chunk_end]
+            ] = mask.flatten(1).any(1)
+            chunk_start = chunk_end
+        return layout.long()
+
+    def nonzero(self, block_size: int = 32) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Row and column indices of the elements of the pattern, in row-major order"""
+        full, partial = self._blocks(block_size)
+        block_rows, block_cols = (full | partial).nonzero(as_tuple=True)
+        is_full = full[block_rows, block_cols]
+        all_rows, all_cols = [], []
+        chunk_start = 0
+        for rows, cols, mask in self._eval_blocks(block_rows, block_cols, block_size):
+            chunk_end = chunk_start + mask.shape[0]
+            valid = (rows < self.shape[0]) & (cols < self.shape[1])
+            mask = torch.where(is_full[chunk_start:chunk_end, None, None], valid, mask)
+            all_rows.append(rows.expand(mask.shape)[mask])
+            all_cols.append(cols.expand(mask.shape)[mask])
+            chunk_start = chunk_end
+        if not all_rows:
+            return torch.zeros([0], dtype=torch.long), torch.zeros(
+                [0], dtype=torch.long
+            )
+        rows, cols = torch.cat(all_rows), torch.cat(all_cols)
+        order = torch.argsort(rows * self.shape[1] + cols)
+        return rows[order], cols[order]
+
+    def to_sparse_cs(self, device: Optional[torch.device] = None) -> SparseCS:
+        """
+        Returns the pattern as a :class:`SparseCS` matrix, like `SparseCS(pattern.to_dense())`
+        (including the truncation of the number of elements to a multiple of 4)
+        """
+        rows, cols = self.nonzero()
+        # for now, our kernels assume that we have the number of
+        # nnz to be divisible by 4
+        nnz = rows.shape[0] - rows.shape[0] % 4
+        rows, cols = rows[:nnz], cols[:nnz]
+        row_offsets = torch.nn.functional.pad(
+            rows.bincount(minlength=self.shape[0]).cumsum(0, dtype=torch.int32), (1, 0)
+        )
+        values = torch.ones([1, nnz], dtype=torch.bool)
+        matrix = SparseCSRTensor(
+            row_offsets, cols.to(torch.int32), values, (1, *self.shape)
+        )
+        return SparseCS._wrap(matrix.to(device or torch.device("cpu")))
+
+    def to_attn_bias(self) -> Optional[AttentionBias]:
+        """
+        Returns the :class:`xformers.ops.fmha.attn_bias.AttentionBias` to use with
+        `memory_efficient_attention` to attend to this pattern (`None` for a dense pattern),
+        when there is one. Raises `ValueError` otherwise.
+        """
+        raise ValueError(f"{type(self).__name__} has no equivalent AttentionBias")
+
+
+class BandPattern(Pattern):
+    r"""
+    Queries `i` attend to the keys `j` such that `-left <= j - i <= right`
+    (`None` meaning unbounded). For instance, `BandPattern(shape, None, 0)` is causal.
+    """
+
+    def __init__(
+        self, shape: Tuple[int, int], left: Optional[int], right: Optional[int]
+    ) -> None:
+        super().__init__(shape)
+        self.left = left
+        self.right = right
+
+    def _lo_hi(self) -> Tuple[int, int]:
+        lo = -self.shape[0] if self.left is None else -self.left
+        hi = self.shape[1] if self.right is None else self.right
+        return lo, hi
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        lo, hi = self._lo_hi()
+        diagonal = cols - rows
+        return (diagonal >= lo) & (diagonal <= hi)
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        lo, hi = self._lo_hi()
+        row_starts, row_ends = _block_starts_ends(self.shape[0], block_size)
+        col_starts, col_ends = _block_starts_ends(self.shape[1], block_size)
+        row_starts, row_ends = row_starts[:, None], row_ends[:, None]
+        min_diagonal = col_starts - (row_ends - 1)
+        max_diagonal = (col_ends - 1) - row_starts
+        any_ = (max_diagonal >= lo) & (min_diagonal <= hi)
+        all_ = (min_diagonal >= lo) & (max_diagonal <= hi)
+        return any_, all_
+
+    def to_attn_bias(self) -> Optional[AttentionBias]:
+        if self.left is None and self.right is None:
+            return None
+        if self.left is None and self.right == 0:
+            return LowerTriangularMask()
+        # Biases other than `LowerTriangularMask` are aligned on the bottom-right
+        offset = self.shape[1] - self.shape[0]
+        if self.left is not None and self.right is not None:
+            if self.left + offset >= 0 and self.right - offset >= 0:
+                return LocalAttentionFromBottomRightMask(
+                    window_left=self.left + offset, window_right=self.right - offset
+                )
+        return super().to_attn_bias()
+
+
+class GroupPattern(Pattern):
+    r"""
+    Queries attend to the keys in the same group: `query_groups[i] == key_groups[j]`.
+    For instance, non-overlapping local windows or the windows of Swin.
+    """
+
+    def __init__(
+        self, query_groups: torch.Tensor, key_groups: Optional[torch.Tensor] = None
+    ) -> None:
+        if key_groups is None:
+            key_groups = query_groups
+        super().__init__((query_groups.shape[0], key_groups.shape[0]))
+        self.query_groups = query_groups.long()
+        self.key_groups = key_groups.long()
+
+    @classmethod
+    def windows(cls, attn_size: int, window_size: int) -> "GroupPattern":
+        """Non-overlapping windows of `window_size` consecutive tokens"""
+        return cls(torch.arange(attn_size) // window_size)
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        return self.query_groups[rows] == self.key_groups[cols]
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        q_min, q_max = _block_min_max(self.query_groups, block_size)
+        k_min, k_max = _block_min_max(self.key_groups, block_size)
+        q_min, q_max = q_min[:, None], q_max[:, None]
+        any_ = (q_min <= k_max[None]) & (k_min[None] <= q_max)
+        all_ = (q_min == q_max) & (k_min[None] == k_max[None]) & (q_min == k_min[None])
+        return any_, all_
+
+    def _seqlens(self) -> Optional[List[int]]:
+        """Lengths of the groups if they are contiguous, and the same for queries and keys"""
+        if not torch.equal(self.query_groups, self.key_groups):
+            return None
+        _, counts = torch.unique_consecutive(self.query_groups, return_counts=True)
+        if counts.shape[0] != self.query_groups.unique().shape[0]:
+            return None
+        return counts.tolist()
+
+    def to_attn_bias(self) -> Optional[AttentionBias]:
+        seqlens = self._seqlens()
+        if seqlens is None:
+            return super().to_attn_bias()
+        return BlockDiagonalMask.from_seqlens(seqlens, device=torch.device("cpu"))
+
+
+class AxialPattern(Pattern):
+    r"""
+    Tokens on a grid of shape `sizes` attend to the tokens which differ
+    along at most one dimension, as :func:`axial_nd_pattern`
+    """
+
+    def __init__(self, *sizes: int) -> None:
+        numel = math.prod(sizes)
+        super().__init__((numel, numel))
+        self.sizes = sizes
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        is_different = [
+            r != c
+            for r, c in zip(_nd_coords(self.sizes, rows), _nd_coords(self.sizes, cols))
+        ]
+        num_different = torch.stack(torch.broadcast_tensors(*is_different)).sum(0)
+        return num_different < 2
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        diff_min, diff_max = _grid_block_diff_ranges(self.sizes, block_size)
+        always_different = (diff_min > 0) | (diff_max < 0)
+        maybe_different = (diff_min != 0) | (diff_max != 0)
+        return always_different.sum(-1) < 2, maybe_different.sum(-1) < 2
+
+
+class LocalNDPattern(Pattern):
+    r"""
+    Tokens on a grid of shape `sizes` attend to the tokens which are
+    closer than `distance` for the `p`-norm, as :func:`local_nd_pattern`
+    """
+
+    def __init__(self, *sizes: int, distance: float, p: float = 2.0) -> None:
+        numel = math.prod(sizes)
+        super().__init__((numel, numel))
+        self.sizes = sizes
+        self.distance = distance
+        self.p = p
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        diffs = torch.stack(
+            torch.broadcast_tensors(
+                *[
+                    (r - c).abs().double()
+                    for r, c in zip(
+                        _nd_coords(self.sizes, rows), _nd_coords(self.sizes, cols)
+                    )
+                ]
+            )
+        )
+        return self._norm(diffs, 0) < self.distance
+
+    def _norm(self, diffs: torch.Tensor, dim: int) -> torch.Tensor:
+        if self.p == 0:
+            return (diffs != 0).sum(dim)
+        if self.p == math.inf:
+            return diffs.amax(dim)
+        return (diffs**self.p).sum(dim) ** (1 / self.p)
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        diff_min, diff_max = _grid_block_diff_ranges(self.sizes, block_size)
+        # Closest and furthest distances along each dimension
+        closest = torch.maximum(diff_min, -diff_max).clamp(min=0).double()
+        furthest = torch.maximum(diff_max, -diff_min).double()
+        any_ = self._norm(closest, -1) < self.distance
+        all_ = self._norm(furthest, -1) < self.distance
+        return any_, all_
+
+
+class Dilated2DPattern(Pattern):
+    r"""
+    Pixels of a `H x W` image attend to 1 every `k` pixels, as :func:`dilated_2d_pattern`
+    """
+
+    def __init__(self, H: int, W: int, k: int = 2) -> None:
+        super().__init__((H * W, H * W))
+        self.sizes = (H, W)
+        self.k = k
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        (r_h, r_w), (c_h, c_w) = _nd_coords(self.sizes, rows), _nd_coords(
+            self.sizes, cols
+        )
+        return ((r_h - c_h) % self.k == 0) & ((r_w - c_w) % self.k == 0)
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        diff_min, diff_max = _grid_block_diff_ranges(self.sizes, block_size)
+        # Whether there is a multiple of `k` between the bounds
+        any_ = (diff_max // self.k * self.k >= diff_min).all(-1)
+        all_ = ((diff_min == diff_max) & (diff_min % self.k == 0)).all(-1)
+        return any_, all_
+
+
+class GlobalTokenPattern(Pattern):
+    r"""
+    Global tokens attend to all the tokens and are attended by all the tokens,
+    as :func:`global_token_pattern`
+    """
+
+    def __init__(self, attention_query_mask: torch.Tensor) -> None:
+        assert attention_query_mask.ndim == 1
+        assert attention_query_mask.dtype == torch.bool
+        super().__init__((attention_query_mask.shape[0],) * 2)
+        self.is_global = attention_query_mask
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        return self.is_global[rows] | self.is_global[cols]
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        all_global, any_global = _block_min_max(self.is_global.int(), block_size)
+        all_global, any_global = all_global.bool(), any_global.bool()
+        any_ = any_global[:, None] | any_global[None]
+        all_ = all_global[:, None] | all_global[None]
+        return any_, all_
+
+
+class LayoutPattern(Pattern):
+    r"""
+    The pattern of a 2d block-sparse `layout` with blocks of `block_size x block_size`,
+    as :func:`layout_to_pattern` without materializing it
+    """
+
+    def __init__(self, layout: torch.Tensor, block_size: int) -> None:
+        assert layout.ndim == 2
+        super().__init__((layout.shape[0] * block_size, layout.shape[1] * block_size))
+        self.layout = layout.bool()
+        self.block_size = block_size
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        return self.layout[rows // self.block_size, cols // self.block_size]
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        if block_size % self.block_size != 0:
+            return super()._block_bounds(block_size)
+        # Each block covers `ratio x ratio` blocks of the layout
+        ratio = block_size // self.block_size
+        layout = self.layout.float()[None]
+        pad = [0, (-layout.shape[2]) % ratio, 0, (-layout.shape[1]) % ratio]
+        any_ = torch.nn.functional.max_pool2d(
+            torch.nn.functional.pad(layout, pad, value=0.0), ratio
+        )
+        all_ = -torch.nn.functional.max_pool2d(
+            torch.nn.functional.pad(-layout, pad, value=-1.0), ratio
+        )
+        return any_[0].bool(), all_[0].bool()
+
+
+class DensePattern(Pattern):
+    r"""A pattern given by a dense boolean mask, to combine it with lazy patterns"""
+
+    def __init__(self, mask: torch.Tensor) -> None:
+        assert mask.ndim == 2
+        super().__init__((mask.shape[0], mask.shape[1]))
+        self.dense_mask = mask.bool()
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        return self.dense_mask[rows, cols]
+
+
+class _UnionPattern(Pattern):
+    def __init__(self, a: Pattern, b: Pattern) -> None:
+        super().__init__(a.shape)
+        self.a, self.b = a, b
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        return self.a.mask(rows, cols) | self.b.mask(rows, cols)
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        any_a, all_a = self.a._block_bounds(block_size)
+        any_b, all_b = self.b._block_bounds(block_size)
+        return any_a | any_b, all_a | all_b
+
+
+class _IntersectionPattern(Pattern):
+    def __init__(self, a: Pattern, b: Pattern) -> None:
+        super().__init__(a.shape)
+        self.a, self.b = a, b
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        return self.a.mask(rows, cols) & self.b.mask(rows, cols)
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        any_a, all_a = self.a._block_bounds(block_size)
+        any_b, all_b = self.b._block_bounds(block_size)
+        return any_a & any_b, all_a & all_b
+
+    def to_attn_bias(self) -> Optional[AttentionBias]:
+        # Causal (possibly local) attention within contiguous groups
+        for groups, band in [(self.a, self.b), (self.b, self.a)]:
+            if (
+                isinstance(groups, GroupPattern)
+                and isinstance(band, BandPattern)
+                and band.right == 0
+            ):
+                seqlens = groups._seqlens()
+                if seqlens is None:
+                    continue
+                bias = BlockDiagonalMask.from_seqlens(
+                    seqlens, device=torch.device("cpu")
+                )
+                if band.left is None:
+                    return bias.make_causal()
+                return bias.make_local_attention(band.left + 1)
+        return super().to_attn_bias()
+
+
+class _ComplementPattern(Pattern):
+    def __init__(self, a: Pattern) -> None:
+        super().__init__(a.shape)
+        self.a = a
+
+    def mask(self, rows: torch.Tensor, cols: torch.Tensor) -> torch.Tensor:
+        return ~self.a.mask(rows, cols)
+
+    def _block_bounds(self, block_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        any_a, all_a = self.a._block_bounds(block_size)
+        return ~all_a, ~any_a
@@ -6,7 +6,7 @@
 
 from abc import ABCMeta, abstractmethod
 from dataclasses import asdict, dataclass
-from typing import Optional, Type, TypeVar
+from typing import Any, NamedTuple, Optional, Tuple, Type, TypeVar
 
 import torch
 import torch.nn as nn
@@ -28,6 +28,13 @@ class AttentionConfig:
 Self = TypeVar("Self", bound="Attention")
 
 
+class _TokensState(NamedTuple):
+    # All the tokens seen so far, for the attentions which cannot summarize them
+    q: torch.Tensor
+    k: torch.Tensor
+    v: torch.Tensor
+
+
 # Define the common interface, every attention block needs to derive from it
 class Attention(nn.Module, metaclass=ABCMeta):
     r"""The base Attention mechanism, which is typically a sub-part of the multi-head attention"""
@@ -78,6 +85,37 @@ class Attention(nn.Module, metaclass=ABCMeta):
     ) -> torch.Tensor:
         raise NotImplementedError
 
+    def init_state(self) -> Any:
+        """
+        State of an incremental decoding (see :meth:`step`) before the first token
+        """
+        return None
+
+    def step(
+        self,
+        q: torch.Tensor,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        state: Any = None,
+    ) -> Tuple[torch.Tensor, Any]:
+        """
+        Incremental decoding: attention of the new tokens `q`, `k`, `v` (typically one at a time)
+        given all the previous ones, as summed up in `state`. This is what `forward` would give
+        for the new tokens on the sequence so far.
+
+        Returns the attention of the new tokens and the updated state.
+
+        By default all the tokens are kept, and the attention is computed again on the whole
+        sequence. Attentions which can sum up the past in a constant size (linear attentions)
+        override this, so that each step has a constant cost.
+        """
+        num_new = q.shape[-2]
+        if state is not None:
+            q, k, v = (
+                torch.cat([past, new], dim=-2) for past, new in zip(state, (q, k, v))
+            )
+        return self(q, k, v)[..., -num_new:, :], _TokensState(q, k, v)
+
     @staticmethod
     def _maybe_pad_sequence(x: torch.Tensor, mask: torch.Tensor):
         """
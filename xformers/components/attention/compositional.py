@@ -29,6 +29,7 @@ from xformers.components.attention import (
     register_attention,
 )
 from xformers.components.attention.core import _softmax
+from xformers.components.attention.mask_cache import get_causal_mask
 from xformers.components.input_projection import InputProjection, InputProjectionConfig
 
 
@@ -245,9 +246,11 @@ class CompositionalAttention(Attention):
 
         # Init causal mask if needed, now that we know the context length
         if self.causal and (
-            self._causal_mask is None or self._causal_mask.shape[0] != Sk
+            self._causal_mask is None
+            or self._causal_mask.shape[1:] != (Sq, Sq)
+            or self._causal_mask.device != q.device
         ):
-            self._causal_mask = AttentionMask.make_causal(Sq, Sq, device=q.device)
+            self._causal_mask = get_causal_mask(Sq, Sq, device=q.device)
 
         # Convenience, create an attention mask if a tensor was passed
         # This sanitizes different mask types being passed, from now on it's additive
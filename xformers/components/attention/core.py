@@ -14,8 +14,7 @@ import torch
 from xformers import _has_cpp_library
 from xformers.components.attention.attention_mask import AttentionMask
 
-if _has_cpp_library:
-    from ._sputnik_sparse import SparseCS
+from ._sputnik_sparse import SparseCS
 
 logger = logging.getLogger("xformers")
 
@@ -68,9 +67,10 @@ def _matmul_with_mask(
     if mask is None:
         return a @ b
 
+    if isinstance(mask, SparseCS) and mask.dtype == torch.bool:
+        return mask.matmul_with_mask(a, b)
+
     if _has_cpp_library and mask.dtype == torch.bool:
-        if isinstance(mask, SparseCS):
-            return mask.matmul_with_mask(a, b)
         if mask.is_sparse:
             # perform broadcasting if needed
             mask = _broadcast_batch(mask, a.shape[0])
@@ -81,12 +81,10 @@ def _matmul_with_mask(
         return torch.ops.xformers.matmul_with_mask(a, b, mask)
 
     # Non optimized codepath
-    if _has_cpp_library:
-        assert not isinstance(mask, SparseCS)
+    assert not isinstance(mask, SparseCS)
 
     att = a @ b
     if mask.dtype == torch.bool:
-        assert not isinstance(mask, SparseCS)
         if mask.ndim == 2:
             mask = mask.unsqueeze(0).expand(att.shape[0], -1, -1)
         # mask is presumed false == ignore
@@ -95,8 +93,7 @@ def _matmul_with_mask(
         # mask is presumed additive
         # repeat if batch sizes don't match
         if (
-            not isinstance(mask, SparseCS)
-            and mask.ndim == 3
+            mask.ndim == 3
             and mask.shape[0] != att.shape[0]
             and (att.shape[0] % mask.shape[0]) == 0
         ):
@@ -108,7 +105,7 @@ def _matmul_with_mask(
 
 
 def _softmax(a: torch.Tensor, causal: bool = False) -> torch.Tensor:
-    if _has_cpp_library and isinstance(a, SparseCS):
+    if isinstance(a, SparseCS):
         return a.softmax()
 
     if a.is_sparse:
@@ -154,11 +151,10 @@ if _has_cpp_library:
 
 
 def bmm(a: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
-    if _has_cpp_library:
-        if isinstance(a, SparseCS):
-            return a.spmm(b)
-        if a.is_sparse:
-            return _sparse_bmm(a, b)
+    if isinstance(a, SparseCS):
+        return a.spmm(b)
+    if _has_cpp_library and a.is_sparse:
+        return _sparse_bmm(a, b)
     return a @ b
 
 
@@ -167,31 +163,26 @@ def _apply_dropout(att, dropout):
         return att
 
     # Dropout chokes on sparse tensors
-    if _has_cpp_library:
-        if isinstance(att, SparseCS):
-            values = att.values.clone()
-            values = dropout(values)
-            att = SparseCS.wrap(
-                att.shape,
-                values,
-                att.row_indices,
-                att.row_offsets,
-                att.column_indices,
-                att._transp_info,
-            )
-        elif att.is_sparse:
-            att = att.coalesce()
-            values = att.values().clone()  # protect against in-place dropout
-            values = dropout(values)
-            att = torch.sparse_coo_tensor(att.indices(), values, att.shape)
-        else:
-            # Simple dense case
-            att = dropout(att)
-
-        return att
+    if isinstance(att, SparseCS):
+        values = att.values.clone()
+        values = dropout(values)
+        att = SparseCS.wrap(
+            att.shape,
+            values,
+            att.row_indices,
+            att.row_offsets,
+            att.column_indices,
+            att._transp_info,
+        )
+    elif att.is_sparse:
+        att = att.coalesce()
+        values = att.values().clone()  # protect against in-place dropout
+        values = dropout(values)
+        att = torch.sparse_coo_tensor(att.indices(), values, att.shape)
+    else:
+        # Simple dense case
+        att = dropout(att)
 
-    # Non optimized vanilla dropout
-    att = dropout(att)
     return att
 
 
@@ -228,10 +219,8 @@ def scaled_dot_product_attention(
     att_mask: Optional[Union[AttentionMask, "SparseCS", torch.Tensor]],
     dropout: Optional[torch.nn.Module] = None,
 ) -> torch.Tensor:
-    autocast_disabled = (
-        _has_cpp_library
-        and isinstance(att_mask, SparseCS)
-        or (att_mask is not None and att_mask.is_sparse)
+    autocast_disabled = isinstance(att_mask, SparseCS) or (
+        att_mask is not None and att_mask.is_sparse
     )
     with torch.amp.autocast("cuda", enabled=False) if autocast_disabled else nullcontext():  # type: ignore
         if autocast_disabled:
@@ -6,7 +6,7 @@
 import logging
 import math
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import NamedTuple, Optional, Tuple
 
 import torch
 import torch.nn as nn
@@ -35,6 +35,20 @@ class FavorAttentionConfig(AttentionConfig):
         int
     ] = None  # The number of iterations before the random features are re-drawn from scratch
     feature_map: Optional[FeatureMapType] = None
+    causal_chunk_size: Optional[
+        int
+    ] = None  # The sequence chunks of the causal prefix sums
+
+
+class FavorState(NamedTuple):
+    """
+    Running state of the FAVOR attention, for causal chunks or incremental decoding:
+    the sums over all the keys seen so far of `k' v^T` and `k'`, with `k'` the keys
+    in the random features space
+    """
+
+    kv: torch.Tensor  # [..., dim_features, dim_value]
+    k_sum: torch.Tensor  # [..., dim_features]
 
 
 @register_attention("favor", FavorAttentionConfig)
@@ -48,6 +62,7 @@ class FavorAttention(Attention):
         iter_before_redraw: Optional[int] = None,
         feature_map_type: FeatureMapType = FeatureMapType.SMReg,
         normalize_inputs: bool = False,
+        causal_chunk_size: int = 128,
         *_,
         **__,
     ):
@@ -63,6 +78,8 @@ class FavorAttention(Attention):
             iter_before_redraw (int): the number of steps (forward calls) before a redraw of the features
             feature_map_type (FeatureMapType): the type of feature map being used,
             for instance orthogonal random features.
+            causal_chunk_size (int): the causal attention is computed on chunks of this many tokens,
+            carrying the sums over the previous chunks
 
         .. _Performers: https://arxiv.org/pdf/2009.14794v1.pdf
         """
@@ -75,6 +92,7 @@ class FavorAttention(Attention):
             else iter_before_redraw
         )  # This will be used for both key and query
         self.normalize_inputs = normalize_inputs
+        self.causal_chunk_size = causal_chunk_size
         self.feature_map_type = feature_map_type
         self.attn_drop = nn.Dropout(dropout, inplace=True)
 
@@ -117,22 +135,43 @@ class FavorAttention(Attention):
 
     @staticmethod
     def _causal_attention(
-        k_prime: torch.Tensor, q_prime: torch.Tensor, v: torch.Tensor
-    ) -> Tuple[torch.Tensor, torch.Tensor]:
-        # Algorithm 1 in the paper
-        ref_v = torch.ones_like(v.unsqueeze(2))  # BATCH x SEQ x 1 x EMB
-        Gps = k_prime.unsqueeze(3) * v.unsqueeze(2)
-        Grenorm = k_prime.unsqueeze(3) * ref_v
+        k_prime: torch.Tensor,
+        q_prime: torch.Tensor,
+        v: torch.Tensor,
+        chunk_size: int = 128,
+        state: Optional[FavorState] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor, FavorState]:
+        # Algorithm 1 in the paper, the prefix sums of k' v^T being computed one chunk at a time:
+        # within a chunk the attention is quadratic, the previous chunks are summed up in the
+        # running state. This keeps the memory use in O(chunk_size^2 + dim_features x dim_value)
+        # instead of materializing the [..., SEQ, FEATURES, EMB] prefix sums
+        if state is None:
+            state = FavorState(
+                kv=k_prime.new_zeros(
+                    k_prime.shape[:-2] + (k_prime.shape[-1], v.shape[-1])
+                ),
+                k_sum=k_prime.new_zeros(k_prime.shape[:-2] + k_prime.shape[-1:]),
+            )
+        kv, k_sum = state
 
-        # Consolidate against the feature dimension
-        att_raw = torch.einsum("bcfe,bcf->bce", Gps, q_prime)
-        att_norm = torch.einsum("bcfe,bcf->bce", Grenorm, q_prime)
+        att_raw, att_norm = [], []
+        for start in range(0, k_prime.shape[-2], chunk_size):
+            q_c = q_prime[..., start : start + chunk_size, :]
+            k_c = k_prime[..., start : start + chunk_size, :]
+            v_c = v[..., start : start + chunk_size, :]
 
-        # Cumulative sum over the sequence
-        att_raw = att_raw.cumsum(2)
-        att_norm = att_norm.cumsum(2)
+            scores = (q_c @ k_c.transpose(-2, -1)).tril()
+            att_raw.append(scores @ v_c + q_c @ kv)
+            att_norm.append(scores.sum(-1, keepdim=True) + q_c @ k_sum.unsqueeze(-1))
 
-        return att_raw, att_norm
+            kv = kv + k_c.transpose(-2, -1) @ v_c
+            k_sum = k_sum + k_c.sum(-2)
+
+        return (
+            torch.cat(att_raw, dim=-2),
+            torch.cat(att_norm, dim=-2),
+            FavorState(kv, k_sum),
+        )
 
     def forward(
         self,
@@ -147,6 +186,16 @@ class FavorAttention(Attention):
         k_prime = self.feature_map(k)
         q_prime = self.feature_map(q)
 
+        return self._attention(k_prime, q_prime, v)[0]
+
+    def _attention(
+        self,
+        k_prime: torch.Tensor,
+        q_prime: torch.Tensor,
+        v: torch.Tensor,
+        state: Optional[FavorState] = None,
+        incremental: bool = False,
+    ) -> Tuple[torch.Tensor, Optional[FavorState]]:
         with autocast("cuda", enabled=False):
             # The softmax kernel approximation for Favor will easily overflow
             # Force the computations here to stay in fp32 for numerical stability
@@ -155,14 +204,25 @@ class FavorAttention(Attention):
             q_prime = self._maybe_promote(q_prime)
             v = self._maybe_promote(v)
 
-            if not self.causal:
+            if self.causal:
+                # Actually compute attention
+                att_raw, att_normalization, state = self._causal_attention(
+                    k_prime, q_prime, v, self.causal_chunk_size, state
+                )
+            elif incremental:
+                # The queries attend to all the keys so far, which are summed up in the state
+                kv = k_prime.transpose(-2, -1) @ v
+                k_sum = k_prime.sum(-2)
+                if state is not None:
+                    kv, k_sum = kv + state.kv, k_sum + state.k_sum
+                state = FavorState(kv, k_sum)
+                att_raw = q_prime @ kv
+                att_normalization = q_prime @ k_sum.unsqueeze(-1)
+            else:
                 att_normalization = q_prime @ (
                     k_prime.transpose(-2, -1) @ torch.ones_like(v)
                 )
                 att_raw = q_prime @ (k_prime.transpose(-2, -1) @ v)
-            else:
-                # Actually compute attention
-                att_raw, att_normalization = self._causal_attention(k_prime, q_prime, v)
 
             # Normalize
             att = att_raw / att_normalization
@@ -170,4 +230,38 @@ class FavorAttention(Attention):
         if self.attn_drop is not None:
             att = self.attn_drop(att)
 
-        return att
+        return att, state
+
+    def step(
+        self,
+        q: torch.Tensor,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        state: Optional[FavorState] = None,
+    ) -> Tuple[torch.Tensor, FavorState]:
+        """
+        Attention of the new tokens `q`, `k`, `v` (typically one at a time) over them
+        and all the previous tokens, summed up in `state`. This is what `forward` would give
+        on the sequence so far, with a constant cost per token, for autoregressive decoding.
+
+        Returns the attention of the new tokens and the updated state.
+
+        .. note: the random features are not redrawn in the middle of a sequence
+        """
+        assert (
+            not self.normalize_inputs
+        ), "The input normalization depends on the whole sequence, it cannot be streamed"
+
+        iter_counter = self.feature_map._iter_counter
+        if state is not None:
+            self.feature_map._iter_counter = 0
+
+        k_prime = self.feature_map(k)
+        q_prime = self.feature_map(q)
+
+        if state is not None:
+            self.feature_map._iter_counter = iter_counter
+
+        att, new_state = self._attention(k_prime, q_prime, v, state, incremental=True)
+        assert new_state is not None
+        return att, new_state
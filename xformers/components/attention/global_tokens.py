@@ -3,7 +3,7 @@
 # This source code is licensed under the BSD license found in the
 # LICENSE file in the root directory of this source tree.
 
-
+import hashlib
 from dataclasses import dataclass
 from typing import Optional, Union
 
@@ -23,6 +23,7 @@ from xformers.components.attention.attention_patterns import (
     global_token_pattern,
 )
 from xformers.components.attention.core import scaled_dot_product_attention
+from xformers.components.attention.mask_cache import get_cached_mask
 
 
 @dataclass
@@ -66,16 +67,24 @@ class GlobalAttention(Attention):
         ), "A N x 1 query mask is expected"
 
         self.attn_drop = nn.Dropout(dropout, inplace=False)
-        self.attention_mask = global_token_pattern(attention_query_mask[:, 0])
         self.force_sparsity = force_sparsity
-
-        if causal:
-            self.attention_mask &= causal_1d_pattern(attention_query_mask.shape[1])
-
-        self.attention_mask = (
-            sparsify(self.attention_mask)
-            if self.force_sparsity
-            else maybe_sparsify(self.attention_mask)
+        self.causal = causal
+
+        # The same query mask gives the same attention mask, possibly shared with other layers
+        query_mask_hash = hashlib.sha256(
+            attention_query_mask.cpu().numpy().tobytes()
+        ).hexdigest()
+        self._mask_key = (
+            "global",
+            tuple(attention_query_mask.shape),
+            query_mask_hash,
+            causal,
+            force_sparsity,
+        )
+        self.attention_mask = get_cached_mask(
+            self._mask_key,
+            attention_query_mask.device,
+            lambda device: self._get_global_mask(attention_query_mask).to(device),
         )
 
         # Properties specific to this attention mechanism
@@ -83,6 +92,14 @@ class GlobalAttention(Attention):
         self.supports_attention_mask = False
         self.supports_key_padding_mask = False
 
+    def _get_global_mask(self, attention_query_mask: torch.Tensor):
+        mask = global_token_pattern(attention_query_mask[:, 0])
+
+        if self.causal:
+            mask &= causal_1d_pattern(attention_query_mask.shape[1])
+
+        return sparsify(mask) if self.force_sparsity else maybe_sparsify(mask)
+
     def forward(
         self,
         q: torch.Tensor,
@@ -94,7 +111,9 @@ class GlobalAttention(Attention):
     ):
         # Make sure that the mask is on the right device
         if self.attention_mask.device != q.device:
-            self.attention_mask = self.attention_mask.to(q.device)
+            self.attention_mask = get_cached_mask(
+                self._mask_key, q.device, self.attention_mask.to
+            )
 
         # Mask-aware attention
         if att_mask is not None:
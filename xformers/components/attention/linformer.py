@@ -5,7 +5,7 @@
 
 
 from dataclasses import dataclass
-from typing import Optional
+from typing import NamedTuple, Optional, Tuple
 
 import torch
 import torch.nn as nn
@@ -20,6 +20,17 @@ class LinformerSelfAttentionConfig(AttentionConfig):
     k: Optional[int]  # dimension of the internal space
 
 
+class LinformerState(NamedTuple):
+    """
+    Incremental decoding state of the Linformer attention, the projections of the
+    keys and values seen so far, and their number
+    """
+
+    position: int
+    k_projected: torch.Tensor
+    v_projected: torch.Tensor
+
+
 @register_attention("linformer", LinformerSelfAttentionConfig)
 class LinformerAttention(Attention):
     def __init__(
@@ -72,3 +83,33 @@ class LinformerAttention(Attention):
         y = self.attn_drop(y)
 
         return y[:, :-padding, :] if padding > 0 else y
+
+    def step(
+        self,
+        q: torch.Tensor,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        state: Optional[LinformerState] = None,
+    ) -> Tuple[torch.Tensor, LinformerState]:
+        """
+        Attention of the new tokens over the sequence so far, padded as in `forward`.
+        The projections of the sequence are updated with the new keys and values only,
+        so each step has a constant cost.
+        """
+        position = 0 if state is None else state.position
+        end = position + k.shape[-2]
+        assert (
+            end <= self.seq_len
+        ), "The sequence is longer than the Linformer projections"
+
+        k_projected = self.E.weight[:, position:end] @ k
+        v_projected = self.F.weight[:, position:end] @ v
+        if state is not None:
+            k_projected = k_projected + state.k_projected
+            v_projected = v_projected + state.v_projected
+
+        y = scaled_dot_product_attention(
+            q=q, k=k_projected, v=v_projected, att_mask=None, dropout=self.attn_drop
+        )
+
+        return self.attn_drop(y), LinformerState(end, k_projected, v_projected)
@@ -23,6 +23,7 @@ from xformers.components.attention.attention_patterns import (
     local_1d_pattern,
 )
 from xformers.components.attention.core import scaled_dot_product_attention
+from xformers.components.attention.mask_cache import get_cached_mask
 
 
 @dataclass
@@ -102,9 +103,22 @@ class LocalAttention(Attention):
         *args,
         **kwargs,
     ):
-        # Local window attention masking
-        if self.attention_mask is None or self.attention_mask.shape[1] != q.shape[1]:
-            self.attention_mask = self._get_local_mask(q.shape).to(q.device)
+        # Local window attention masking, shared with the other layers and sequence lengths
+        if (
+            self.attention_mask is None
+            or self.attention_mask.shape[1] != q.shape[1]
+            or self.attention_mask.device != q.device
+        ):
+            key = (
+                "local",
+                self.window_size,
+                self.causal,
+                self.force_sparsity,
+                q.shape[1],
+            )
+            self.attention_mask = get_cached_mask(
+                key, q.device, lambda device: self._get_local_mask(q.shape).to(device)
+            )
 
         # Take into account the optional user mask
         if att_mask is None:
@@ -0,0 +1,167 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+import torch
+
+from xformers.components.attention._sputnik_sparse import SparseCS
+from xformers.components.attention.attention_mask import AttentionMask
+from xformers.sparse.utils import _normalize_device
+
+
+class MaskCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    num_masks: int
+    nbytes: int
+    max_bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def _mask_nbytes(mask: Any) -> int:
+    if isinstance(mask, SparseCS):
+        tensors = [
+            mask.values,
+            mask.row_indices,
+            mask.row_offsets,
+            mask.column_indices,
+        ] + list(mask._mat._csr_transp_info)
+    elif isinstance(mask, AttentionMask):
+        tensors = [mask.values]
+    else:
+        tensors = [mask]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class MaskCache:
+    """
+    Least recently used cache of attention masks, shared by the attention
+    components so that all the layers (and all the sequence lengths a model
+    is served with) reuse the masks already built, instead of going through the
+    dense pattern and `maybe_sparsify` again.
+
+    Masks are keyed by a hashable description of the pattern (its parameters
+    and the sequence length) and the device. A mask missing on a device is
+    copied from another device if possible. Masks are evicted above `max_bytes`.
+    The cached masks are shared, and must not be modified in-place.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._masks: "OrderedDict[Tuple[Hashable, torch.device], Tuple[Any, int]]" = (
+            OrderedDict()
+        )
+        # key -> devices holding a copy of the mask
+        self._devices: Dict[Hashable, Dict[torch.device, None]] = {}
+
+    def get(
+        self,
+        key: Hashable,
+        device: torch.device,
+        create: Callable[[torch.device], Any],
+    ) -> Any:
+        """
+        Returns the mask described by `key` on `device`, calling `create(device)`
+        to build it if it is not cached
+        """
+        device = _normalize_device(device)
+        entry = self._masks.get((key, device))
+        if entry is not None:
+            self.hits += 1
+            self._masks.move_to_end((key, device))
+            return entry[0]
+
+        self.misses += 1
+        other_devices = self._devices.get(key)
+        if other_devices:
+            mask = self._masks[(key, next(iter(other_devices)))][0].to(device)
+        else:
+            mask = create(device)
+        self._add(key, device, mask)
+        return mask
+
+    def _add(self, key: Hashable, device: torch.device, mask: Any) -> None:
+        nbytes = _mask_nbytes(mask)
+        if nbytes > self.max_bytes:
+            return
+        self._masks[(key, device)] = (mask, nbytes)
+        self._devices.setdefault(key, {})[device] = None
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            (old_key, old_device), (_, old_nbytes) = self._masks.popitem(last=False)
+            devices = self._devices[old_key]
+            del devices[old_device]
+            if not devices:
+                del self._devices[old_key]
+            self.nbytes -= old_nbytes
+
+    def info(self) -> MaskCacheInfo:
+        return MaskCacheInfo(
+            self.hits, self.misses, len(self._masks), self.nbytes, self.max_bytes
+        )
+
+    def clear(self) -> None:
+        self._masks.clear()
+        self._devices.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+_MASK_CACHE_MAX_BYTES = 256 * 1024 * 1024
+_mask_cache = MaskCache(_MASK_CACHE_MAX_BYTES)
+
+
+def get_cached_mask(
+    key: Hashable,
+    device: torch.device,
+    create: Callable[[torch.device], Any],
+) -> Any:
+    """
+    Returns the attention mask described by `key` on `device` from the shared
+    mask cache, calling `create(device)` to build it if needed
+    """
+    return _mask_cache.get(key, device, create)
+
+
+def mask_cache_info() -> MaskCacheInfo:
+    """Hits, misses and memory usage of the shared attention mask cache"""
+    return _mask_cache.info()
+
+
+def clear_mask_cache(max_bytes: Optional[int] = None) -> None:
+    """
+    Drops the masks of the shared attention mask cache and resets its counters,
+    optionally changing its maximum size
+    """
+    _mask_cache.clear()
+    if max_bytes is not None:
+        _mask_cache.max_bytes = max_bytes
+
+
+def get_causal_mask(
+    seq_len: int,
+    to_seq_len: Optional[int] = None,
+    device: Optional[torch.device] = None,
+    dtype: Optional[torch.dtype] = None,
+) -> AttentionMask:
+    """Cached version of :meth:`AttentionMask.make_causal`"""
+    to_seq_len = to_seq_len or seq_len
+    return get_cached_mask(
+        ("causal", seq_len, to_seq_len, dtype),
+        torch.device("cpu") if device is None else device,
+        lambda device: AttentionMask.make_causal(
+            seq_len, to_seq_len, device=device, dtype=dtype
+        ),
+    )
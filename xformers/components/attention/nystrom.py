@@ -16,6 +16,7 @@ from xformers.components.attention.core import (
     scaled_dot_product_attention,
     scaled_query_key_softmax,
 )
+from xformers.components.attention.mask_cache import get_cached_mask
 from xformers.components.attention.utils import (
     bool_mask_to_additive,
     iterative_pinv,
@@ -233,6 +234,7 @@ class NystromAttention(Attention):
                 self.causal_mask_1 is None
                 or (batched_dim, seq_len, self.num_landmarks)
                 != self.causal_mask_1.size()
+                or self.causal_mask_1.device != q.device
             ):
                 self.causal_mask_1 = self._triu_mask(
                     batched_dim, seq_len, self.num_landmarks, **tt
@@ -287,9 +289,15 @@ class NystromAttention(Attention):
         device = kwargs["device"]
         dtype = kwargs["dtype"]
 
-        return torch.triu(
-            torch.ones(dim_2, dim_3, dtype=dtype, device=device) * float("-inf"),
-            diagonal=1,
-        ).expand(
+        # Shared with the other layers, only the batch dimension is per call
+        mask = get_cached_mask(
+            ("nystrom_triu", dim_2, dim_3, dtype),
+            device,
+            lambda device: torch.triu(
+                torch.ones(dim_2, dim_3, dtype=dtype, device=device) * float("-inf"),
+                diagonal=1,
+            ),
+        )
+        return mask.expand(
             dim_1, -1, -1
         )  # micro optim, save memory on the batch dimension
@@ -41,21 +41,29 @@ class OrthoformerAttentionConfig(AttentionConfig):
     num_landmarks           Number of landmarks to use for softmax approximation.
     subsample_fraction      Percentage of q_samples matrix to sample per iteration
     landmark_selection      Landmark selection strategy
+    kmeans_chunk_size       Number of points assigned to the clusters at once by kmeans
+    kmeans_warm_start       Initialize kmeans with the landmarks of the previous call
     """
 
     num_landmarks: Optional[int]
     subsample_fraction: Optional[float]
     landmark_selection: Optional[LandmarkSelection]
+    kmeans_chunk_size: int = 4096
+    kmeans_warm_start: bool = False
 
 
 @register_attention("orthoformer", OrthoformerAttentionConfig)
 class OrthoFormerAttention(Attention):
+    _kmeans_centroids: Optional[torch.Tensor]
+
     def __init__(
         self,
         dropout: float,
         num_landmarks: int = 32,
         subsample_fraction: float = 1.0,
         landmark_selection: LandmarkSelection = LandmarkSelection.Orthogonal,
+        kmeans_chunk_size: int = 4096,
+        kmeans_warm_start: bool = False,
         *args,
         **kwargs,
     ):
@@ -71,6 +79,12 @@ class OrthoFormerAttention(Attention):
 
         .. _Orthoformer: https://arxiv.org/abs/2106.05392
 
+        With the kmeans landmark selections, the points are assigned to the clusters
+        `kmeans_chunk_size` at a time, so that the memory used does not grow with the
+        sequence length. With `kmeans_warm_start`, kmeans starts from the landmarks of
+        the previous call (when the shapes match) instead of random points, which then
+        needs fewer iterations for similar inputs, e.g. consecutive video clips.
+
         """
         super().__init__()
 
@@ -78,6 +92,9 @@ class OrthoFormerAttention(Attention):
         self.attn_drop = nn.Dropout(dropout)
         self.subsample_fraction = subsample_fraction
         self.landmark_selection = landmark_selection
+        self.kmeans_chunk_size = kmeans_chunk_size
+        self.kmeans_warm_start = kmeans_warm_start
+        self.register_buffer("_kmeans_centroids", None, persistent=False)
 
         # Properties specific to this attention mechanism
         self.supports_attention_mask = True
@@ -151,88 +168,131 @@ class OrthoFormerAttention(Attention):
         else:
             q_samples = q  # (B, N, D)
 
+        init = None
+        centroids = self._kmeans_centroids
+        if (
+            self.kmeans_warm_start
+            and centroids is not None
+            and centroids.shape == (q.shape[0], num_landmarks, q.shape[2])
+            and centroids.dtype == q.dtype
+            and centroids.device == q.device
+        ):
+            init = centroids
+
         if spherical:
             q_samples_normalized = Fn.normalize(
                 q_samples, p=2, dim=-1
             )  # may need to change default eps to eps=1e-8 for mixed precision compatibility
             landmarks = self._kmeans_spherical(
-                q_samples_normalized, num_landmarks, num_iters
+                q_samples_normalized, num_landmarks, num_iters, init=init
             )
         else:
-            landmarks = self._kmeans(q_samples, num_landmarks, num_iters)
+            landmarks = self._kmeans(q_samples, num_landmarks, num_iters, init=init)
+
+        if self.kmeans_warm_start:
+            self._kmeans_centroids = landmarks.detach()
         return landmarks  # (B, M, D)
 
-    def _kmeans(self, x: torch.Tensor, K: int, num_iters: int = 10):
+    def _assign_clusters(
+        self, x: torch.Tensor, c: torch.Tensor, spherical: bool
+    ) -> torch.Tensor:
+        """
+        Index of the nearest centroid of each point, computed on chunks of points
+        with a matmul instead of a (B, N, K, D) difference.
+
+        Arguments:
+            x: (B, N, D)
+            c: (B, K, D)
+        Returns: (B, N) indices
+        """
+        cl = torch.empty(x.shape[:2], dtype=torch.long, device=x.device)
+        c_t = c.transpose(-2, -1)
+        if not spherical:
+            # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, the first term does not change the argmin
+            c_sq = (c * c).sum(-1, keepdim=True).transpose(-2, -1)  # (B, 1, K)
+        chunk_size = max(self.kmeans_chunk_size, 1)
+        for start in range(0, x.shape[1], chunk_size):
+            x_chunk = x[:, start : start + chunk_size]
+            if spherical:
+                # cosine similarity
+                cl[:, start : start + chunk_size] = (x_chunk @ c_t).argmax(dim=-1)
+            else:
+                D_ij = torch.baddbmm(c_sq, x_chunk, c_t, alpha=-2)
+                cl[:, start : start + chunk_size] = D_ij.argmin(dim=-1)
+        return cl
+
+    def _update_centroids(
+        self, x: torch.Tensor, c: torch.Tensor, cl: torch.Tensor
+    ) -> None:
+        # M step: update the centroids
+        B, N, D = x.shape
+        c.zero_()
+        c.scatter_add_(
+            -2, cl[..., None].expand(B, N, D), x
+        )  # sum of points per cluster
+        counts = c.new_full(c.shape[:2], 1e-6)  # avoid div0
+        counts.scatter_add_(-1, cl, x.new_ones((B, N)))  # number of points per cluster
+        c.divide_(counts.unsqueeze(-1))  # compute the average
+
+    def _kmeans(
+        self,
+        x: torch.Tensor,
+        K: int,
+        num_iters: int = 10,
+        init: Optional[torch.Tensor] = None,
+    ):
         """
         Arguments:
             x: (B, N, D)
             K: number of clusters
             num_iters: the number of kmeans updates
+            init: (B, K, D) optional initial centroids
         """
 
         B, N, D = x.size()
         assert K <= N, f"{K} > {N}"
 
-        c = x[
-            :, torch.randperm(N, device=x.device)[:K], :
-        ].clone()  # initialisation for the centroids
+        if init is not None:
+            c = init.clone()
+        else:
+            c = x[
+                :, torch.randperm(N, device=x.device)[:K], :
+            ].clone()  # initialisation for the centroids
 
         with profiler.record_function("kmeans"):
-            x_i = x.view(B, N, 1, D)
-            c_j = c.view(B, 1, K, D)
-            counts = c.new_zeros(B, K)
-            ones = x.new_ones((B, N))
-
             for _ in range(num_iters):
                 # E step: assign points to the nearest cluster
-                D_ij = ((x_i - c_j) ** 2).sum(-1)  # (B, N, K) squared distances
-                cl = D_ij.argmin(
-                    dim=-1, keepdim=True
-                ).long()  # (B, N, 1) index of point to nearest cluster
-
-                # M step: update the centroids
-                c.zero_()
-                c.scatter_add_(-2, cl.repeat(1, 1, D), x)  # sum of points per cluster
-                counts.fill_(1e-6)  # avoid div0
-                counts.scatter_add_(
-                    -1, cl.squeeze(-1), ones
-                )  # number of points per cluster
-                c.divide_(counts.unsqueeze(-1))  # compute the average
+                cl = self._assign_clusters(x, c, spherical=False)
+                self._update_centroids(x, c, cl)
 
         return c
 
-    def _kmeans_spherical(self, x: torch.Tensor, K: int, num_iters=10):
+    def _kmeans_spherical(
+        self,
+        x: torch.Tensor,
+        K: int,
+        num_iters=10,
+        init: Optional[torch.Tensor] = None,
+    ):
         """
         Arguments:
             x: (B, N, D)
+            init: (B, K, D) optional initial centroids
         """
         B, N, D = x.size()
         assert K <= N, f"{K} > {N}"
 
         # initialisation for the centroids
-        c = x[:, torch.randperm(N, device=x.device)[:K], :].clone()
+        if init is not None:
+            c = Fn.normalize(init, p=2, dim=-1)
+        else:
+            c = x[:, torch.randperm(N, device=x.device)[:K], :].clone()
 
         with profiler.record_function("kmeans_spherical"):
-            counts = c.new_zeros(B, K)
-            ones = x.new_ones((B, N))
-
             for _ in range(num_iters):
                 # E step: assign points to the nearest cluster
-                D_ij = torch.matmul(
-                    x, c.transpose(-2, -1)
-                )  # (B, N, K) cosine similarity
-                cl = D_ij.argmax(
-                    dim=-1, keepdim=True
-                ).long()  # (B, N, 1) index of point to nearest cluster
-
-                # M step: update the centroids
-                c.zero_()
-                c.scatter_add_(-2, cl.repeat(1, 1, D), x)  # sum of points per cluster
-                counts.fill_(1e-6)  # avoid div0
-                counts.scatter_add_(
-                    -1, cl.squeeze(-1), ones
-                )  # number of points per cluster
-                c.divide_(counts.unsqueeze(-1))  # compute the average
+                cl = self._assign_clusters(x, c, spherical=True)
+                self._update_centroids(x, c, cl)
                 c = Fn.normalize(c, p=2, dim=-1)  # renormalise
         return c
 
@@ -23,6 +23,7 @@ from xformers.components.attention.attention_patterns import (
     random_pattern,
 )
 from xformers.components.attention.core import scaled_dot_product_attention
+from xformers.components.attention.mask_cache import get_cached_mask
 
 
 @dataclass
@@ -66,6 +67,8 @@ class RandomAttention(Attention):
         self.causal = causal
         self.r = r
         self.rand_attention_mask: Optional[torch.Tensor] = None
+        # Seed of the constant masks, drawn on the first call
+        self._mask_seed: Optional[int] = None
         self.constant_masking = constant_masking
         self.force_sparsity = force_sparsity
 
@@ -75,9 +78,11 @@ class RandomAttention(Attention):
 
         self.requires_same_k_q_dimensions = True
 
-    def _get_rand_mask(self, shape: torch.Size) -> torch.Tensor:
+    def _get_rand_mask(
+        self, shape: torch.Size, generator: Optional[torch.Generator] = None
+    ) -> torch.Tensor:
         sparsity = 1 - self.r
-        mask = random_pattern(shape[1], sparsity=sparsity)
+        mask = random_pattern(shape[1], sparsity=sparsity, generator=generator)
 
         if self.causal:
             mask &= causal_1d_pattern(shape[1])
@@ -96,8 +101,34 @@ class RandomAttention(Attention):
         **kwargs,
     ):
         # Rand masking
-        if not self.constant_masking or self.rand_attention_mask is None:
+        if not self.constant_masking:
             self.rand_attention_mask = self._get_rand_mask(q.shape).to(q.device)
+        elif (
+            self.rand_attention_mask is None
+            or self.rand_attention_mask.shape[1] != q.shape[1]
+            or self.rand_attention_mask.device != q.device
+        ):
+            # The constant mask of each sequence length is drawn from the seed of this layer,
+            # so that it can be cached and rebuilt identically
+            if self._mask_seed is None:
+                self._mask_seed = int(torch.randint(2**62, ()))
+            seed = self._mask_seed
+            key = (
+                "random",
+                seed,
+                self.r,
+                self.causal,
+                self.force_sparsity,
+                q.shape[1],
+            )
+            self.rand_attention_mask = get_cached_mask(
+                key,
+                q.device,
+                lambda device: self._get_rand_mask(
+                    q.shape, torch.Generator().manual_seed(seed)
+                ).to(device),
+            )
+        assert self.rand_attention_mask is not None
 
         # Mask-aware attention
         if att_mask is not None:
@@ -5,7 +5,7 @@
 
 import logging
 from dataclasses import dataclass
-from typing import Optional, Union
+from typing import NamedTuple, Optional, Tuple, Union
 
 import torch
 from torch import nn
@@ -17,10 +17,18 @@ from xformers.components.attention import (
     register_attention,
 )
 from xformers.components.attention.core import scaled_dot_product_attention
+from xformers.components.attention.mask_cache import get_causal_mask
 
 logger = logging.getLogger("xformers")
 
 
+class ScaledDotProductState(NamedTuple):
+    """Incremental decoding state of :class:`ScaledDotProduct`: the keys and values so far"""
+
+    k: torch.Tensor
+    v: torch.Tensor
+
+
 @dataclass
 class ScaledDotProductConfig(AttentionConfig):
     causal: Optional[bool]
@@ -55,7 +63,7 @@ class ScaledDotProduct(Attention):
         self.seq_len = seq_len
 
         if causal and seq_len is not None:
-            self.mask = AttentionMask.make_causal(seq_len, to_seq_len)
+            self.mask = get_causal_mask(seq_len, to_seq_len)
         else:
             self.mask = None
 
@@ -99,7 +107,7 @@ class ScaledDotProduct(Attention):
         # Handle a possibly deferred causal mask handling
         mask = self.mask
         if self.causal and self.mask is None:
-            mask = AttentionMask.make_causal(
+            mask = get_causal_mask(
                 seq_len=q.shape[-2],
                 to_seq_len=q.shape[-2],
                 device=q.device,
@@ -132,3 +140,33 @@ class ScaledDotProduct(Attention):
             q=q, k=k, v=v, att_mask=att_mask, dropout=self.attn_drop
         )
         return y
+
+    def step(
+        self,
+        q: torch.Tensor,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        state: Optional[ScaledDotProductState] = None,
+    ) -> Tuple[torch.Tensor, ScaledDotProductState]:
+        """
+        Incremental decoding with a key/value cache: the new queries attend to all the
+        keys and values so far, the past queries are not kept nor attended again
+        """
+        if state is not None:
+            k = torch.cat([state.k, k], dim=-2)
+            v = torch.cat([state.v, v], dim=-2)
+
+        # The new tokens are the last ones of the causal mask
+        att_mask: Optional[AttentionMask] = None
+        if self.causal and q.shape[-2] > 1:
+            causal_mask = get_causal_mask(
+                seq_len=k.shape[-2], device=q.device, dtype=q.dtype
+            )
+            att_mask = AttentionMask(
+                causal_mask.values[:, -q.shape[-2] :], is_causal=False
+            )
+
+        y = scaled_dot_product_attention(
+            q=q, k=k, v=v, att_mask=att_mask, dropout=self.attn_drop
+        )
+        return y, ScaledDotProductState(k, v)
@@ -7,10 +7,33 @@ The code has been adopted from DeepSpeed
 (https://github.com/microsoft/DeepSpeed/blob/master/deepspeed/ops/sparse_attention/sparsity_config.py)
 """
 
+import hashlib
+import os
 import random
+from collections import OrderedDict
 
 import torch
 
+# Layouts which only depend on the config and the sequence length are cached
+# in-process, and on disk if this environment variable is set to a folder
+_LAYOUT_CACHE_DIR_ENV = "XFORMERS_SPARSITY_LAYOUT_CACHE"
+_LAYOUT_CACHE_MAXSIZE = 8
+_layout_cache: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+
+
+def _local_windows_layout(window, unidirectional):
+    """Blocks attend to the blocks in the same local window, `window[i]` being the window of block `i`"""
+    layout = window[:, None] == window[None, :]
+    if unidirectional:
+        layout = layout.tril()
+    return layout
+
+
+def _sliding_window_layout(num_blocks, num_sliding_window_blocks):
+    blocks = torch.arange(num_blocks)
+    w = num_sliding_window_blocks // 2
+    return (blocks[:, None] - blocks[None, :]).abs() <= w
+
 
 class SparsityConfig:
     """Abstract Configuration class to store `sparsity configuration of a self attention layer`.
@@ -35,6 +58,65 @@ class SparsityConfig:
         self.different_layout_per_head = different_layout_per_head
         self.num_layout_heads = num_heads if different_layout_per_head else 1
 
+    def make_layout(self, seq_len):
+        """Generates the sparsity layout used by each head in the sparse attention.
+        Layouts which don't contain random blocks are cached, see `_make_layout` for the actual
+        generation.
+        Arguments:
+             seq_len: required: an integer determining the underling sequence length.
+        Return:
+             layout: a tensor of dimension (num_heads, num_blocks, num_blocks) containing sparsity
+                layout of all head
+        """
+
+        if not self.is_deterministic():
+            return self._make_layout(seq_len)
+
+        key = self._layout_cache_key(seq_len)
+        layout = _layout_cache.get(key)
+        if layout is None:
+            layout = self._load_or_make_layout(key, seq_len)
+            _layout_cache[key] = layout
+            if len(_layout_cache) > _LAYOUT_CACHE_MAXSIZE:
+                _layout_cache.popitem(last=False)
+        else:
+            _layout_cache.move_to_end(key)
+        # The cache holds the distinct heads as booleans. Always return a new
+        # tensor, as layouts are modified in-place by some callers
+        shape = (self.num_heads, *layout.shape[1:])
+        return torch.empty(shape, dtype=torch.int64).copy_(layout.expand(shape))
+
+    def _make_layout(self, seq_len):
+        raise NotImplementedError()
+
+    def is_deterministic(self):
+        """Whether the layout only depends on the config and the sequence length (no random blocks)"""
+        return getattr(self, "num_random_blocks", 0) == 0
+
+    def _layout_cache_key(self, seq_len):
+        params = sorted(vars(self).items())
+        content = (
+            f"{type(self).__module__}.{type(self).__qualname__}:{params}:{seq_len}"
+        )
+        digest = hashlib.sha256(content.encode()).hexdigest()[:32]
+        return f"{type(self).__name__}_{digest}"
+
+    def _load_or_make_layout(self, key, seq_len):
+        cache_dir = os.environ.get(_LAYOUT_CACHE_DIR_ENV)
+        path = None
+        if cache_dir:
+            path = os.path.join(os.path.expanduser(cache_dir), f"{key}.pt")
+            if os.path.exists(path):
+                return torch.load(path, weights_only=True)
+        layout = self._make_layout(seq_len)[: self.num_layout_heads].bool()
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first, so concurrent readers never see partial files
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            torch.save(layout, tmp_path)
+            os.replace(tmp_path, path)
+        return layout
+
     def setup_layout(self, seq_len):
         """Create layout tensor for the given sequence length
         Arguments:
@@ -91,7 +173,7 @@ class DenseSparsityConfig(SparsityConfig):
 
         super().__init__(num_heads, block_size, different_layout_per_head)
 
-    def make_layout(self, seq_len):
+    def _make_layout(self, seq_len):
         """Set 1 to all blocks of the layout meanins the pattern is dense; not sparse.
         Arguments:
              seq_len: required: an integer determining the underling sequence length;
@@ -205,13 +287,10 @@ class FixedSparsityConfig(SparsityConfig):
         """
 
         num_blocks = layout.shape[1]
-        for i in range(0, num_blocks, self.num_local_blocks):
-            end = min(i + self.num_local_blocks, num_blocks)
-            for row in range(i, end):
-                for col in range(
-                    i, (row + 1 if self.attention == "unidirectional" else end)
-                ):
-                    layout[h, row, col] = 1
+        window = torch.arange(num_blocks) // self.num_local_blocks
+        layout[h].masked_fill_(
+            _local_windows_layout(window, self.attention == "unidirectional"), 1
+        )
         return layout
 
     def set_global_layout(self, h, layout):
@@ -237,40 +316,45 @@ class FixedSparsityConfig(SparsityConfig):
             self.num_local_blocks
             - (1 + h % self.num_different_global_patterns) * self.num_global_blocks
         )
+        blocks = torch.arange(num_blocks)
 
-        # set all global blocks except the last one if (in last local window)
+        # global blocks of all the local windows except the last one if it is short.
+        # In unidirectional attention, they are attended by the rows starting at the
+        # first global block of their window
         end = num_blocks - (num_blocks % self.num_local_blocks)
-        for i in range(first_global_block_idx, end, self.num_local_blocks):
-
-            # vertical global attention
-            first_row = 0 if self.attention == "bidirectional" else i
-            # (((i // self.num_local_blocks) + 1) * self.num_local_blocks)
-            # if (first_row < num_blocks):
-            layout[h, first_row:, i : i + self.num_global_blocks] = 1
-
-            # horizontal global attention; only in bidirectional attention
-            if self.horizontal_global_attention:
-                layout[h, i : i + self.num_global_blocks, :] = 1
+        offset = blocks % self.num_local_blocks - first_global_block_idx
+        is_global = (blocks < end) & (offset >= 0) & (offset < self.num_global_blocks)
+        first_row = torch.where(is_global, blocks - offset, num_blocks)
 
         # set last global blocks; handle possible short last local window
         if end < num_blocks:
             start = min(
                 end + first_global_block_idx, num_blocks - self.num_global_blocks
             )
-            end = start + self.num_global_blocks
+            # NOTE: `start` is negative if there are fewer blocks than global blocks
+            is_last_global = torch.zeros_like(is_global)
+            is_last_global[start : start + self.num_global_blocks] = True
+            is_global |= is_last_global
+            first_row = torch.where(
+                is_last_global,
+                first_row.clamp(max=range(num_blocks)[start:].start),
+                first_row,
+            )
 
-            # vertical global attention
-            first_row = 0 if self.attention == "bidirectional" else start
-            # (((start // self.num_local_blocks) + 1) * self.num_local_blocks)
-            # if (first_row < num_blocks):
-            layout[h, first_row:, start:end] = 1
+        if self.attention == "bidirectional":
+            first_row.zero_()
 
-            # horizontal global attention
-            if self.horizontal_global_attention:
-                layout[h, start:end, :] = 1
+        # vertical global attention
+        layout[h].masked_fill_(
+            is_global[None, :] & (blocks[:, None] >= first_row[None, :]), 1
+        )
+
+        # horizontal global attention; only in bidirectional attention
+        if self.horizontal_global_attention:
+            layout[h].masked_fill_(is_global[:, None], 1)
         return layout
 
-    def make_layout(self, seq_len):
+    def _make_layout(self, seq_len):
         """Generates `Fixed` sparsity layout used by each head in the sparse attention.
         Arguments:
              seq_len: required: an integer determining number of attention heads of the layer.
@@ -420,29 +504,22 @@ class VariableSparsityConfig(SparsityConfig):
         """
 
         num_blocks = layout.shape[1]
-        start_block_idx = 0
-        end_block_idx = 0
-        for block_size in self.local_window_blocks:
-            end_block_idx += block_size
-            end_block_idx = min(end_block_idx, num_blocks)
-            for row in range(start_block_idx, end_block_idx):
-                for col in range(
-                    start_block_idx,
-                    (row + 1 if self.attention == "unidirectional" else end_block_idx),
-                ):
-                    layout[h, row, col] = 1
-            start_block_idx += block_size
+        blocks = torch.arange(num_blocks)
+        window_ends = torch.tensor(self.local_window_blocks).cumsum(0)
+        window = torch.bucketize(blocks, window_ends, right=True)
 
         # if there is any remaining not attended part, use the lats local window block size as local
         # window for the remaining applicable local windows
-        for i in range(start_block_idx, num_blocks, block_size):
-            end_block_idx = min(i + block_size, num_blocks)
-            for row in range(i, end_block_idx):
-                for col in range(
-                    i,
-                    (row + 1 if self.attention == "unidirectional" else end_block_idx),
-                ):
-                    layout[h, row, col] = 1
+        start_block_idx = int(window_ends[-1])
+        block_size = self.local_window_blocks[-1]
+        window = torch.where(
+            blocks < start_block_idx,
+            window,
+            len(self.local_window_blocks) + (blocks - start_block_idx) // block_size,
+        )
+        layout[h].masked_fill_(
+            _local_windows_layout(window, self.attention == "unidirectional"), 1
+        )
         return layout
 
     def set_global_layout(self, h, layout):
@@ -484,7 +561,7 @@ class VariableSparsityConfig(SparsityConfig):
                     layout[h, first_row:, start_idx:end_idx] = 1
         return layout
 
-    def make_layout(self, seq_len):
+    def _make_layout(self, seq_len):
         """Generates `Variable` sparsity layout used by each head in the sparse attention.
         Arguments:
              seq_len: required: an integer determining number of attention heads of the layer.
@@ -605,11 +682,9 @@ class BigBirdSparsityConfig(SparsityConfig):
                 overall number of blocks in a row, {num_blocks}!"""
             )
 
-        w = self.num_sliding_window_blocks // 2
-        for row in range(0, num_blocks):
-            start = max(0, row - w)
-            end = min(row + w + 1, num_blocks)
-            layout[h, row, start:end] = 1
+        layout[h].masked_fill_(
+            _sliding_window_layout(num_blocks, self.num_sliding_window_blocks), 1
+        )
         return layout
 
     def set_global_layout_itc(self, h, layout):
@@ -642,7 +717,7 @@ class BigBirdSparsityConfig(SparsityConfig):
 
         return layout
 
-    def make_layout(self, seq_len):
+    def _make_layout(self, seq_len):
         """Generates `BigBird` sparsity layout used by each head in the sparse attention.
         Arguments:
              seq_len: required: an integer determining number of attention heads of the layer.
@@ -750,11 +825,9 @@ class BSLongformerSparsityConfig(SparsityConfig):
                 than overall number of blocks in a row, {num_blocks}!"""
             )
 
-        w = self.num_sliding_window_blocks // 2
-        for row in range(0, num_blocks):
-            start = max(0, row - w)
-            end = min(row + w + 1, num_blocks)
-            layout[h, row, start:end] = 1
+        layout[h].masked_fill_(
+            _sliding_window_layout(num_blocks, self.num_sliding_window_blocks), 1
+        )
         return layout
 
     def set_global_layout(self, h, layout):
@@ -794,7 +867,7 @@ class BSLongformerSparsityConfig(SparsityConfig):
             layout = torch.tril(layout)
         return layout
 
-    def make_layout(self, seq_len):
+    def _make_layout(self, seq_len):
         """Generates edited `Longformer` sparsity layout used by each head in the sparse attention.
         Arguments:
              seq_len: required: an integer determining number of attention heads of the layer.
@@ -15,6 +15,7 @@ import torch
 from torch import nn
 
 from xformers._deprecation_warning import deprecated_function
+from xformers.ops.unbind import unbind
 
 logger = logging.getLogger("xformers")
 
@@ -29,6 +30,12 @@ class InputProjectionConfig:
 class InputProjection(nn.Module):
     """
     Handle all the input projections in one go, opportunistically fuse some operations.
+
+    With `pack_weights`, Q, K and V projections of the same size are held by a single
+    `qkv_proj` linear layer, so that self-attention inputs are projected with a single
+    matmul, whose output is split in Q, K and V views without copies.
+    The state dict then holds `qkv_proj` instead of `q_proj`, `k_proj` and `v_proj`,
+    whose weights are packed when loading them.
     """
 
     def __init__(
@@ -37,6 +44,7 @@ class InputProjection(nn.Module):
         key_proj_params: Optional[InputProjectionConfig],
         value_proj_params: Optional[InputProjectionConfig],
         use_separate_proj_weight: bool = True,
+        pack_weights: bool = False,
     ):
 
         super().__init__()
@@ -44,6 +52,21 @@ class InputProjection(nn.Module):
 
         self.out_features = query_proj_params.out_features
 
+        self.qkv_proj: Optional[nn.Linear] = None
+        if (
+            pack_weights
+            and use_separate_proj_weight
+            and key_proj_params == query_proj_params
+            and value_proj_params == query_proj_params
+        ):
+            self.qkv_proj = nn.Linear(
+                query_proj_params.in_features,
+                3 * query_proj_params.out_features,
+                query_proj_params.bias,
+            )
+            self._register_load_state_dict_pre_hook(self.load_hook)
+            return
+
         # Each input gets a separate projection
         self.q_proj = nn.Linear(
             query_proj_params.in_features,
@@ -83,20 +106,83 @@ class InputProjection(nn.Module):
                 self.k_proj.weight = self.q_proj.weight
                 self.v_proj.weight = self.q_proj.weight
 
+    # Checkpoints with separate projections can be loaded in a packed one
+    def load_hook(
+        self,
+        state_dict,
+        prefix,
+        local_metadata,
+        strict,
+        missing_keys,
+        unexpected_keys,
+        error_msgs,
+    ):
+        for name in ("weight", "bias"):
+            keys = [f"{prefix}{proj}.{name}" for proj in ("q_proj", "k_proj", "v_proj")]
+            if all(key in state_dict for key in keys):
+                state_dict[f"{prefix}qkv_proj.{name}"] = torch.cat(
+                    [state_dict.pop(key) for key in keys]
+                )
+
+    def _packed_linear(
+        self, x: torch.Tensor, start: int, end: int
+    ) -> Tuple[torch.Tensor, ...]:
+        # Projections `start` to `end` (Q: 0, K: 1, V: 2) of the packed weights,
+        # computed in one go and split in views
+        assert self.qkv_proj is not None
+        rows = slice(start * self.out_features, end * self.out_features)
+        weight, bias = self.qkv_proj.weight, self.qkv_proj.bias
+        y = nn.functional.linear(x, weight[rows], None if bias is None else bias[rows])
+        return unbind(y.view(y.shape[:-1] + (end - start, -1)), dim=-2)
+
     def forward(
         self,
         query: torch.Tensor,
         key: torch.Tensor,
         value: torch.Tensor,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-        # One projection per input tensor
-
-        # NOTE: Would it make sense to catch self attention + shared weights, to skip a projection step ?
-
-        q, k, v = map(
-            lambda fn, x: fn(x),
-            [self.q_proj, self.k_proj, self.v_proj],
-            [query, key, value],
-        )
-
-        return q, k, v
+        if self.qkv_proj is not None:
+            # Self attention with packed weights, a single projection
+            if query is key and key is value:
+                q, k, v = self._packed_linear(query, 0, 3)
+                return q, k, v
+
+        # Self attention with shared weights, a single projection, then the biases
+        elif (
+            query is key
+            and key is value
+            and self.k_proj.weight is self.q_proj.weight
+            and self.v_proj.weight is self.q_proj.weight
+        ):
+            x = nn.functional.linear(query, self.q_proj.weight)
+            q, k, v = (
+                x + p.bias if p.bias is not None else x
+                for p in (self.q_proj, self.k_proj, self.v_proj)
+            )
+            return q, k, v
+
+        k, v = self.project_key_value(key, value)
+        return self.project_query(query), k, v
+
+    def project_query(self, query: torch.Tensor) -> torch.Tensor:
+        """Query projection only"""
+        if self.qkv_proj is not None:
+            return self._packed_linear(query, 0, 1)[0]
+        return self.q_proj(query)
+
+    def project_key_value(
+        self, key: torch.Tensor, value: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Key and value projections only, for instance to project a cross-attention
+        memory once for all the decoding steps
+        """
+        if self.qkv_proj is None:
+            return self.k_proj(key), self.v_proj(value)
+
+        # Keys and values from the same input (cross attention)
+        if key is value:
+            k, v = self._packed_linear(key, 1, 3)
+            return k, v
+
+        return self._packed_linear(key, 1, 2)[0], self._packed_linear(value, 2, 3)[0]
@@ -6,7 +6,7 @@
 
 import logging
 from dataclasses import asdict, dataclass
-from typing import Optional, Tuple
+from typing import Any, NamedTuple, Optional, Tuple
 
 import torch
 import torch.nn as nn
@@ -16,6 +16,7 @@ from xformers._deprecation_warning import deprecated_function
 from xformers.components.attention import Attention
 from xformers.components.input_projection import InputProjection, InputProjectionConfig
 from xformers.components.positional_embedding import RotaryEmbedding
+from xformers.ops.unbind import stack_or_none, unbind
 
 logger = logging.getLogger("xformers")
 
@@ -48,6 +49,26 @@ def _split_heads(t: torch.Tensor, B: int, S: int, H: int, Hs: int):
     return t.view(B, S, H, Hs).transpose(1, 2)
 
 
+class MultiHeadDispatchState(NamedTuple):
+    """
+    Incremental decoding state of :class:`MultiHeadDispatch`: the number of tokens
+    seen so far, and the state of the attention
+    """
+
+    position: int
+    attention: Any
+
+
+class MultiHeadDispatchMemory(NamedTuple):
+    """
+    Keys and values of a cross-attention, projected and split in heads once
+    (see :meth:`MultiHeadDispatch.project_memory`)
+    """
+
+    key: torch.Tensor
+    value: torch.Tensor
+
+
 class MultiHeadDispatch(nn.Module):
     """
     A multi-head masked self-attention dispatch mechanism, with a projection at the end,
@@ -206,6 +227,24 @@ class MultiHeadDispatch(nn.Module):
         if self.attention.requires_skip_multi_head:
             return self.attention(query, key, value, **kw_mask_args)
 
+        q, k, v = self._project_heads(query, key, value)
+
+        # Self-attend
+        y = self.attention(q, k, v, **kw_mask_args)
+
+        # Re-assemble all head outputs side by side, output projection
+        return self._merge_heads(y, B, S_Q)
+
+    def _project_heads(
+        self,
+        query: torch.Tensor,
+        key: torch.Tensor,
+        value: torch.Tensor,
+        position: int = 0,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        B, S_Q, _ = query.size()
+        _, S_K, _ = key.size()
+
         # Calculate query, key, values for all heads in batch
         if self.attention.requires_input_projection:
             q, k, v = self.in_proj_container(query=query, key=key, value=value)
@@ -222,6 +261,15 @@ class MultiHeadDispatch(nn.Module):
         check(v, "projected value")
         check(k, "projected key")
 
+        # The projections can be views of the same tensor (see InputProjection)
+        qkv: Optional[torch.Tensor] = None
+        if (
+            not self.rotary_embeddings
+            and S_Q == S_K
+            and self.dim_key_head == self.dim_value_head
+        ):
+            qkv = stack_or_none([q, k, v], dim=2)
+
         # Optional: rotary embedding, add relative positioning information
         if self.rotary_embeddings:
             # rotary requires the head dimension
@@ -229,11 +277,20 @@ class MultiHeadDispatch(nn.Module):
             k = _split_heads(k, B, S_K, self.num_heads, self.dim_key_head)
             v = _split_heads(v, B, S_K, self.num_heads, self.dim_value_head)
 
-            q, k = self.rotary_embeddings(q=q, k=k)
+            q, k = self.rotary_embeddings(q=q, k=k, offset=position)
 
             if not self.attention.requires_head_dimension:
                 q, k, v = q.flatten(0, 1), k.flatten(0, 1), v.flatten(0, 1)
 
+        elif qkv is not None:
+            # Packed projections (self-attention), reshape q/k/v all at once
+            qkv = qkv.view(B, S_Q, 3, self.num_heads, self.dim_key_head).permute(
+                2, 0, 3, 1, 4
+            )
+            if not self.attention.requires_head_dimension:
+                qkv = qkv.flatten(1, 2)
+            q, k, v = unbind(qkv, dim=0)
+
         else:
             # Reshape k/q/v to either expose the heads, or fold the head dimension into the batch
             reshape_fn = (
@@ -244,9 +301,9 @@ class MultiHeadDispatch(nn.Module):
             k = reshape_fn(k, B, S_K, self.num_heads, self.dim_key_head)
             v = reshape_fn(v, B, S_K, self.num_heads, self.dim_value_head)
 
-        # Self-attend
-        y = self.attention(q, k, v, **kw_mask_args)
+        return q, k, v
 
+    def _merge_heads(self, y: torch.Tensor, B: int, S_Q: int) -> torch.Tensor:
         # Re-assemble all head outputs side by side
         y = (
             y.view(B, self.num_heads, S_Q, self.dim_value_head)
@@ -260,6 +317,113 @@ class MultiHeadDispatch(nn.Module):
         # Return the same sequence size as the input
         return y
 
+    def init_state(self) -> MultiHeadDispatchState:
+        """
+        State of an incremental decoding (see :meth:`step`) before the first token
+        """
+        return MultiHeadDispatchState(0, self.attention.init_state())
+
+    def step(
+        self,
+        query: torch.Tensor,
+        key: Optional[torch.Tensor] = None,
+        value: Optional[torch.Tensor] = None,
+        state: Optional[MultiHeadDispatchState] = None,
+    ) -> Tuple[torch.Tensor, MultiHeadDispatchState]:
+        """
+        Incremental decoding: attention of the new tokens (typically one at a time, with
+        dimensions [batch size, new tokens, embed dim]) given the previous ones, which are
+        summed up in `state`. The state is threaded through the attention, see
+        :meth:`Attention.step`, so that linear attentions have a constant cost per token.
+
+        Returns the output for the new tokens, and the updated state.
+        """
+
+        if key is None:
+            key = query
+        if value is None:
+            value = query
+        if state is None:
+            state = self.init_state()
+
+        B, S_Q, _ = query.size()
+        position = state.position + key.shape[1]
+
+        if self.attention.requires_skip_multi_head:
+            y, attention_state = self.attention.step(query, key, value, state.attention)
+            return y, MultiHeadDispatchState(position, attention_state)
+
+        q, k, v = self._project_heads(query, key, value, state.position)
+        y, attention_state = self.attention.step(q, k, v, state.attention)
+        return self._merge_heads(y, B, S_Q), MultiHeadDispatchState(
+            position, attention_state
+        )
+
+    def project_memory(
+        self, key: torch.Tensor, value: Optional[torch.Tensor] = None
+    ) -> MultiHeadDispatchMemory:
+        """
+        Projects the keys and values of a cross-attention, typically an encoder output,
+        so that they can be attended to by several queries (see :meth:`attend_memory`),
+        for instance all the steps of an incremental decoding, without projecting them again.
+        """
+        if value is None:
+            value = key
+
+        if self.attention.requires_skip_multi_head:
+            return MultiHeadDispatchMemory(key, value)
+
+        assert (
+            self.rotary_embeddings is None
+        ), "Rotary embeddings are not supported in cross attention"
+
+        B, S_K, _ = key.size()
+        if self.attention.requires_input_projection:
+            key, value = self.in_proj_container.project_key_value(key, value)
+
+        reshape_fn = (
+            _split_heads if self.attention.requires_head_dimension else _fold_heads
+        )
+        return MultiHeadDispatchMemory(
+            reshape_fn(key, B, S_K, self.num_heads, self.dim_key_head),
+            reshape_fn(value, B, S_K, self.num_heads, self.dim_value_head),
+        )
+
+    def attend_memory(
+        self,
+        query: torch.Tensor,
+        memory: MultiHeadDispatchMemory,
+        att_mask: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """
+        Same as :meth:`forward`, with keys and values already projected by :meth:`project_memory`
+        """
+        kw_mask_args = {}
+        if att_mask is not None:
+            assert (
+                self.attention.supports_attention_mask
+            ), "This attention does not support attention masks"
+            kw_mask_args["att_mask"] = att_mask
+
+        if self.attention.requires_skip_multi_head:
+            return self.attention(query, memory.key, memory.value, **kw_mask_args)
+
+        B, S_Q, _ = query.size()
+        assert (
+            S_Q == memory.key.shape[-2]
+            or not self.attention.requires_same_k_q_dimensions
+        ), "This attention mechanism requires query and key to have the same sequence (context) lengths"
+
+        if self.attention.requires_input_projection:
+            query = self.in_proj_container.project_query(query)
+
+        reshape_fn = (
+            _split_heads if self.attention.requires_head_dimension else _fold_heads
+        )
+        q = reshape_fn(query, B, S_Q, self.num_heads, self.dim_key_head)
+        y = self.attention(q, memory.key, memory.value, **kw_mask_args)
+        return self._merge_heads(y, B, S_Q)
+
     @classmethod
     def from_config(cls, config: MultiHeadDispatchConfig):
         # Generate the class inputs from the config
@@ -39,8 +39,14 @@ class LearnablePositionalEmbedding(PositionEmbedding):
             torch.nn.Parameter(torch.zeros(dim_model)) if add_class_token else None
         )
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(self, x: torch.Tensor, offset: int = 0) -> torch.Tensor:
+        """
+        `offset` is the position of the first token of `x`,
+        for instance when decoding one token at a time
+        """
         if self.class_token is not None:
+            assert offset == 0, "Decoding is not supported with a class token"
+
             # Prepend class token
             clf_token = (
                 torch.ones(x.shape[0], 1, self.pos_emb.shape[-1], device=x.device)
@@ -51,4 +57,8 @@ class LearnablePositionalEmbedding(PositionEmbedding):
         if x.ndim == 2:
             x = x.unsqueeze(-1)
 
-        return x + self.pos_emb
+        pos_emb: torch.Tensor = self.pos_emb
+        if offset > 0 or x.shape[1] != pos_emb.shape[1]:
+            pos_emb = pos_emb[:, offset : offset + x.shape[1]]
+
+        return x + pos_emb
@@ -56,20 +56,23 @@ class RotaryEmbedding(torch.nn.Module):
         self._cos_cached = None
         self._sin_cached = None
 
-    def _update_cos_sin_tables(self, x, seq_dimension=1):
-        seq_len = x.shape[seq_dimension]
+    def _update_cos_sin_tables(self, x, seq_dimension=1, offset=0):
+        seq_len = offset + x.shape[seq_dimension]
 
         # Reset the tables if the sequence length has changed,
-        # or if we're on a new device (possibly due to tracing for instance)
+        # or if we're on a new device (possibly due to tracing for instance).
+        # When decoding, the tables are only extended once in a while
         if (
-            seq_len != self._seq_len_cached
+            self._seq_len_cached is None
+            or (seq_len != self._seq_len_cached and offset == 0)
+            or self._seq_len_cached < seq_len
             or self._cos_cached.device != x.device
             or self._cos_cached.dtype != x.dtype
         ):
+            if offset > 0:
+                seq_len = 1 << (seq_len - 1).bit_length()
             self._seq_len_cached = seq_len
-            t = torch.arange(
-                x.shape[seq_dimension], device=x.device, dtype=torch.float32
-            )
+            t = torch.arange(seq_len, device=x.device, dtype=torch.float32)
             freqs = torch.einsum("i,j->ij", t, self.inv_freq.to(x.dtype))
             emb = torch.cat((freqs, freqs), dim=-1).to(x.device)
 
@@ -79,13 +82,17 @@ class RotaryEmbedding(torch.nn.Module):
         return self._cos_cached, self._sin_cached
 
     def forward(
-        self, q: torch.Tensor, k: torch.Tensor
+        self, q: torch.Tensor, k: torch.Tensor, offset: int = 0
     ) -> Tuple[torch.Tensor, torch.Tensor]:
-        self._cos_cached, self._sin_cached = self._update_cos_sin_tables(
-            k, seq_dimension=-2
-        )
+        """
+        `offset` is the position of the first token of `q` and `k`,
+        for instance when decoding one token at a time
+        """
+        cos, sin = self._update_cos_sin_tables(k, seq_dimension=-2, offset=offset)
+        if offset > 0:
+            cos, sin = cos[:, :, offset:], sin[:, :, offset:]
 
         return (
-            apply_rotary_pos_emb(q, self._cos_cached, self._sin_cached),
-            apply_rotary_pos_emb(k, self._cos_cached, self._sin_cached),
+            apply_rotary_pos_emb(q, cos, sin),
+            apply_rotary_pos_emb(k, cos, sin),
         )
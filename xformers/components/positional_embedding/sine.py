@@ -24,10 +24,14 @@ class SinePositionalEmbedding(PositionEmbedding):
         super().__init__()
         self.dim_model = dim_model
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(self, x: torch.Tensor, offset: int = 0) -> torch.Tensor:
+        """
+        `offset` is the position of the first token of `x`,
+        for instance when decoding one token at a time
+        """
         seq_len = x.shape[1]
         pos = (
-            torch.arange(0, seq_len, device=x.device, dtype=torch.float32)
+            torch.arange(offset, offset + seq_len, device=x.device, dtype=torch.float32)
             .unsqueeze(1)
             .repeat(1, self.dim_model)
         )
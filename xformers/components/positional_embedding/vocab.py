@@ -51,10 +51,14 @@ class VocabEmbedding(PositionEmbedding):
         torch.nn.init.normal_(self.position_embeddings.weight, std=0.02 * gain)
         torch.nn.init.normal_(self.word_embeddings.weight, std=0.02 * gain)
 
-    def forward(self, x: torch.Tensor):
-        position_ids = torch.arange(x.shape[1], dtype=torch.long, device=x.device)[
-            None, :
-        ].repeat(x.shape[0], 1)
+    def forward(self, x: torch.Tensor, offset: int = 0):
+        """
+        `offset` is the position of the first token of `x`,
+        for instance when decoding one token at a time
+        """
+        position_ids = torch.arange(
+            offset, offset + x.shape[1], dtype=torch.long, device=x.device
+        )[None, :].repeat(x.shape[0], 1)
 
         X_token = self.word_embeddings(x)
         X_pos = self.position_embeddings(position_ids)
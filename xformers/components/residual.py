@@ -6,7 +6,7 @@
 
 from collections import namedtuple
 from enum import Enum
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import torch
 import torch.nn as nn
@@ -110,15 +110,13 @@ class PreNorm(nn.Module, RequiresWrappedInputs):
     def forward(self, inputs: List[torch.Tensor], **kwargs):
         assert len(inputs) > 0
 
-        # Perf improvement: if the inputs are all the same, only norm once
-        ids = [id(x) for x in inputs]
-        if ids.count(ids[0]) == len(ids):
-            # The same tensor is passed multiple times
-            x_norm = self.norm(inputs[0])
-            inputs_normed = [x_norm for _ in inputs]
-        else:
-            # The inputs differ, norm them all
-            inputs_normed = [self.norm(x_) for x_ in inputs]
+        # Perf improvement: if the same tensor is passed multiple times (self attention,
+        # or the keys and values of a cross attention), only norm it once
+        normed: Dict[int, torch.Tensor] = {}
+        for x in inputs:
+            if id(x) not in normed:
+                normed[id(x)] = self.norm(x)
+        inputs_normed = [normed[id(x)] for x in inputs]
 
         if self.wrap_inputs:
             return self.sublayer(inputs=inputs_normed, **kwargs)
@@ -6,7 +6,7 @@
 
 import logging
 from dataclasses import asdict
-from typing import Optional, Tuple, Union
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
 
 import torch
 import torch.nn as nn
@@ -23,6 +23,10 @@ from xformers.components import (
 )
 from xformers.components.attention import AttentionMask
 from xformers.components.feedforward import build_feedforward
+from xformers.components.multi_head_dispatch import (
+    MultiHeadDispatchMemory,
+    MultiHeadDispatchState,
+)
 from xformers.components.positional_embedding import build_positional_embedding
 from xformers.components.residual import get_deepnorm_coefficients
 from xformers.components.simplicial_embedding import SimplicialEmbedding
@@ -93,6 +97,50 @@ def _get_ln_factory(
     return ln_factory
 
 
+def _call_wrapped(
+    wrapper: nn.Module,
+    inputs: List[Optional[torch.Tensor]],
+    fn: Callable[..., torch.Tensor],
+) -> torch.Tensor:
+    """
+    Goes through the residual paths and norms built by `_get_ln_factory` like their forward,
+    but calls `fn(layer, *inputs)` instead of the wrapped layer.
+    `None` inputs (for instance cached keys and values) are passed through as-is.
+    """
+    if isinstance(wrapper, Residual):
+        residue = inputs[0]
+        assert residue is not None
+        if wrapper.scale is not None:
+            residue = residue * wrapper.scale
+        return residue + _call_wrapped(wrapper.layer, inputs, fn)
+
+    if isinstance(wrapper, PreNorm):
+        normed = {}
+        for x in inputs:
+            if x is not None and id(x) not in normed:
+                normed[id(x)] = wrapper.norm(x)
+        return _call_wrapped(
+            wrapper.sublayer,
+            [normed[id(x)] if x is not None else None for x in inputs],
+            fn,
+        )
+
+    if isinstance(wrapper, PostNorm):
+        return wrapper.norm(_call_wrapped(wrapper.sublayer, inputs, fn))
+
+    return fn(wrapper, *inputs)
+
+
+class xFormerDecoderState(NamedTuple):
+    """
+    Incremental decoding state of :class:`xFormerDecoderBlock`: the self-attention
+    state (keys and values of the target so far), and the projected memory
+    """
+
+    self_attention: MultiHeadDispatchState
+    memory: MultiHeadDispatchMemory
+
+
 class xFormerEncoderBlock(torch.nn.Module):
     r"""A vanilla Transformer Encoder block"""
 
@@ -356,3 +404,56 @@ class xFormerDecoderBlock(torch.nn.Module):
         x = self.wrap_ff(inputs=[x])
 
         return x
+
+    def step(
+        self,
+        target: torch.Tensor,
+        memory: Optional[torch.Tensor] = None,
+        state: Optional[xFormerDecoderState] = None,
+    ) -> Tuple[torch.Tensor, xFormerDecoderState]:
+        """
+        Incremental decoding: outputs for the new target tokens (typically one at a time),
+        given the previous ones as summed up in `state`. This matches :meth:`forward`
+        on the whole target sequence if the self-attention is causal.
+
+        The memory is normed and projected into the cross-attention keys and values on
+        the first step only, the following steps reuse them from the state
+        and `memory` can be skipped.
+
+        Returns the outputs for the new tokens, and the updated state.
+        """
+        position = state.self_attention.position if state is not None else 0
+
+        if self.pose_encoding is not None:
+            target = self.pose_encoding(target, offset=position)
+
+            if hasattr(self, "embedding_projector"):
+                target = self.embedding_projector(target)
+
+        self_attention_state = state.self_attention if state is not None else None
+
+        def self_attend(mha, q, k, v):
+            nonlocal self_attention_state
+            y, self_attention_state = mha.step(q, k, v, self_attention_state)
+            return y
+
+        x = _call_wrapped(self.wrap_att, [target, target, target], self_attend)
+
+        projected_memory = state.memory if state is not None else None
+
+        def cross_attend(mha, q, k, v):
+            nonlocal projected_memory
+            if projected_memory is None:
+                projected_memory = mha.project_memory(k, v)
+            return mha.attend_memory(q, projected_memory)
+
+        if projected_memory is None:
+            assert memory is not None, "The memory is required on the first step"
+            x = _call_wrapped(self.wrap_cross, [x, memory, memory], cross_attend)
+        else:
+            x = _call_wrapped(self.wrap_cross, [x, None, None], cross_attend)
+
+        x = self.wrap_ff(inputs=[x])
+
+        assert self_attention_state is not None and projected_memory is not None
+        return x, xFormerDecoderState(self_attention_state, projected_memory)
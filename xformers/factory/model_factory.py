@@ -6,7 +6,7 @@
 
 import logging
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
 
 import torch
 
@@ -18,7 +18,11 @@ from xformers.factory.block_configs import (
     xFormerDecoderConfig,
     xFormerEncoderConfig,
 )
-from xformers.factory.block_factory import xFormerDecoderBlock, xFormerEncoderBlock
+from xformers.factory.block_factory import (
+    xFormerDecoderBlock,
+    xFormerDecoderState,
+    xFormerEncoderBlock,
+)
 from xformers.factory.weight_init import get_weight_init_fn, xFormerWeightInit
 
 logger = logging.getLogger("xformers")
@@ -105,6 +109,12 @@ class xFormerConfig:
         deprecated_function(self)
 
 
+class xFormerState(NamedTuple):
+    """Incremental decoding state of :class:`xFormer`, one per decoder block"""
+
+    decoders: List[xFormerDecoderState]
+
+
 class xFormer(torch.nn.Module):
     def __init__(
         self,
@@ -198,6 +208,10 @@ class xFormer(torch.nn.Module):
         )
         self.decoders = torch.nn.ModuleList(decoders)
 
+        # Execution plan, decided once here instead of inspecting the stacks in every forward
+        self.has_encoder = len(encoders) > 0
+        self.has_decoder = len(decoders) > 0
+
         use_deepnorm = (
             stack_configs[0].residual_norm_style == ResidualNormStyle.DeepNorm
         )
@@ -262,6 +276,31 @@ class xFormer(torch.nn.Module):
         for name, module in self.decoders.named_children():
             init_fn(module=module, name=name, gain=decoder_gain)
 
+    def _encode(
+        self, src: torch.Tensor, encoder_input_mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        if not self.reversible_encoder:
+            memory = src
+            for encoder in self.encoders:  # type: ignore
+                memory = encoder(memory, input_mask=encoder_input_mask)
+            return memory
+
+        if self.rev_enc_pose_encoding:
+            src = self.rev_enc_pose_encoding(src)
+
+        # Reversible Encoder, the two streams start from the same inputs
+        x = torch.cat([src, src], dim=-1)
+
+        # Apply the optional input masking
+        if encoder_input_mask is not None:
+            x += encoder_input_mask.unsqueeze(-1)
+
+        x = self.encoders(x)
+
+        # Average the two streams
+        x1, x2 = x.chunk(2, dim=-1)
+        return torch.add(x1, x2).mul_(0.5)
+
     def forward(
         self,
         src: torch.Tensor,
@@ -269,45 +308,50 @@ class xFormer(torch.nn.Module):
         encoder_input_mask: Optional[torch.Tensor] = None,
         decoder_input_mask: Optional[torch.Tensor] = None,
     ) -> Optional[torch.Tensor]:
+        if not self.has_decoder:
+            # Encoder only, or empty model
+            return self._encode(src, encoder_input_mask) if self.has_encoder else None
 
-        # Encode to latent space if encoder is present
-        if len(list(self.encoders.parameters())) > 0:
-            encoders = self.encoders
-            memory = src.clone()
-            if isinstance(encoders, torch.nn.ModuleList):
-                for encoder in encoders:
-                    memory = encoder(memory, input_mask=encoder_input_mask)
-            else:
-                if self.rev_enc_pose_encoding:
-                    memory = self.rev_enc_pose_encoding(src)
+        # Encode to latent space if encoder is present, else decode the source
+        memory = self._encode(src, encoder_input_mask) if self.has_encoder else src
 
-                # Reversible Encoder
-                x = torch.cat([memory, memory], dim=-1)
+        # If decoder: either use the encoder output, or just decode, both options are possible
+        tgt = src if tgt is None else tgt
+        for decoder in self.decoders:
+            tgt = decoder(target=tgt, memory=memory, input_mask=decoder_input_mask)
 
-                # Apply the optional input masking
-                if encoder_input_mask is not None:
-                    if x.dim() - encoder_input_mask.dim() > 1:
-                        encoder_input_mask.unsqueeze(0)
-                    x += encoder_input_mask.unsqueeze(-1)
+        return tgt
 
-                x = encoders(x)
-                memory = torch.stack(x.chunk(2, dim=-1)).mean(dim=0)
+    def step(
+        self,
+        tgt: torch.Tensor,
+        src: Optional[torch.Tensor] = None,
+        state: Optional[xFormerState] = None,
+        encoder_input_mask: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, xFormerState]:
+        """
+        Incremental decoding, as used to generate a sequence token by token: the decoder
+        outputs for the new target tokens `tgt` (typically the last generated one), given
+        the ones already decoded as summed up in `state`.
 
-            if not self.decoders:
-                return memory
+        `src` is encoded on the first step only, and every decoder block projects the encoder
+        output into its cross-attention keys and values once. These are reused for all the
+        following steps (which do not need `src`), as are the keys and values of the target.
 
-        # If decoder: either use the encoder output, or just decode, both options are possible
-        if len(self.decoders) > 0:
-            tgt = src.clone() if tgt is None else tgt
+        Returns the outputs for the new tokens, and the updated state.
+        """
+        assert self.has_decoder, "Incremental decoding requires decoder blocks"
 
-            for decoder in self.decoders:
-                tgt = decoder(
-                    target=tgt,
-                    # pyre-fixme[61]: `memory` is not always initialized here.
-                    memory=memory,
-                    input_mask=decoder_input_mask,
-                )
+        memory: Optional[torch.Tensor] = None
+        if state is None:
+            assert src is not None, "The source is required on the first step"
+            memory = self._encode(src, encoder_input_mask) if self.has_encoder else src
 
-            return tgt
+        decoder_states = []
+        for i, decoder in enumerate(self.decoders):
+            tgt, decoder_state = decoder.step(
+                tgt, memory, state.decoders[i] if state is not None else None
+            )
+            decoder_states.append(decoder_state)
 
-        return None
+        return tgt, xFormerState(decoder_states)
@@ -12,6 +12,7 @@ from .fmha import (
     AttentionOpBase,
     LowerTriangularMask,
     MemoryEfficientAttentionCkOp,
+    MemoryEfficientAttentionCpuOp,
     MemoryEfficientAttentionCutlassFwdFlashBwOp,
     MemoryEfficientAttentionCutlassOp,
     MemoryEfficientAttentionFlashAttentionOp,
@@ -24,6 +25,7 @@ from .fmha import (
 from .indexing import index_select_cat, scaled_index_add
 from .ipc import init_ipc
 from .modpar_layers import ColumnParallelLinear, RowParallelLinear
+from .paged_kv_cache import PagedKVCache
 from .rmsnorm import RMSNorm
 from .rope_padded import rope_padded
 from .seqpar import sequence_parallel_leading_matmul, sequence_parallel_trailing_matmul
@@ -40,6 +42,7 @@ from .swiglu_op import (
     SwiGLUFusedOp,
     SwiGLUOp,
     SwiGLUOpDispatch,
+    SwiGLUPackedCPUOp,
     SwiGLUPackedFusedOp,
     swiglu,
 )
@@ -83,6 +86,7 @@ __all__ = [
     "MemoryEfficientAttentionCutlassOp",
     "MemoryEfficientAttentionFlashAttentionOp",
     "MemoryEfficientAttentionCkOp",
+    "MemoryEfficientAttentionCpuOp",
     "MemoryEfficientAttentionSplitKCkOp",
     "memory_efficient_attention",
     "memory_efficient_attention_backward",
@@ -96,6 +100,8 @@ __all__ = [
     # modpar_layers
     "ColumnParallelLinear",
     "RowParallelLinear",
+    # paged_kv_cache
+    "PagedKVCache",
     # rmsnorm
     "RMSNorm",
     # rope_padded
@@ -114,6 +120,7 @@ __all__ = [
     "SwiGLUFusedOp",
     "SwiGLUOp",
     "SwiGLUOpDispatch",
+    "SwiGLUPackedCPUOp",
     "SwiGLUPackedFusedOp",
     "swiglu",
     # tiled_matmul
@@ -3,7 +3,8 @@
 # This source code is licensed under the BSD license found in the
 # LICENSE file in the root directory of this source tree.
 
-from typing import Any, List, Optional, Sequence, Tuple, Type, Union, cast
+import math
+from typing import Any, Iterator, List, Optional, Sequence, Tuple, Type, Union, cast
 
 import torch
 
@@ -12,6 +13,7 @@ from . import (
     ck,
     ck_decoder,
     ck_splitk,
+    cpu,
     cutlass,
     flash,
     flash3,
@@ -21,7 +23,9 @@ from .attn_bias import (
     VARLEN_BIASES,
     AttentionBias,
     BlockDiagonalMask,
+    LowerTriangularFromBottomRightMask,
     LowerTriangularMask,
+    _get_key_ranges,
 )
 from .common import (
     AttentionBwOpBase,
@@ -31,13 +35,17 @@ from .common import (
     Context,
     Gradients,
     Inputs,
+    _record_attention_flops,
     bmk2bmhk,
 )
 from .dispatch import (
+    _clear_dispatch_cache,
     _dispatch_bw,
     _dispatch_fw,
     _ensure_op_supports_or_raise,
+    _get_dispatch_cache_info,
     _get_use_fa3,
+    _set_dispatch_cache_maxsize,
     _set_use_fa3,
 )
 
@@ -47,6 +55,7 @@ MemoryEfficientAttentionFlashAttentionOp = (flash.FwOp, flash.BwOp)
 MemoryEfficientAttentionCkOp = (ck.FwOp, ck.BwOp)
 MemoryEfficientAttentionCkDecoderOp = (ck_decoder.FwOp, ck.BwOp)
 MemoryEfficientAttentionSplitKCkOp = (ck_splitk.FwOp, ck.BwOp)
+MemoryEfficientAttentionCpuOp = (cpu.FwOp, cpu.BwOp)
 
 
 def _deserialize_bias(attn_bias_ctx, attn_bias_tensor: Optional[torch.Tensor]) -> Any:
@@ -487,7 +496,8 @@ def _memory_efficient_attention_forward(
     else:
         _ensure_op_supports_or_raise(ValueError, "memory_efficient_attention", op, inp)
 
-    out, *_ = op.apply(inp, needs_gradient=False)
+    with _record_attention_flops(inp, is_bwd=False):
+        out, *_ = op.apply(inp, needs_gradient=False)
     return out.reshape(output_shape)
 
 
@@ -500,7 +510,8 @@ def _memory_efficient_attention_forward_requires_grad(
         op = _dispatch_fw(inp, True)
     else:
         _ensure_op_supports_or_raise(ValueError, "memory_efficient_attention", op, inp)
-    out = op.apply(inp, needs_gradient=True)
+    with _record_attention_flops(inp, is_bwd=False):
+        out = op.apply(inp, needs_gradient=True)
     assert out[1] is not None
     return (out[0].reshape(output_shape), out[1])
 
@@ -582,7 +593,8 @@ def _memory_efficient_attention_backward(
                 f"with the operator used in the FW pass."
             )
 
-    grads = op.apply(ctx, inp, grad)
+    with _record_attention_flops(inp, is_bwd=True):
+        grads = op.apply(ctx, inp, grad)
     grads.dq = grads.dq.reshape(shape_dq)
     grads.dk = grads.dk.reshape(shape_dk)
     grads.dv = grads.dv.reshape(shape_dv)
@@ -709,6 +721,13 @@ def merge_attentions(
     if requires_grad and not write_lse:
         raise ValueError("write_lse should be true if inputs require gradients.")
 
+    if attn_split[0].device.type == "cpu":
+        # The merging kernels are written in Triton, which needs a GPU
+        accumulator = AttentionAccumulator(output_dtype=output_dtype)
+        for attn_chunk, lse_chunk in zip(attn_split, lse_split):
+            accumulator.add(attn_chunk, lse_chunk)
+        return accumulator.finalize(write_lse=write_lse)
+
     concat_path = attn_is_concat and lse_is_concat and not requires_grad
     if concat_path:
         attn_split = cast(torch.Tensor, attn_split)
@@ -822,6 +841,466 @@ def merge_attentions(
     return attn_out, lse_out
 
 
+class AttentionAccumulator:
+    """
+    Combines attention outputs computed on different parts of K/V for the same
+    query, like :attr:`merge_attentions`, but receiving the chunks one at a time.
+    Only a running maximum of the LSEs and the corresponding numerator and
+    denominator are kept (in float32), so the memory used does not depend on
+    the number of chunks.
+
+    Example:
+
+    .. code-block:: python
+
+        accumulator = AttentionAccumulator()
+        for k_chunk, v_chunk in zip(k.split(chunk_size, 1), v.split(chunk_size, 1)):
+            accumulator.add(
+                *memory_efficient_attention_partial(q, k_chunk, v_chunk)
+            )
+        out, lse = accumulator.finalize()
+
+    Gradients are propagated to the chunks through regular PyTorch operations.
+    """
+
+    def __init__(self, output_dtype: Optional[torch.dtype] = None) -> None:
+        """
+        Args:
+            output_dtype: dtype of the output, defaults to the dtype
+                of the first chunk
+        """
+        self.output_dtype = output_dtype
+        self.num_chunks = 0
+        self._lse_dtype: Optional[torch.dtype] = None
+        self._shape: Optional[Tuple[torch.Size, torch.Size]] = None
+        # Running values, all of shape [B, M, (G,) H, 1] except the numerator
+        # which is [B, M, (G,) H, Kq]. The numerator and denominator are
+        # relative to the running maximum (or 0 where it is -inf)
+        self._max: Optional[torch.Tensor] = None
+        self._numerator: Optional[torch.Tensor] = None
+        self._denominator: Optional[torch.Tensor] = None
+
+    def add(self, attn: torch.Tensor, lse: torch.Tensor) -> None:
+        """
+        Adds the output of the attention on a chunk of K/V
+
+        Args:
+            attn: attention output for the chunk,
+                of shape [B, M, G, H, Kq] or [B, M, H, Kq]
+            lse: LSE for the chunk, of shape [B, G, H, M] or [B, H, M]
+        """
+        if attn.ndim != lse.ndim + 1 or attn.ndim not in (4, 5):
+            raise ValueError(f"Incompatible input shapes: {attn.shape=}, {lse.shape=}")
+        if self._shape is None:
+            self._shape = (attn.shape, lse.shape)
+            if self.output_dtype is None:
+                self.output_dtype = attn.dtype
+            self._lse_dtype = lse.dtype
+        elif self._shape != (attn.shape, lse.shape):
+            raise ValueError(
+                f"Incompatible input shapes for chunk {self.num_chunks}: "
+                f"{attn.shape=}, {lse.shape=}, expected {self._shape}"
+            )
+        self.num_chunks += 1
+        attn = attn.float()
+        lse = lse.float().movedim(-1, 1).unsqueeze(-1)
+        if self._max is None:
+            self._max = lse
+            scale = torch.exp(lse - _finite_or_zero(lse))
+            self._numerator = attn * scale
+            self._denominator = scale
+            return
+        assert self._numerator is not None and self._denominator is not None
+        new_max = torch.maximum(self._max, lse)
+        # Queries which didn't attend to any key so far have an LSE of -inf
+        safe_max = _finite_or_zero(new_max)
+        old_scale = torch.exp(self._max - safe_max)
+        new_scale = torch.exp(lse - safe_max)
+        if torch.is_grad_enabled() and any(
+            x.requires_grad for x in (self._numerator, attn, lse)
+        ):
+            self._numerator = self._numerator * old_scale + attn * new_scale
+            self._denominator = self._denominator * old_scale + new_scale
+        else:
+            self._numerator.mul_(old_scale).addcmul_(attn, new_scale)
+            self._denominator.mul_(old_scale).add_(new_scale)
+        self._max = new_max
+
+    def finalize(
+        self, write_lse: bool = True
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        Returns the attention on all the chunks added so far, in the same
+        format as :attr:`merge_attentions`:
+
+        attn_out: [B, M, G, H, Kq] or [B, M, H, Kq]
+        lse_out: [B, G, H, M] or [B, H, M] if write_lse, or None otherwise
+        """
+        if self._max is None:
+            raise ValueError("No chunk was added")
+        assert self._numerator is not None and self._denominator is not None
+        denominator = self._denominator
+        attn_out = self._numerator / denominator.masked_fill(denominator == 0, 1)
+        attn_out = attn_out.to(self.output_dtype)
+        if not write_lse:
+            return attn_out, None
+        lse_out = _finite_or_zero(self._max) + torch.log(denominator)
+        return attn_out, lse_out.squeeze(-1).movedim(1, -1).to(self._lse_dtype)
+
+
+def _finite_or_zero(lse: torch.Tensor) -> torch.Tensor:
+    return lse.masked_fill(lse == -math.inf, 0)
+
+
+def chunked_memory_efficient_attention(
+    query: torch.Tensor,
+    key: torch.Tensor,
+    value: torch.Tensor,
+    attn_bias: Optional[Union[torch.Tensor, AttentionBias]] = None,
+    scale: Optional[float] = None,
+    *,
+    kv_chunk: int = 4096,
+    q_chunk: Optional[int] = None,
+    op: Optional[Union[AttentionOp, Type[AttentionFwOpBase]]] = None,
+    output_dtype: Optional[torch.dtype] = None,
+    prefetch: bool = False,
+) -> torch.Tensor:
+    """
+    Same as :attr:`memory_efficient_attention`, but computed on chunks of at most
+    ``q_chunk`` queries and ``kv_chunk`` keys at a time with
+    :attr:`memory_efficient_attention_partial`, the chunks being combined with an
+    :attr:`AttentionAccumulator`. The memory used thus does not depend on
+    the number of keys, and chunks of keys which are masked
+    for all the queries of a chunk are skipped.
+    The backward pass is computed chunk by chunk as well.
+
+    ``key`` and ``value`` can live on a different device than ``query``
+    (eg in host memory, or memory-mapped from disk): the chunks are then
+    copied to the device of ``query`` when needed. With ``prefetch=True``
+    and CUDA queries, the next chunk is copied on a side stream while
+    the current one is processed.
+
+    Supports no bias, tensor biases (without gradient), and the biases supported by
+    :attr:`xformers.ops.fmha.cpu.FwOp` (causal, local, and the
+    block-diagonal biases, including paged ones).
+
+    Args:
+        kv_chunk: Number of keys per chunk
+        q_chunk: Number of queries per chunk (defaults to ``kv_chunk``).
+            The chunks of keys which are partially masked for a chunk of
+            queries (other than causally) are given a tensor bias of
+            ``q_chunk * kv_chunk`` elements, which bounds the extra memory used
+        op: The operator to use for each chunk, see
+            :attr:`memory_efficient_attention`
+        output_dtype: dtype of the output, defaults to the dtype of ``query``
+        prefetch: Overlap the copies of the chunks of keys and values
+            with the computation
+
+    :Note:
+
+        This is experimental.
+    """
+    if kv_chunk <= 0 or (q_chunk is not None and q_chunk <= 0):
+        raise ValueError(f"Invalid chunk sizes: {kv_chunk=}, {q_chunk=}")
+    is_bmk = query.ndim == 3
+    if is_bmk:
+        query, key, value = query.unsqueeze(2), key.unsqueeze(2), value.unsqueeze(2)
+        if isinstance(attn_bias, torch.Tensor) and attn_bias.ndim == 3:
+            attn_bias = attn_bias.unsqueeze(1)
+    chunker = _AttentionChunker(
+        query, key, value, attn_bias, kv_chunk, q_chunk, prefetch
+    )
+    op_fw: Optional[Type[AttentionFwOpBase]] = op[0] if isinstance(op, tuple) else op
+    op_bw = op[1] if isinstance(op, tuple) else None
+    output_dtype = output_dtype or query.dtype
+    if torch.is_grad_enabled() and any(x.requires_grad for x in (query, key, value)):
+        out = _ChunkedAttention.apply(
+            query, key, value, chunker, scale, op_fw, op_bw, output_dtype
+        )
+    else:
+        out, _ = _chunked_attention_forward(
+            query, chunker, scale, op_fw, output_dtype, write_lse=False
+        )
+    return out.squeeze(2) if is_bmk else out
+
+
+class _AttentionChunker:
+    """
+    Splits the attention in chunks of queries and keys,
+    with the bias of each chunk
+    """
+
+    def __init__(
+        self,
+        query: torch.Tensor,
+        key: torch.Tensor,
+        value: torch.Tensor,
+        attn_bias: Optional[Union[torch.Tensor, AttentionBias]],
+        kv_chunk: int,
+        q_chunk: Optional[int],
+        prefetch: bool,
+    ) -> None:
+        self.key, self.value = key, value
+        self.device = query.device
+        self.prefetch = prefetch
+        self.num_queries = query.shape[1]
+        self.num_keys = key.shape[1]
+        self.q_chunk = q_chunk or kv_chunk
+        self.kv_chunk = kv_chunk
+        self.tensor_bias: Optional[torch.Tensor] = None
+        self.key_ranges: Optional[
+            Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]
+        ] = None
+        self.key_index: Optional[torch.Tensor] = None
+        if isinstance(attn_bias, AttentionBias):
+            self.key_ranges = _get_key_ranges(
+                attn_bias, self.num_queries, self.num_keys, self.device
+            )
+            if self.key_ranges is None:
+                raise NotImplementedError(
+                    f"chunked_memory_efficient_attention: {type(attn_bias).__name__} "
+                    "is not supported"
+                )
+            self.key_index = self.key_ranges[2]
+            if self.key_index is not None:
+                self.num_keys = self.key_index.shape[0]
+            # Decide on the host which chunks are masked, with a single transfer
+            self._k_start_host = self.key_ranges[0].cpu()
+            self._k_end_host = self.key_ranges[1].cpu()
+        elif isinstance(attn_bias, torch.Tensor):
+            if attn_bias.requires_grad:
+                raise NotImplementedError(
+                    "chunked_memory_efficient_attention: "
+                    "gradients of the bias are not supported"
+                )
+            self.tensor_bias = attn_bias
+
+    def query_chunks(self) -> Iterator[Tuple[int, int]]:
+        for q0 in range(0, self.num_queries, self.q_chunk):
+            yield q0, min(q0 + self.q_chunk, self.num_queries)
+
+    def key_chunks(
+        self, q: torch.Tensor, q0: int
+    ) -> Iterator[
+        Tuple[
+            int,
+            int,
+            torch.Tensor,
+            torch.Tensor,
+            Optional[Union[torch.Tensor, AttentionBias]],
+        ]
+    ]:
+        """
+        Yields `(k0, k1, key, value, bias)` for the chunks of (logical) keys
+        `[k0, k1)` the queries `q` (starting at `q0`) attend to
+        """
+        q1 = q0 + q.shape[1]
+        chunks = [
+            (k0, min(k0 + self.kv_chunk, self.num_keys))
+            for k0 in range(0, self.num_keys, self.kv_chunk)
+        ]
+        masked = [False] * len(chunks)
+        if self.key_ranges is not None:
+            k_start, k_end = self._k_start_host[q0:q1], self._k_end_host[q0:q1]
+            chunks = [
+                (k0, k1) for k0, k1 in chunks if ((k_start < k1) & (k_end > k0)).any()
+            ]
+            masked = [
+                bool((k_start > k0).any() or (k_end < k1).any()) for k0, k1 in chunks
+            ]
+        for (k0, k1, k, v), is_masked in zip(self._load_chunks(chunks), masked):
+            bias: Optional[Union[torch.Tensor, AttentionBias]] = None
+            if self.tensor_bias is not None:
+                bias = self.tensor_bias[..., q0:q1, k0:k1]
+            elif is_masked and self._is_causal_chunk(q0, q1, k0, k1):
+                bias = LowerTriangularFromBottomRightMask()
+            elif is_masked:
+                bias = self._chunk_bias(q, q0, k0, k1)
+            yield k0, k1, k, v, bias
+
+    def _is_causal_chunk(self, q0: int, q1: int, k0: int, k1: int) -> bool:
+        """
+        Whether the mask of the chunk is a :attr:`LowerTriangularFromBottomRightMask`
+        (eg the chunks on the diagonal of a causal mask), decided on the host
+        """
+        num_keys = k1 - k0
+        start = (self._k_start_host[q0:q1] - k0).clamp(0, num_keys)
+        end = (self._k_end_host[q0:q1] - k0).clamp(0, num_keys)
+        causal_end = torch.arange(q1 - q0) + num_keys - (q1 - q0) + 1
+        attends = end > start
+        return bool(
+            (start[attends] == 0).all()
+            and (end[attends] == causal_end[attends]).all()
+            and (causal_end[~attends] <= 0).all()
+        )
+
+    def _chunk_bias(self, q: torch.Tensor, q0: int, k0: int, k1: int) -> torch.Tensor:
+        assert self.key_ranges is not None
+        q1 = q0 + q.shape[1]
+        keys = torch.arange(k0, k1, device=q.device)
+        mask = (keys >= self.key_ranges[0][q0:q1, None]) & (
+            keys < self.key_ranges[1][q0:q1, None]
+        )
+        # Keep the rows aligned, which some kernels require
+        aligned_k = (k1 - k0 + 7) // 8 * 8
+        bias = torch.zeros([q1 - q0, aligned_k], dtype=q.dtype, device=q.device)
+        bias = bias[:, : k1 - k0].masked_fill_(~mask, -math.inf)
+        # [B, (G,) H, Mq, Mk]
+        return bias.expand(q.shape[0], *q.shape[2:-1], q1 - q0, k1 - k0)
+
+    def key_positions(self, k0: int, k1: int) -> Union[slice, torch.Tensor]:
+        """Positions in `key` of the logical keys `[k0, k1)`"""
+        if self.key_index is None:
+            return slice(k0, k1)
+        return self.key_index[k0:k1].to(self.key.device)
+
+    def _load(self, k0: int, k1: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        positions = self.key_positions(k0, k1)
+        if isinstance(positions, slice):
+            k, v = self.key[:, positions], self.value[:, positions]
+        else:
+            k = self.key.index_select(1, positions)
+            v = self.value.index_select(1, positions)
+        if k.device == self.device:
+            return k, v
+        if self.device.type == "cuda" and k.device.type == "cpu":
+            k, v = k.pin_memory(), v.pin_memory()
+        return (
+            k.to(self.device, non_blocking=True),
+            v.to(self.device, non_blocking=True),
+        )
+
+    def _load_chunks(
+        self, chunks: List[Tuple[int, int]]
+    ) -> Iterator[Tuple[int, int, torch.Tensor, torch.Tensor]]:
+        if not (
+            self.prefetch
+            and self.device.type == "cuda"
+            and self.key.device != self.device
+        ):
+            for k0, k1 in chunks:
+                yield (k0, k1, *self._load(k0, k1))
+            return
+
+        copy_stream = torch.cuda.Stream(self.device)
+        compute_stream = torch.cuda.current_stream(self.device)
+
+        def load_async(k0: int, k1: int) -> Tuple[torch.Tensor, torch.Tensor, Any]:
+            with torch.cuda.stream(copy_stream):
+                k, v = self._load(k0, k1)
+                event = torch.cuda.Event()
+                event.record(copy_stream)
+            return k, v, event
+
+        pending = load_async(*chunks[0]) if chunks else None
+        for i, (k0, k1) in enumerate(chunks):
+            assert pending is not None
+            k, v, event = pending
+            if i + 1 < len(chunks):
+                pending = load_async(*chunks[i + 1])
+            compute_stream.wait_event(event)
+            k.record_stream(compute_stream)
+            v.record_stream(compute_stream)
+            yield k0, k1, k, v
+
+
+def _chunked_attention_forward(
+    query: torch.Tensor,
+    chunker: _AttentionChunker,
+    scale: Optional[float],
+    op: Optional[Type[AttentionFwOpBase]],
+    output_dtype: torch.dtype,
+    write_lse: bool,
+) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    outputs: List[torch.Tensor] = []
+    lses: List[Optional[torch.Tensor]] = []
+    for q0, q1 in chunker.query_chunks():
+        q = query[:, q0:q1]
+        accumulator = AttentionAccumulator(output_dtype=output_dtype)
+        for _, _, k, v, bias in chunker.key_chunks(q, q0):
+            accumulator.add(
+                *memory_efficient_attention_partial(q, k, v, bias, scale=scale, op=op)
+            )
+        if accumulator.num_chunks == 0:
+            # None of these queries attends to any key
+            out = torch.zeros(
+                [*q.shape[:-1], chunker.value.shape[-1]],
+                dtype=output_dtype,
+                device=q.device,
+            )
+            lse: Optional[torch.Tensor] = torch.full(
+                [q.shape[0], *q.shape[2:-1], q1 - q0],
+                -math.inf,
+                dtype=torch.float32,
+                device=q.device,
+            )
+        else:
+            out, lse = accumulator.finalize(write_lse=write_lse)
+        outputs.append(out)
+        lses.append(lse)
+    out = torch.cat(outputs, dim=1)
+    if not write_lse:
+        return out, None
+    return out, torch.cat(cast(List[torch.Tensor], lses), dim=-1)
+
+
+class _ChunkedAttention(torch.autograd.Function):
+    @staticmethod
+    # type: ignore
+    def forward(
+        ctx,
+        query: torch.Tensor,
+        key: torch.Tensor,
+        value: torch.Tensor,
+        chunker: _AttentionChunker,
+        scale: Optional[float],
+        op_fw: Optional[Type[AttentionFwOpBase]],
+        op_bw: Optional[Type[AttentionBwOpBase]],
+        output_dtype: torch.dtype,
+    ) -> torch.Tensor:
+        out, lse = _chunked_attention_forward(
+            query, chunker, scale, op_fw, output_dtype, write_lse=True
+        )
+        ctx.save_for_backward(query, out, lse)
+        ctx.chunker, ctx.scale, ctx.op_bw = chunker, scale, op_bw
+        return out
+
+    @staticmethod
+    @torch.autograd.function.once_differentiable
+    def backward(ctx, grad: torch.Tensor) -> Tuple[Optional[torch.Tensor], ...]:
+        # With the softmax statistics of the whole attention, the
+        # gradients are a sum of contributions of each chunk
+        query, out, lse = ctx.saved_tensors
+        chunker: _AttentionChunker = ctx.chunker
+        dq = torch.zeros_like(query)
+        dk = torch.zeros_like(chunker.key)
+        dv = torch.zeros_like(chunker.value)
+        for q0, q1 in chunker.query_chunks():
+            q = query[:, q0:q1]
+            for k0, k1, k, v, bias in chunker.key_chunks(q, q0):
+                dq_chunk, dk_chunk, dv_chunk = memory_efficient_attention_backward(
+                    grad[:, q0:q1].contiguous(),
+                    out[:, q0:q1].contiguous(),
+                    lse[..., q0:q1].contiguous(),
+                    q,
+                    k,
+                    v,
+                    bias,
+                    scale=ctx.scale,
+                    op=ctx.op_bw,
+                )
+                dq[:, q0:q1] += dq_chunk
+                positions = chunker.key_positions(k0, k1)
+                dk_chunk, dv_chunk = dk_chunk.to(dk.device), dv_chunk.to(dv.device)
+                if isinstance(positions, slice):
+                    dk[:, positions] += dk_chunk
+                    dv[:, positions] += dv_chunk
+                else:
+                    dk.index_add_(1, positions, dk_chunk)
+                    dv.index_add_(1, positions, dv_chunk)
+        return dq, dk, dv, None, None, None, None, None
+
+
 class _MergeAttentions(torch.autograd.Function):
     @staticmethod
     # type: ignore
@@ -865,12 +1344,14 @@ ALL_FW_OPS: List[Type[AttentionFwOpBase]] = [
     flash.FwOp,
     flash3.FwOp,
     triton_splitk.FwOp,
+    cpu.FwOp,
 ]
 
 ALL_BW_OPS: List[Type[AttentionBwOpBase]] = [
     cutlass.BwOp if torch.version.cuda else ck.BwOp,
     flash.BwOp,
     flash3.BwOp,
+    cpu.BwOp,
 ]
 
 __all__ = [
@@ -884,10 +1365,14 @@ __all__ = [
     "memory_efficient_attention",
     "MemoryEfficientAttentionCkOp",
     "MemoryEfficientAttentionCkDecoderOp",
+    "MemoryEfficientAttentionCpuOp",
     "ALL_FW_OPS",
     "ALL_BW_OPS",
     "attn_bias",
     "_get_use_fa3",
     "_set_use_fa3",
+    "_clear_dispatch_cache",
+    "_get_dispatch_cache_info",
+    "_set_dispatch_cache_maxsize",
     "BlockDiagonalMask",
 ]
@@ -18,20 +18,10 @@ parts of the attention matrix we will need to compute (eg causal masks).
 Some very common biases are LowerTriangularMask and BlockDiagonalMask.
 """
 
+import copy
 import math
 from dataclasses import dataclass
-from typing import (
-    Any,
-    ClassVar,
-    Iterable,
-    List,
-    Optional,
-    Sequence,
-    Tuple,
-    Type,
-    Union,
-    cast,
-)
+from typing import Any, ClassVar, Iterable, List, Optional, Sequence, Tuple, Type, Union
 
 import torch
 
@@ -86,6 +76,54 @@ class AttentionBias:
         """
         raise NotImplementedError()
 
+    def flops(
+        self,
+        query_shape: Sequence[int],
+        key_shape: Sequence[int],
+        value_shape: Sequence[int],
+    ) -> int:
+        """
+        Number of floating-point operations of the forward pass
+        (the `Q @ K^T` and `P @ V` matmuls) with this bias, counting only
+        the query/key pairs which are not masked.
+        Shapes are in BMHK or BMGHK format. The backward pass costs about
+        2.5 times as much (it recomputes `Q @ K^T`).
+        """
+        num_pairs, _ = _count_attended_keys(self, query_shape[1], key_shape[1])
+        num_heads = math.prod(query_shape[2:-1])
+        return (
+            2
+            * query_shape[0]
+            * num_heads
+            * num_pairs
+            * (query_shape[-1] + value_shape[-1])
+        )
+
+    def bytes_accessed(
+        self,
+        query_shape: Sequence[int],
+        key_shape: Sequence[int],
+        value_shape: Sequence[int],
+        element_size: int = 2,
+    ) -> int:
+        """
+        Minimum number of bytes read and written by the forward pass with
+        this bias: the queries and the output, plus the keys and values
+        that at least one query attends to (a page shared by several
+        sequences of a paged bias is only counted once).
+        Shapes are in BMHK or BMGHK format.
+        """
+        _, num_keys = _count_attended_keys(self, query_shape[1], key_shape[1])
+        q_numel = math.prod(query_shape)
+        out_numel = math.prod(query_shape[:-1]) * value_shape[-1]
+        kv_numel = (
+            key_shape[0]
+            * num_keys
+            * math.prod(key_shape[2:-1])
+            * (key_shape[-1] + value_shape[-1])
+        )
+        return element_size * (q_numel + out_numel + kv_numel)
+
 
 def _get_default_bias_device(device: Optional[torch.device] = None) -> torch.device:
     if device is None:
@@ -306,6 +344,13 @@ class _SeqLenInfo:
         min_seqlen: 2
         seqstart_py: [0, 2, 5, 7]
         seqstart: torch.IntTensor([0, 2, 5, 7])
+
+    When created from a tensor of sequence lengths, only the tensors are
+    computed (on the same device, without synchronization). The python-side
+    members (`seqstart_py`, `min_seqlen`, `max_seqlen`...) are then computed
+    separately the first time they are accessed, unless they are assigned
+    before. Operator dispatch reads `min_seqlen` and `max_seqlen`: assign both
+    to avoid synchronizing with the device.
     """
 
     seqstart: torch.Tensor
@@ -313,15 +358,63 @@ class _SeqLenInfo:
     min_seqlen: int
     seqstart_py: List[int]
 
+    _LAZY_FIELDS: ClassVar[Tuple[str, ...]] = (
+        "max_seqlen",
+        "min_seqlen",
+        "seqstart_py",
+    )
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called when `name` is not set on the instance
+        if name in type(self)._LAZY_FIELDS and "seqstart" in self.__dict__:
+            self._compute_lazy_field(name)
+            return self.__dict__[name]
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'"
+        )
+
+    @classmethod
+    def _create_lazy(cls, **tensors: Any) -> Any:
+        """
+        Creates an instance with only some members set, the missing ones
+        are computed on first access by `_compute_lazy_field`
+        """
+        info = cls.__new__(cls)
+        info.__dict__.update(tensors)
+        return info
+
+    def _compute_lazy_field(self, name: str) -> None:
+        if name == "seqstart_py":
+            self.__dict__[name] = self.seqstart.tolist()
+        elif "seqstart_py" in self.__dict__:
+            seqstart_py = self.seqstart_py
+            self._set_min_max_seqlen(
+                [end - start for start, end in zip(seqstart_py, seqstart_py[1:])]
+            )
+        else:
+            self._set_min_max_seqlen_from_tensor(self.seqstart.diff())
+
+    def _set_min_max_seqlen(self, seqlens: Sequence[int]) -> None:
+        self.__dict__.setdefault("min_seqlen", min(seqlens, default=-1))
+        self.__dict__.setdefault("max_seqlen", max(seqlens, default=-1))
+
+    def _set_min_max_seqlen_from_tensor(self, seqlens: torch.Tensor) -> None:
+        # A single synchronization, without copying all the lengths
+        if seqlens.numel() == 0:
+            self._set_min_max_seqlen([])
+            return
+        self._set_min_max_seqlen(torch.stack([seqlens.min(), seqlens.max()]).tolist())
+
+    def _replace_tensors(self, **tensors: torch.Tensor) -> Any:
+        # Does not trigger the computation of lazy members
+        info = copy.copy(self)
+        info.__dict__.update(tensors)
+        return info
+
     def to(self, device: torch.device) -> "_SeqLenInfo":
         if self.seqstart.device == device:
             return self
-        return _SeqLenInfo(
-            seqstart=self.seqstart.to(device),
-            max_seqlen=self.max_seqlen,
-            min_seqlen=self.min_seqlen,
-            seqstart_py=self.seqstart_py,
-        )
+        return self._replace_tensors(seqstart=self.seqstart.to(device))
 
     def intervals(self) -> Iterable[Tuple[int, int]]:
         yield from zip(self.seqstart_py, self.seqstart_py[1:])
@@ -349,11 +442,20 @@ class _SeqLenInfo:
 
     @classmethod
     def from_seqlens(
-        cls, seqlens: Iterable[int], *, device: Optional[torch.device] = None
+        cls,
+        seqlens: Union[Iterable[int], torch.Tensor],
+        *,
+        device: Optional[torch.device] = None,
     ) -> "_SeqLenInfo":
         """
         Input tensors are assumed to be in shape [B, M, *]
         """
+        if isinstance(seqlens, torch.Tensor):
+            seqlens = seqlens.to(device=device, dtype=torch.int32)
+            seqstart = torch.nn.functional.pad(
+                seqlens.cumsum(0, dtype=torch.int32), (1, 0)
+            )
+            return cls._create_lazy(seqstart=seqstart)
         device = _get_default_bias_device(device)
         min_seqlen, max_seqlen, seqstart_py, seqstart = cls._get_seqstart(
             seqlens, device=device
@@ -366,6 +468,22 @@ class _SeqLenInfo:
             seqstart_py=seqstart_py,
         )
 
+    def _set_seqlens_(self, seqlens: Union[int, torch.Tensor]) -> None:
+        """
+        Sets the length of every block (the same for all blocks if `seqlens` is
+        an int), updating `seqstart` in-place. With an int, `min_seqlen` and
+        `max_seqlen` are known without synchronization, and `seqstart_py` is
+        only computed if it is accessed
+        """
+        for name in self._LAZY_FIELDS:
+            self.__dict__.pop(name, None)
+        if isinstance(seqlens, torch.Tensor):
+            torch.cumsum(seqlens, 0, dtype=self.seqstart.dtype, out=self.seqstart[1:])
+            return
+        num_blocks = self.seqstart.shape[0] - 1
+        torch.arange(num_blocks + 1, out=self.seqstart).mul_(seqlens)
+        self.min_seqlen = self.max_seqlen = seqlens if num_blocks else -1
+
     def split(
         self, x: torch.Tensor, batch_sizes: Optional[Sequence[int]] = None
     ) -> List[torch.Tensor]:
@@ -433,24 +551,48 @@ class _PaddedSeqLenInfo(_SeqLenInfo):
     # of the i-th sequence
     # seqstart: torch.Tensor
 
+    _LAZY_FIELDS: ClassVar[Tuple[str, ...]] = (
+        *_SeqLenInfo._LAZY_FIELDS,
+        "seqlen_py",
+    )
+
     def __post_init__(self) -> None:
         assert len(self.seqstart_py) == len(self.seqlen_py) + 1
+        self._active_slots()
+
+    def _compute_lazy_field(self, name: str) -> None:
+        if name == "seqstart_py":
+            num_blocks = self.seqlen.shape[0]
+            self.__dict__[name] = list(
+                range(0, num_blocks * self.padding + 1, self.padding)
+            )
+        elif name == "seqlen_py":
+            self.__dict__[name] = self.seqlen.tolist()
+        elif "seqlen_py" in self.__dict__:
+            self._set_min_max_seqlen(self.seqlen_py)
+        else:
+            self._set_min_max_seqlen_from_tensor(self.seqlen)
 
     def to(self, device: torch.device) -> "_PaddedSeqLenInfo":
         if self.seqlen.device == device:
             return self
-        return _PaddedSeqLenInfo(
-            # _SeqLenInfo
+        return self._replace_tensors(
             seqstart=self.seqstart.to(device),
-            max_seqlen=self.max_seqlen,
-            min_seqlen=self.min_seqlen,
-            seqstart_py=self.seqstart_py,
-            # _PaddedSeqLenInfo
             seqlen=self.seqlen.to(device),
-            seqlen_py=self.seqlen_py,
-            padding=self.padding,
+            _active=self._active_slots().to(device),
         )
 
+    def _active_slots(self) -> torch.Tensor:
+        """
+        Preallocated buffer, 1 for the blocks holding a sequence and 0 for
+        the free ones, maintained by `_set_block_seqlens_`. Initially, the
+        blocks which are not empty hold a sequence
+        """
+        active = self.__dict__.get("_active")
+        if active is None:
+            active = self.__dict__["_active"] = (self.seqlen > 0).to(self.seqlen.dtype)
+        return active
+
     def intervals(self) -> Iterable[Tuple[int, int]]:
         for (start, _), length in zip(super().intervals(), self.seqlen_py):
             yield start, start + length
@@ -466,7 +608,7 @@ class _PaddedSeqLenInfo(_SeqLenInfo):
     @classmethod
     def from_seqlens_padded(
         cls,
-        seqlens: Sequence[int],
+        seqlens: Union[Sequence[int], torch.Tensor],
         padding: int,
         *,
         device: Optional[torch.device] = None,
@@ -475,7 +617,21 @@ class _PaddedSeqLenInfo(_SeqLenInfo):
         Input tensors are assumed to be in shape [B, M, *]
         seqstart = padding * torch.arange(batch_size)
         """
-        assert not isinstance(seqlens, torch.Tensor)
+        if isinstance(seqlens, torch.Tensor):
+            seqlen = seqlens.to(device=device, dtype=torch.int32)
+            seqstart = torch.arange(
+                0,
+                (seqlen.shape[0] + 1) * padding,
+                padding,
+                dtype=torch.int32,
+                device=seqlen.device,
+            )
+            return cls._create_lazy(
+                seqstart=seqstart,
+                seqlen=seqlen,
+                padding=padding,
+                _active=(seqlen > 0).to(seqlen.dtype),
+            )
         assert all(
             seqlen <= padding for seqlen in seqlens
         ), f"Seqlens {seqlens} Padding {padding}"
@@ -492,6 +648,96 @@ class _PaddedSeqLenInfo(_SeqLenInfo):
             padding=padding,
         )
 
+    def _forget_seqlens_py(self) -> None:
+        # They will be computed again from `seqlen` when needed
+        for name in ("seqlen_py", "min_seqlen", "max_seqlen"):
+            self.__dict__.pop(name, None)
+
+    def _set_seqlens_py(self, seqlen_py: List[int]) -> None:
+        self._forget_seqlens_py()
+        self.seqlen_py = seqlen_py
+        self._set_min_max_seqlen(seqlen_py)
+
+    def _advance_(self, n: Union[int, torch.Tensor]) -> None:
+        """
+        Adds `n` to the length of every block holding a sequence, updating
+        `seqlen` in-place.
+        The keys must fit in the padding: this is only checked (raising
+        a `ValueError`) when the maximum length is known on the host
+        """
+        active = self._active_slots()
+        if not isinstance(n, int):
+            self.seqlen.addcmul_(active, n)
+            self._forget_seqlens_py()
+            return
+        if "seqlen_py" in self.__dict__:
+            self._set_min_max_seqlen(self.seqlen_py)
+        appended_empty = self.__dict__.get("_appended_empty", False)
+        max_seqlen = self.__dict__.get("max_seqlen", 0)
+        if (max_seqlen > 0 or appended_empty) and max_seqlen + n > self.padding:
+            raise ValueError(
+                f"Can't add {n} keys to a block of length {max_seqlen} "
+                f"with padding {self.padding}"
+            )
+        self.seqlen.add_(active, alpha=n)
+        # The blocks which are not empty hold a sequence. The empty ones are
+        # free, unless they were appended empty: then only `max_seqlen` is
+        # still known
+        bounds = {
+            name: self.__dict__[name]
+            for name in ("min_seqlen", "max_seqlen")
+            if name in self.__dict__
+        }
+        if appended_empty and n > 0:
+            del self.__dict__["_appended_empty"]
+        self._forget_seqlens_py()
+        for name, value in bounds.items():
+            if value > 0 or (appended_empty and name == "max_seqlen"):
+                self.__dict__[name] = value + n
+            elif not appended_empty:
+                self.__dict__[name] = value
+
+    def _set_block_seqlens_(
+        self,
+        indices: Union[Sequence[int], torch.Tensor],
+        seqlens: Union[int, Sequence[int], torch.Tensor],
+        active: bool,
+    ) -> None:
+        """
+        Sets the length of the blocks `indices` to `seqlens`, updating
+        `seqlen` in-place. With `active=True`, the blocks hold a sequence
+        (even empty) which grows with `_advance_`, otherwise they are free
+        """
+        index = torch.as_tensor(indices, dtype=torch.long, device=self.seqlen.device)
+        self._active_slots().index_fill_(0, index, int(active))
+        if isinstance(seqlens, int):
+            values: Sequence[int] = [seqlens] * index.shape[0]
+            self.seqlen.index_fill_(0, index, seqlens)
+        else:
+            values = seqlens  # type: ignore
+            seqlen = torch.as_tensor(
+                seqlens, dtype=self.seqlen.dtype, device=self.seqlen.device
+            )
+            self.seqlen.index_copy_(0, index, seqlen)
+        if active and (
+            isinstance(values, torch.Tensor) or any(value == 0 for value in values)
+        ):
+            # `_advance_` can't tell them from the free blocks on the host
+            self.__dict__["_appended_empty"] = True
+        if (
+            isinstance(indices, torch.Tensor)
+            or isinstance(values, torch.Tensor)
+            or "seqlen_py" not in self.__dict__
+        ):
+            self._forget_seqlens_py()
+            return
+        if any(value > self.padding for value in values):
+            raise ValueError(f"Seqlens {values} Padding {self.padding}")
+        seqlen_py = list(self.seqlen_py)
+        for i, value in zip(indices, values):
+            seqlen_py[i] = value
+        self._set_seqlens_py(seqlen_py)
+
     def split(
         self, x: torch.Tensor, batch_sizes: Optional[Sequence[int]] = None
     ) -> List[torch.Tensor]:
@@ -551,18 +797,26 @@ class _GappySeqInfo(_SeqLenInfo):
     # of the i-th sequence
     # seqstart: torch.Tensor
 
+    _LAZY_FIELDS: ClassVar[Tuple[str, ...]] = (
+        *_SeqLenInfo._LAZY_FIELDS,
+        "seqlen_py",
+    )
+
+    def _compute_lazy_field(self, name: str) -> None:
+        if name == "seqstart_py":
+            self.__dict__[name] = self.seqstart.tolist()
+        elif name == "seqlen_py":
+            self.__dict__[name] = self.seqlen.tolist()
+        elif "seqlen_py" in self.__dict__:
+            self._set_min_max_seqlen(self.seqlen_py)
+        else:
+            self._set_min_max_seqlen_from_tensor(self.seqlen)
+
     def to(self, device: torch.device) -> "_GappySeqInfo":
         if self.seqlen.device == device:
             return self
-        return _GappySeqInfo(
-            # _SeqLenInfo
-            seqstart=self.seqstart.to(device),
-            max_seqlen=self.max_seqlen,
-            min_seqlen=self.min_seqlen,
-            seqstart_py=self.seqstart_py,
-            # _GappySeqInfo
-            seqlen=self.seqlen.to(device),
-            seqlen_py=self.seqlen_py,
+        return self._replace_tensors(
+            seqstart=self.seqstart.to(device), seqlen=self.seqlen.to(device)
         )
 
     def intervals(self) -> Iterable[Tuple[int, int]]:
@@ -578,14 +832,12 @@ class _GappySeqInfo(_SeqLenInfo):
     @classmethod
     def from_seqlens_gappy(
         cls,
-        seqstarts: Sequence[int],
-        seqlens: Sequence[int],
+        seqstarts: Union[Sequence[int], torch.Tensor],
+        seqlens: Union[Sequence[int], torch.Tensor],
         paged: bool,
         *,
         device: torch.device,
     ) -> "_GappySeqInfo":
-        assert not isinstance(seqlens, torch.Tensor)
-        seqstart_py = list(seqstarts)
         if len(seqlens) == 0:
             raise ValueError("No elements")
         if len(seqstarts) - len(seqlens) != (0 if paged else 1):
@@ -593,6 +845,12 @@ class _GappySeqInfo(_SeqLenInfo):
             raise ValueError(
                 f"len(seqstarts)={seqstarts} should be {extra}len(seqlens)={seqlens}"
             )
+        if isinstance(seqlens, torch.Tensor) or isinstance(seqstarts, torch.Tensor):
+            return cls._create_lazy(
+                seqstart=torch.as_tensor(seqstarts, dtype=torch.int32, device=device),
+                seqlen=torch.as_tensor(seqlens, dtype=torch.int32, device=device),
+            )
+        seqstart_py = list(seqstarts)
         seqlen = torch.tensor(seqlens, dtype=torch.int32, device=device)
         return cls(
             seqlen=seqlen,
@@ -660,55 +918,31 @@ class BlockDiagonalMask(AttentionBias):
             _batch_sizes=self._batch_sizes,
         )
 
-    def _create_block_mask(
-        self,
-        shape: Tuple[int, ...],
-        dtype: torch.dtype = torch.float32,
-        device: Union[str, torch.device] = "cpu",
-    ) -> torch.Tensor:
-        return torch.zeros(
-            shape,
-            dtype=dtype,
-            device=device,
-        )
-
     def materialize(
         self,
         shape: Tuple[int, ...],
         dtype: torch.dtype = torch.float32,
         device: Union[str, torch.device] = "cpu",
+        *,
+        q_range: Optional[Tuple[int, int]] = None,
     ) -> torch.Tensor:
-        """Materialize the attention bias - for debugging & testing"""
-        assert shape[-1] == self.k_seqinfo.seqstart_py[-1], (
-            shape[-1],
-            self.k_seqinfo.seqstart_py[-1],
-        )
-        assert shape[-2] == self.q_seqinfo.seqstart_py[-1], (
-            shape[-2],
-            self.q_seqinfo.seqstart_py[-1],
-        )
-        mask = torch.empty(shape[-2:], dtype=dtype, device=device)
-        mask.fill_(-math.inf)
-        for i, ((q_start, q_end), (k_start, k_end)) in enumerate(
-            zip(
-                self.q_seqinfo.intervals(),
-                self.k_seqinfo.intervals(),
-            )
-        ):
-            mask[q_start:q_end, k_start:k_end] = self._create_block_mask(
-                (q_end - q_start, k_end - k_start),
-                dtype=dtype,
-                device=device,
-            )
-        for _ in range(len(shape) - 2):
-            mask = mask.unsqueeze(0)
-        return mask.expand(shape)
+        """Materialize the attention bias - for debugging & testing
+
+        Use ``dtype=torch.bool`` to get a mask which is ``True`` where
+        queries can attend to keys, and ``q_range=(start, end)`` to only
+        materialize the rows of the queries in ``[start, end)``.
+        """
+        if shape[-1] != self.k_seqinfo.seqstart_py[-1]:
+            raise ValueError("k shapes wrong", (shape, self.k_seqinfo))
+        if shape[-2] != self.q_seqinfo.seqstart_py[-1]:
+            raise ValueError("q shapes wrong", (shape, self.q_seqinfo))
+        return _materialize_varlen_bias(self, shape, dtype, device, q_range)
 
     @classmethod
     def from_seqlens(
         cls,
-        q_seqlen: Sequence[int],
-        kv_seqlen: Optional[Sequence[int]] = None,
+        q_seqlen: Union[Sequence[int], torch.Tensor],
+        kv_seqlen: Optional[Union[Sequence[int], torch.Tensor]] = None,
         *,
         device: Optional[torch.device] = None,
     ) -> "BlockDiagonalMask":
@@ -724,7 +958,9 @@ class BlockDiagonalMask(AttentionBias):
         device = _get_default_bias_device(device)
         assert kv_seqlen is None or len(q_seqlen) == len(kv_seqlen)
         q_seqinfo = _SeqLenInfo.from_seqlens(q_seqlen, device=device)
-        if kv_seqlen is None or q_seqlen == kv_seqlen:
+        if kv_seqlen is None or (
+            not isinstance(q_seqlen, torch.Tensor) and q_seqlen == kv_seqlen
+        ):
             k_seqinfo = q_seqinfo
         else:
             k_seqinfo = _SeqLenInfo.from_seqlens(kv_seqlen, device=device)
@@ -858,18 +1094,6 @@ class BlockDiagonalCausalMask(BlockDiagonalMask):
     is from the initial query in block i.
     """
 
-    def _create_block_mask(
-        self,
-        shape: Tuple[int, ...],
-        dtype: torch.dtype = torch.float32,
-        device: Union[str, torch.device] = "cpu",
-    ) -> torch.Tensor:
-        return LowerTriangularMask().materialize(
-            shape,
-            dtype=dtype,
-            device=device,
-        )
-
 
 @dataclass
 class BlockDiagonalCausalFromBottomRightMask(BlockDiagonalMask):
@@ -900,16 +1124,6 @@ class BlockDiagonalCausalFromBottomRightMask(BlockDiagonalMask):
                     " Expected `num_keys >= num_queries`"
                 )
 
-    def _create_block_mask(
-        self,
-        shape: Tuple[int, ...],
-        dtype: torch.dtype = torch.float32,
-        device: Union[str, torch.device] = "cpu",
-    ) -> torch.Tensor:
-        return LowerTriangularFromBottomRightMask().materialize(
-            shape=shape, dtype=dtype, device=device
-        )
-
 
 @dataclass
 class BlockDiagonalPaddedKeysMask(AttentionBias):
@@ -938,48 +1152,32 @@ class BlockDiagonalPaddedKeysMask(AttentionBias):
             k_seqinfo=self.k_seqinfo.to(device),
         )
 
-    def _create_block_mask(
-        self,
-        shape: Tuple[int, ...],
-        dtype: torch.dtype = torch.float32,
-        device: Union[str, torch.device] = "cpu",
-    ) -> torch.Tensor:
-        return torch.tensor(0.0, device=device, dtype=dtype)
-
     def materialize(
         self,
         shape: Tuple[int, ...],
         dtype: torch.dtype = torch.float32,
         device: Union[str, torch.device] = "cpu",
+        *,
+        q_range: Optional[Tuple[int, int]] = None,
     ) -> torch.Tensor:
-        """Materialize the attention bias - for debugging & testing"""
+        """Materialize the attention bias - for debugging & testing
+
+        Use ``dtype=torch.bool`` to get a mask which is ``True`` where
+        queries can attend to keys, and ``q_range=(start, end)`` to only
+        materialize the rows of the queries in ``[start, end)``.
+        """
         if shape[-1] != self.k_seqinfo.seqstart_py[-1]:
-            raise ValueError("k shapes wrong")
+            raise ValueError("k shapes wrong", (shape, self.k_seqinfo))
         if shape[-2] != self.q_seqinfo.seqstart_py[-1]:
-            raise ValueError("q shapes wrong")
-        mask = torch.empty(shape[-2:], dtype=dtype, device=device)
-        mask.fill_(-math.inf)
-        for i, ((q_start, q_end), (k_start, k_end)) in enumerate(
-            zip(
-                self.q_seqinfo.intervals(),
-                self.k_seqinfo.intervals(),
-            )
-        ):
-            mask[q_start:q_end, k_start:k_end] = self._create_block_mask(
-                (q_end - q_start, k_end - k_start),
-                dtype=dtype,
-                device=device,
-            )
-        for _ in range(len(shape) - 2):
-            mask = mask.unsqueeze(0)
-        return mask.expand(shape)
+            raise ValueError("q shapes wrong", (shape, self.q_seqinfo))
+        return _materialize_varlen_bias(self, shape, dtype, device, q_range)
 
     @classmethod
     def from_seqlens(
         cls,
-        q_seqlen: Sequence[int],
+        q_seqlen: Union[Sequence[int], torch.Tensor],
         kv_padding: int,
-        kv_seqlen: Sequence[int],
+        kv_seqlen: Union[Sequence[int], torch.Tensor],
         causal_diagonal: Any = None,
         *,
         device: Optional[torch.device] = None,
@@ -988,9 +1186,9 @@ class BlockDiagonalPaddedKeysMask(AttentionBias):
         lengths for query and key/value.
 
         Args:
-            q_seqlen (Sequence[int]): List or tensor of sequence lengths for query tensors
+            q_seqlen (Union[Sequence[int], torch.Tensor]): List or tensor of sequence lengths for query tensors
             kv_padding (int): Padding for k/v - also an upperbound on each individual key length
-            kv_seqlen (Sequence[int]): List or tensor of sequence lengths for key/value.
+            kv_seqlen (Union[Sequence[int], torch.Tensor]): List or tensor of sequence lengths for key/value.
             causal_diagonal: unused, for BC only
         Returns:
             BlockDiagonalPaddedKeysMask
@@ -1006,6 +1204,46 @@ class BlockDiagonalPaddedKeysMask(AttentionBias):
         )
         return cls(q_seqinfo=q_seqinfo, k_seqinfo=k_seqinfo)
 
+    def advance(self, n_new_tokens: Union[int, torch.Tensor] = 1) -> None:
+        """
+        Updates the bias in-place for the next decoding step: every sequence
+        now has `n_new_tokens` queries (an int, or a tensor with one value
+        per sequence), whose keys/values were added at the end of the
+        sequence.
+
+        Sequences without keys (see :attr:`retire_sequences`) are not
+        advanced. The keys must fit in the padding: this raises a
+        `ValueError` only when the key lengths are known on the host.
+        The bias tensors are updated in-place and no data is moved between
+        the host and the device, so this can be used with CUDA graphs.
+        With an int, the queries' `min_seqlen` and `max_seqlen` are set too,
+        so that choosing the operator does not synchronize either. With a
+        tensor, assign both of `q_seqinfo.min_seqlen` and `q_seqinfo.max_seqlen`
+        after this call for the same effect.
+        """
+        self.k_seqinfo._advance_(n_new_tokens)
+        self.q_seqinfo._set_seqlens_(n_new_tokens)
+
+    def append_sequences(
+        self,
+        indices: Union[Sequence[int], torch.Tensor],
+        kv_seqlen: Union[Sequence[int], torch.Tensor],
+    ) -> None:
+        """
+        Starts new sequences in the slots `indices` of the batch,
+        whose first `kv_seqlen` keys/values are already in the cache.
+        The bias tensors are updated in-place.
+        """
+        self.k_seqinfo._set_block_seqlens_(indices, kv_seqlen, active=True)
+
+    def retire_sequences(self, indices: Union[Sequence[int], torch.Tensor]) -> None:
+        """
+        Frees the slots `indices` of the batch: the queries of these sequences
+        no longer attend to any key, until :attr:`append_sequences` is
+        called for the slot. The bias tensors are updated in-place.
+        """
+        self.k_seqinfo._set_block_seqlens_(indices, 0, active=False)
+
     def make_paged(
         self,
         block_tables: torch.Tensor,
@@ -1044,22 +1282,12 @@ class BlockDiagonalCausalWithOffsetPaddedKeysMask(BlockDiagonalPaddedKeysMask):
 
     causal_diagonal: Any = None  # unused. Exists for BC only.
 
-    def _create_block_mask(
-        self,
-        shape: Tuple[int, ...],
-        dtype: torch.dtype = torch.float32,
-        device: Union[str, torch.device] = "cpu",
-    ) -> torch.Tensor:
-        return LowerTriangularFromBottomRightMask().materialize(
-            shape=shape, dtype=dtype, device=device
-        )
-
     @classmethod
     def from_seqlens(
         cls,
-        q_seqlen: Sequence[int],
+        q_seqlen: Union[Sequence[int], torch.Tensor],
         kv_padding: int,
-        kv_seqlen: Sequence[int],
+        kv_seqlen: Union[Sequence[int], torch.Tensor],
         causal_diagonal: Any = None,
         *,
         device: Optional[torch.device] = None,
@@ -1068,9 +1296,9 @@ class BlockDiagonalCausalWithOffsetPaddedKeysMask(BlockDiagonalPaddedKeysMask):
         lengths for query and key/value.
 
         Args:
-            q_seqlen (Sequence[int]): List or tensor of sequence lengths for query tensors
+            q_seqlen (Union[Sequence[int], torch.Tensor]): List or tensor of sequence lengths for query tensors
             kv_padding (int): Padding for k/v - also an upperbound on each individual key length
-            kv_seqlen (Sequence[int]): List or tensor of sequence lengths for key/value.
+            kv_seqlen (Union[Sequence[int], torch.Tensor]): List or tensor of sequence lengths for key/value.
             causal_diagonal: unused, for BC only
         Returns:
             BlockDiagonalCausalWithOffsetPaddedKeysMask
@@ -1103,20 +1331,6 @@ class BlockDiagonalCausalLocalAttentionPaddedKeysMask(BlockDiagonalPaddedKeysMas
 
     _window_size: int
 
-    def _create_block_mask(
-        self,
-        shape: Tuple[int, ...],
-        dtype: torch.dtype = torch.float32,
-        device: Union[str, torch.device] = "cpu",
-    ) -> torch.Tensor:
-        return _materialize_causal_mask(
-            shape=shape,
-            dtype=dtype,
-            device=device,
-            window_size=self._window_size,
-            from_bottomright=True,
-        )
-
     @classmethod
     def from_seqlens_local(
         cls,
@@ -1165,45 +1379,26 @@ class PagedBlockDiagonalPaddedKeysMask(AttentionBias):
         shape: Tuple[int, ...],
         dtype: torch.dtype = torch.float32,
         device: Union[str, torch.device] = "cpu",
+        *,
+        q_range: Optional[Tuple[int, int]] = None,
     ) -> torch.Tensor:
-        """Materialize the attention bias - for debugging & testing"""
-        # First create a non-paged mask, then cut individual pages and
-        # copy them to their places in the physical mask, using block tables
-
-        max_row_len = self.block_tables.shape[1] * self.page_size
-        bias_nonpaged = self._UNPAGED_TYPE(
-            q_seqinfo=self.q_seqinfo,
-            k_seqinfo=_PaddedSeqLenInfo.from_seqlens_padded(
-                self.k_seqinfo.seqlen_py, max_row_len
-            ),
-        )
-        mask_nonpaged = bias_nonpaged.materialize(shape, dtype, device)
+        """Materialize the attention bias - for debugging & testing
 
-        n_used_blocks = cast(int, self.block_tables.max().item() + 1)
-        max_physical_len = n_used_blocks * self.page_size
-        mask_paged = torch.empty(
-            mask_nonpaged.shape[:-1] + (max_physical_len,), dtype=dtype, device=device
-        )
-        mask_paged.fill_(-math.inf)
-        for b, (q_start, q_end) in enumerate(self.q_seqinfo.intervals()):
-            for logical_page_idx in range(self.block_tables.shape[1]):
-                physical_page_idx = cast(
-                    int, self.block_tables[b][logical_page_idx].item()
-                )
-                k_logical_start = b * max_row_len + logical_page_idx * self.page_size
-                k_logical_end = k_logical_start + self.page_size
-                k_physical_start = physical_page_idx * self.page_size
-                k_physical_end = k_physical_start + self.page_size
-                mask_paged[
-                    ..., q_start:q_end, k_physical_start:k_physical_end
-                ] = mask_nonpaged[..., q_start:q_end, k_logical_start:k_logical_end]
-        return mask_paged
+        Use ``dtype=torch.bool`` to get a mask which is ``True`` where
+        queries can attend to keys, and ``q_range=(start, end)`` to only
+        materialize the rows of the queries in ``[start, end)``.
+        The last dimension of the output indexes the physical keys
+        (up to the last page used in ``block_tables``)
+        """
+        if shape[-2] != self.q_seqinfo.seqstart_py[-1]:
+            raise ValueError("q shapes wrong", (shape, self.q_seqinfo))
+        return _materialize_varlen_bias(self, shape, dtype, device, q_range)
 
     @classmethod
     def from_seqlens(
         cls,
-        q_seqlen: Sequence[int],
-        kv_seqlen: Sequence[int],
+        q_seqlen: Union[Sequence[int], torch.Tensor],
+        kv_seqlen: Union[Sequence[int], torch.Tensor],
         block_tables: torch.Tensor,
         page_size: int,
         *,
@@ -1213,9 +1408,9 @@ class PagedBlockDiagonalPaddedKeysMask(AttentionBias):
         lengths for query and key/value.
 
         Args:
-            q_seqlen (Sequence[int]): List or tensor of sequence lengths for query tensors
+            q_seqlen (Union[Sequence[int], torch.Tensor]): List or tensor of sequence lengths for query tensors
             kv_padding (int): Padding for k/v - also an upperbound on each individual key length
-            kv_seqlen (Sequence[int]): List or tensor of sequence lengths for key/value.
+            kv_seqlen (Union[Sequence[int], torch.Tensor]): List or tensor of sequence lengths for key/value.
             causal_diagonal: unused, for BC only
         Returns:
             PagedBlockDiagonalPaddedKeysMask
@@ -1236,6 +1431,26 @@ class PagedBlockDiagonalPaddedKeysMask(AttentionBias):
             page_size=page_size,
         )
 
+    def advance(self, n_new_tokens: Union[int, torch.Tensor] = 1) -> None:
+        """
+        Same as :attr:`BlockDiagonalPaddedKeysMask.advance`.
+        The block tables must already contain the pages for the new keys.
+        """
+        self.k_seqinfo._advance_(n_new_tokens)
+        self.q_seqinfo._set_seqlens_(n_new_tokens)
+
+    def append_sequences(
+        self,
+        indices: Union[Sequence[int], torch.Tensor],
+        kv_seqlen: Union[Sequence[int], torch.Tensor],
+    ) -> None:
+        """Same as :attr:`BlockDiagonalPaddedKeysMask.append_sequences`"""
+        self.k_seqinfo._set_block_seqlens_(indices, kv_seqlen, active=True)
+
+    def retire_sequences(self, indices: Union[Sequence[int], torch.Tensor]) -> None:
+        """Same as :attr:`BlockDiagonalPaddedKeysMask.retire_sequences`"""
+        self.k_seqinfo._set_block_seqlens_(indices, 0, active=False)
+
 
 @dataclass
 class PagedBlockDiagonalCausalWithOffsetPaddedKeysMask(
@@ -1274,31 +1489,27 @@ class BlockDiagonalGappyKeysMask(AttentionBias):
         shape: Tuple[int, ...],
         dtype: torch.dtype = torch.float32,
         device: Union[str, torch.device] = "cpu",
+        *,
+        q_range: Optional[Tuple[int, int]] = None,
     ) -> torch.Tensor:
-        """Materialize the attention bias - for debugging & testing"""
+        """Materialize the attention bias - for debugging & testing
+
+        Use ``dtype=torch.bool`` to get a mask which is ``True`` where
+        queries can attend to keys, and ``q_range=(start, end)`` to only
+        materialize the rows of the queries in ``[start, end)``.
+        """
         if shape[-1] != self.k_seqinfo.seqstart_py[-1]:
             raise ValueError("k shapes wrong", (shape, self.k_seqinfo))
         if shape[-2] != self.q_seqinfo.seqstart_py[-1]:
             raise ValueError("q shapes wrong", (shape, self.q_seqinfo))
-        mask = torch.empty(shape[-2:], dtype=dtype, device=device)
-        mask.fill_(-math.inf)
-        for i, ((q_start, q_end), (k_start, k_end)) in enumerate(
-            zip(
-                self.q_seqinfo.intervals(),
-                self.k_seqinfo.intervals(),
-            )
-        ):
-            mask[q_start:q_end, k_start:k_end] = 0
-        for _ in range(len(shape) - 2):
-            mask = mask.unsqueeze(0)
-        return mask.expand(shape)
+        return _materialize_varlen_bias(self, shape, dtype, device, q_range)
 
     @classmethod
     def from_seqlens(
         cls,
-        q_seqlen: Sequence[int],
-        kv_seqstarts: Sequence[int],
-        kv_seqlen: Sequence[int],
+        q_seqlen: Union[Sequence[int], torch.Tensor],
+        kv_seqstarts: Union[Sequence[int], torch.Tensor],
+        kv_seqlen: Union[Sequence[int], torch.Tensor],
         *,
         device: Optional[torch.device] = None,
     ) -> "BlockDiagonalGappyKeysMask":
@@ -1359,35 +1570,6 @@ class BlockDiagonalCausalWithOffsetGappyKeysMask(BlockDiagonalGappyKeysMask):
     than Q is to the final query in block i.
     """
 
-    def materialize(
-        self,
-        shape: Tuple[int, ...],
-        dtype: torch.dtype = torch.float32,
-        device: Union[str, torch.device] = "cpu",
-    ) -> torch.Tensor:
-        """Materialize the attention bias - for debugging & testing"""
-        if shape[-1] != self.k_seqinfo.seqstart_py[-1]:
-            raise ValueError("k shapes wrong")
-        if shape[-2] != self.q_seqinfo.seqstart_py[-1]:
-            raise ValueError("q shapes wrong")
-        mask = torch.empty(shape[-2:], dtype=dtype, device=device)
-        mask.fill_(-math.inf)
-        for i, ((q_start, q_end), (k_start, k_end)) in enumerate(
-            zip(
-                self.q_seqinfo.intervals(),
-                self.k_seqinfo.intervals(),
-            )
-        ):
-            mask[
-                q_start:q_end, k_start:k_end
-            ] = LowerTriangularFromBottomRightMask().materialize(
-                shape=(q_end - q_start, k_end - k_start), dtype=dtype, device=device
-            )
-
-        for _ in range(len(shape) - 2):
-            mask = mask.unsqueeze(0)
-        return mask.expand(shape)
-
 
 @dataclass
 class PagedBlockDiagonalGappyKeysMask(AttentionBias):
@@ -1412,53 +1594,27 @@ class PagedBlockDiagonalGappyKeysMask(AttentionBias):
         shape: Tuple[int, ...],
         dtype: torch.dtype = torch.float32,
         device: Union[str, torch.device] = "cpu",
+        *,
+        q_range: Optional[Tuple[int, int]] = None,
     ) -> torch.Tensor:
-        """Materialize the attention bias - for debugging & testing"""
-        # First create a non-paged mask, then cut individual pages and
-        # copy them to their places in the physical mask, using block tables
+        """Materialize the attention bias - for debugging & testing
 
-        max_row_len = self.block_tables.shape[1] * self.page_size
-        new_seqstarts = [
-            start + i * max_row_len
-            for i, start in enumerate(self.k_seqinfo.seqstart_py)
-        ] + [shape[-1]]
-        bias_nonpaged = self._UNPAGED_TYPE(
-            q_seqinfo=self.q_seqinfo,
-            k_seqinfo=_GappySeqInfo.from_seqlens_gappy(
-                new_seqstarts,
-                self.k_seqinfo.seqlen_py,
-                False,
-                device=torch.device(device),
-            ),
-        )
-        mask_nonpaged = bias_nonpaged.materialize(shape, dtype, device)
-
-        n_used_blocks = cast(int, self.block_tables.max().item() + 1)
-        max_physical_len = n_used_blocks * self.page_size
-        mask_paged = torch.empty(
-            mask_nonpaged.shape[:-1] + (max_physical_len,), dtype=dtype, device=device
-        )
-        mask_paged.fill_(-math.inf)
-        for b, (q_start, q_end) in enumerate(self.q_seqinfo.intervals()):
-            for logical_page_idx in range(self.block_tables.shape[1]):
-                physical_page_idx = cast(
-                    int, self.block_tables[b][logical_page_idx].item()
-                )
-                k_logical_start = b * max_row_len + logical_page_idx * self.page_size
-                k_logical_end = k_logical_start + self.page_size
-                k_physical_start = physical_page_idx * self.page_size
-                k_physical_end = k_physical_start + self.page_size
-                mask_paged[
-                    ..., q_start:q_end, k_physical_start:k_physical_end
-                ] = mask_nonpaged[..., q_start:q_end, k_logical_start:k_logical_end]
-        return mask_paged
+        Use ``dtype=torch.bool`` to get a mask which is ``True`` where
+        queries can attend to keys, and ``q_range=(start, end)`` to only
+        materialize the rows of the queries in ``[start, end)``.
+        The last dimension of the output indexes the physical keys
+        (up to the last page used in ``block_tables``)
+        """
+        if shape[-2] != self.q_seqinfo.seqstart_py[-1]:
+            raise ValueError("q shapes wrong", (shape, self.q_seqinfo))
+        return _materialize_varlen_bias(self, shape, dtype, device, q_range)
 
     @classmethod
     def from_seqlens(
         cls,
-        q_seqlen: Sequence[int],
-        kv_seqstarts: Sequence[int],
-        kv_seqlen: Sequence[int],
+        q_seqlen: Union[Sequence[int], torch.Tensor],
+        kv_seqstarts: Union[Sequence[int], torch.Tensor],
+        kv_seqlen: Union[Sequence[int], torch.Tensor],
         block_tables: torch.Tensor,
         page_size: int,
         *,
@@ -1532,19 +1688,6 @@ class BlockDiagonalCausalLocalAttentionMask(BlockDiagonalCausalMask):
                     f"No keys are attended in q_seqlen {q} k_seqlen {k} with sliding window {self._window_size}"
                 )
 
-    def _create_block_mask(
-        self,
-        shape: Tuple[int, ...],
-        dtype: torch.dtype = torch.float32,
-        device: Union[str, torch.device] = "cpu",
-    ) -> torch.Tensor:
-        return _materialize_causal_mask(
-            shape,
-            dtype=dtype,
-            device=device,
-            window_size=self._window_size,
-        )
-
 
 @dataclass
 class BlockDiagonalCausalLocalAttentionFromBottomRightMask(
@@ -1568,20 +1711,6 @@ class BlockDiagonalCausalLocalAttentionFromBottomRightMask(
                 f"Expected `window_size > 0`, but window_size={self._window_size}"
             )
 
-    def _create_block_mask(
-        self,
-        shape: Tuple[int, ...],
-        dtype: torch.dtype = torch.float32,
-        device: Union[str, torch.device] = "cpu",
-    ) -> torch.Tensor:
-        return _materialize_causal_mask(
-            shape,
-            dtype=dtype,
-            device=device,
-            window_size=self._window_size,
-            from_bottomright=True,
-        )
-
 
 class AttentionBiasSubTensor(torch.Tensor, AttentionBias):
     HOLDS_DENSE_TENSOR = False
@@ -1737,3 +1866,253 @@ VARLEN_BIASES = (
     PagedBlockDiagonalPaddedKeysMask,
     PagedBlockDiagonalGappyKeysMask,
 )
+
+
+def _diagonal_bounds(
+    attn_bias: Any, q_len: torch.Tensor, k_len: torch.Tensor
+) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor]]:
+    """
+    A query at position `i` of its block can attend to the keys at positions
+    `j` of the same block such that `lo <= j - i <= hi`.
+    Returns `(lo, hi)` for each block, or `None` when unbounded.
+    """
+    bottom_right = k_len - q_len
+    top_left = torch.zeros_like(q_len)
+    if isinstance(attn_bias, LocalAttentionFromBottomRightMask):
+        return (
+            bottom_right - attn_bias.window_left,
+            bottom_right + attn_bias.window_right,
+        )
+    if isinstance(attn_bias, LowerTriangularFromBottomRightLocalAttentionMask):
+        return bottom_right - attn_bias._window_size + 1, bottom_right
+    if isinstance(attn_bias, LowerTriangularFromBottomRightMask):
+        return None, bottom_right
+    if isinstance(attn_bias, LowerTriangularMask):
+        return None, top_left
+    if isinstance(attn_bias, BlockDiagonalCausalLocalAttentionFromBottomRightMask):
+        return bottom_right - attn_bias._window_size + 1, bottom_right
+    if isinstance(attn_bias, BlockDiagonalCausalLocalAttentionMask):
+        return top_left - attn_bias._window_size + 1, top_left
+    if isinstance(attn_bias, BlockDiagonalCausalLocalAttentionPaddedKeysMask):
+        return bottom_right - attn_bias._window_size + 1, bottom_right
+    if isinstance(
+        attn_bias,
+        (
+            BlockDiagonalCausalFromBottomRightMask,
+            BlockDiagonalCausalWithOffsetPaddedKeysMask,
+            BlockDiagonalCausalWithOffsetGappyKeysMask,
+            PagedBlockDiagonalCausalWithOffsetPaddedKeysMask,
+        ),
+    ):
+        return None, bottom_right
+    if isinstance(attn_bias, BlockDiagonalCausalMask):
+        return None, top_left
+    return None, None
+
+
+def _get_key_ranges(
+    attn_bias: Any, num_queries: int, num_keys: int, device: torch.device
+) -> Optional[Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]]:
+    """
+    For the causal, local and block-diagonal biases (including the padded,
+    gappy and paged ones), the keys a query can attend to form a contiguous
+    range in a "logical" key space.
+    Returns `(k_start, k_end, key_index)` where query `i` attends to the
+    logical keys in `[k_start[i], k_end[i])`, and `key_index` maps logical keys
+    to physical positions along the keys dimension (only for paged biases).
+    Returns `None` for the other biases, whose masking can't be described
+    by such ranges.
+    """
+    key_index: Optional[torch.Tensor] = None
+    if isinstance(attn_bias, (BlockDiagonalMask, BlockDiagonalPaddedKeysMask)):
+        q_seqstart = attn_bias.q_seqinfo.seqstart.to(device=device, dtype=torch.long)
+        k_seqinfo = attn_bias.k_seqinfo
+        k_seqstart = k_seqinfo.seqstart.to(device=device, dtype=torch.long)
+        k_block_start = k_seqstart[:-1]
+        if isinstance(attn_bias, BlockDiagonalPaddedKeysMask):
+            k_block_len = attn_bias.k_seqinfo.seqlen.to(device=device, dtype=torch.long)
+        else:
+            k_block_len = k_seqstart[1:] - k_seqstart[:-1]
+    elif isinstance(attn_bias, BlockDiagonalGappyKeysMask):
+        q_seqstart = attn_bias.q_seqinfo.seqstart.to(device=device, dtype=torch.long)
+        k_block_start = attn_bias.k_seqinfo.seqstart[:-1].to(
+            device=device, dtype=torch.long
+        )
+        k_block_len = attn_bias.k_seqinfo.seqlen.to(device=device, dtype=torch.long)
+    elif isinstance(
+        attn_bias, (PagedBlockDiagonalPaddedKeysMask, PagedBlockDiagonalGappyKeysMask)
+    ):
+        q_seqstart = attn_bias.q_seqinfo.seqstart.to(device=device, dtype=torch.long)
+        block_tables = attn_bias.block_tables.to(device=device, dtype=torch.long)
+        page_size = attn_bias.page_size
+        num_blocks = block_tables.shape[0]
+        row_len = block_tables.shape[1] * page_size
+        k_block_start = torch.arange(num_blocks, device=device) * row_len
+        if isinstance(attn_bias, PagedBlockDiagonalGappyKeysMask):
+            k_block_start += attn_bias.k_seqinfo.seqstart.to(
+                device=device, dtype=torch.long
+            )
+        k_block_len = attn_bias.k_seqinfo.seqlen.to(device=device, dtype=torch.long)
+        key_index = (
+            block_tables[:, :, None] * page_size
+            + torch.arange(page_size, device=device)
+        ).flatten()
+    elif isinstance(
+        attn_bias, (LowerTriangularMask, LowerTriangularFromBottomRightMask)
+    ) or isinstance(attn_bias, LocalAttentionFromBottomRightMask):
+        q_seqstart = torch.tensor([0, num_queries], device=device)
+        k_block_start = torch.zeros([1], dtype=torch.long, device=device)
+        k_block_len = torch.full([1], num_keys, dtype=torch.long, device=device)
+    else:
+        return None
+
+    q_block_len = q_seqstart[1:] - q_seqstart[:-1]
+    q_block = torch.repeat_interleave(
+        torch.arange(q_block_len.shape[0], device=device),
+        q_block_len,
+        output_size=num_queries,
+    )
+    q_pos = torch.arange(num_queries, device=device) - q_seqstart[q_block]
+    k_len = k_block_len[q_block]
+    diag_lo, diag_hi = _diagonal_bounds(attn_bias, q_block_len, k_block_len)
+    k_start = torch.zeros_like(q_pos)
+    if diag_lo is not None:
+        k_start = (q_pos + diag_lo[q_block]).clamp(min=0)
+    k_end = k_len
+    if diag_hi is not None:
+        k_end = torch.minimum(k_end, q_pos + diag_hi[q_block] + 1)
+    k_start = torch.minimum(k_start, k_len)
+    k_end = torch.maximum(k_end, k_start)
+    offset = k_block_start[q_block]
+    return k_start + offset, k_end + offset, key_index
+
+
+def _get_block_lens(
+    attn_bias: Any, num_queries: int, num_keys: int
+) -> Optional[Tuple[List[int], List[int]]]:
+    """
+    Returns the number of queries and keys of every block, for the biases
+    whose blocks do not share any key. This only reads the python-side
+    members of the bias, so no range is built on the host.
+    """
+    if isinstance(attn_bias, (BlockDiagonalMask, BlockDiagonalPaddedKeysMask)):
+        q_seqstart = attn_bias.q_seqinfo.seqstart_py
+        q_lens = [end - start for start, end in zip(q_seqstart, q_seqstart[1:])]
+        if isinstance(attn_bias, BlockDiagonalPaddedKeysMask):
+            return q_lens, list(attn_bias.k_seqinfo.seqlen_py)
+        k_seqstart = attn_bias.k_seqinfo.seqstart_py
+        return q_lens, [end - start for start, end in zip(k_seqstart, k_seqstart[1:])]
+    if isinstance(
+        attn_bias, (LowerTriangularMask, LowerTriangularFromBottomRightMask)
+    ) or isinstance(attn_bias, LocalAttentionFromBottomRightMask):
+        return [num_queries], [num_keys]
+    return None
+
+
+def _count_pairs_below_diagonal(
+    q_len: torch.Tensor, k_len: torch.Tensor, diagonal: torch.Tensor
+) -> torch.Tensor:
+    """
+    Number of positions `(i, j)` of each block with `j - i <= diagonal`
+    """
+
+    def clamped_sum(n: torch.Tensor) -> torch.Tensor:
+        # sum(min(t, k_len) for t in range(1, n + 1))
+        n = n.clamp(min=0)
+        m = torch.minimum(n, k_len)
+        return m * (m + 1) // 2 + (n - m) * k_len
+
+    return clamped_sum(diagonal + q_len) - clamped_sum(diagonal)
+
+
+def _count_attended_keys(
+    attn_bias: Any, num_queries: int, num_keys: int
+) -> Tuple[int, int]:
+    """
+    Returns the number of (query, key) pairs which are not masked, and the
+    number of distinct keys attended to by at least one query, for a single
+    batch element
+    """
+    block_lens = _get_block_lens(attn_bias, num_queries, num_keys)
+    if block_lens is not None:
+        # Closed forms over the diagonal band of each block
+        q_len = torch.tensor(block_lens[0], dtype=torch.long)
+        k_len = torch.tensor(block_lens[1], dtype=torch.long)
+        diag_lo, diag_hi = _diagonal_bounds(attn_bias, q_len, k_len)
+        block_pairs = q_len * k_len
+        block_start = torch.zeros_like(k_len)
+        block_end = k_len
+        if diag_hi is not None:
+            block_pairs = _count_pairs_below_diagonal(q_len, k_len, diag_hi)
+            block_end = torch.minimum(k_len, q_len + diag_hi)
+        if diag_lo is not None:
+            block_pairs = block_pairs - _count_pairs_below_diagonal(
+                q_len, k_len, diag_lo - 1
+            )
+            block_start = diag_lo.clamp(min=0)
+        # Consecutive queries attend to overlapping ranges of keys
+        block_keys = (block_end - block_start).clamp(min=0) * (q_len > 0)
+        return int(block_pairs.sum()), int(block_keys.sum())
+
+    # Paged and gappy keys can be shared between blocks
+    device = torch.device("cpu")
+    key_ranges = _get_key_ranges(attn_bias, num_queries, num_keys, device)
+    if key_ranges is None:
+        return num_queries * num_keys, num_keys if num_queries else 0
+    k_start, k_end, key_index = key_ranges
+    num_pairs = int((k_end - k_start).sum())
+    # Union of the key ranges, as a difference array over the logical keys
+    num_logical_keys = int(k_end.max()) if num_queries else 0
+    coverage = torch.zeros([num_logical_keys + 1], dtype=torch.long, device=device)
+    coverage.index_add_(0, k_start, torch.ones_like(k_start))
+    coverage.index_add_(0, k_end, -torch.ones_like(k_end))
+    attended = coverage.cumsum(0)[:-1] > 0
+    if key_index is None:
+        return num_pairs, int(attended.sum())
+    return num_pairs, int(key_index[: attended.shape[0]][attended].unique().numel())
+
+
+def _materialize_varlen_bias(
+    attn_bias: Any,
+    shape: Tuple[int, ...],
+    dtype: torch.dtype,
+    device: Union[str, torch.device],
+    q_range: Optional[Tuple[int, int]],
+) -> torch.Tensor:
+    """
+    Builds the mask of a block-diagonal (or paged) bias from the ranges
+    of keys each query attends to, without looping over the sequences
+    """
+    device = torch.device(device)
+    num_queries = shape[-2]
+    q_start, q_end = (0, num_queries) if q_range is None else q_range
+    if not 0 <= q_start <= q_end <= num_queries:
+        raise ValueError(f"Invalid q_range={q_range} for {num_queries} queries")
+    key_ranges = _get_key_ranges(attn_bias, num_queries, shape[-1], device)
+    assert key_ranges is not None
+    k_start, k_end, key_index = key_ranges
+    k_start = k_start[q_start:q_end, None]
+    k_end = k_end[q_start:q_end, None]
+    if key_index is None:
+        keys = torch.arange(shape[-1], device=device)
+        mask = (keys >= k_start) & (keys < k_end)
+    else:
+        # Paged biases: compare positions in the logical row of
+        # each query, then scatter them to their physical pages
+        block_tables = attn_bias.block_tables
+        page_size = attn_bias.page_size
+        row_len = block_tables.shape[1] * page_size
+        row = ((k_end - 1).clamp(min=0) // row_len).clamp(max=block_tables.shape[0] - 1)
+        logical_keys = row * row_len + torch.arange(row_len, device=device)
+        attends = (logical_keys >= k_start) & (logical_keys < k_end)
+        num_physical_keys = (int(block_tables.max().item()) + 1) * page_size
+        mask = torch.zeros(
+            [q_end - q_start, num_physical_keys], dtype=torch.int32, device=device
+        )
+        mask.scatter_add_(1, key_index[logical_keys], attends.int())
+        mask = mask > 0
+    if dtype is not torch.bool:
+        mask = torch.zeros(mask.shape, dtype=dtype, device=device).masked_fill_(
+            ~mask, -math.inf
+        )
+    return mask.expand(*shape[:-2], *mask.shape)
@@ -3,12 +3,14 @@
 # This source code is licensed under the BSD license found in the
 # LICENSE file in the root directory of this source tree.
 
+import contextlib
 import math
 from dataclasses import dataclass
 from functools import partial
 from typing import (
     Any,
     Callable,
+    ContextManager,
     Iterable,
     List,
     Mapping,
@@ -254,6 +256,35 @@ class Inputs:
         )
 
 
+# Name of the profiler events recording the exact number of operations
+# of an attention call, see `xformers.profiler.profile_analyzer`
+ATTENTION_FLOPS_EVENT = "xformers::attention_flops"
+
+try:
+    # Set by all the profilers (`torch.profiler` and `torch.autograd.profiler`)
+    from torch.autograd import _profiler_enabled
+except ImportError:  # pragma: no cover
+
+    def _profiler_enabled() -> bool:
+        return True
+
+
+def _record_attention_flops(inp: Inputs, is_bwd: bool) -> ContextManager:
+    """
+    When the profiler is running, wraps the attention kernels in an event
+    holding the number of operations given by the bias, as profiler traces
+    only contain the shapes of the inputs
+    """
+    if not _profiler_enabled() or not isinstance(inp.attn_bias, AttentionBias):
+        return contextlib.nullcontext()
+    flops = inp.attn_bias.flops(inp.query.shape, inp.key.shape, inp.value.shape)
+    if is_bwd:
+        flops = flops * 5 // 2
+    return torch.profiler.record_function(
+        f"{ATTENTION_FLOPS_EVENT}({flops}, {inp.query.dtype})"
+    )
+
+
 @dataclass
 class Context:
     lse: torch.Tensor
@@ -0,0 +1,336 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+import math
+from typing import Any, Iterable, List, Optional, Set, Tuple, Union
+
+import torch
+
+from ..common import register_operator
+from .attn_bias import (
+    AttentionBias,
+    BlockDiagonalCausalFromBottomRightMask,
+    BlockDiagonalCausalLocalAttentionFromBottomRightMask,
+    BlockDiagonalCausalLocalAttentionMask,
+    BlockDiagonalCausalLocalAttentionPaddedKeysMask,
+    BlockDiagonalCausalMask,
+    BlockDiagonalCausalWithOffsetGappyKeysMask,
+    BlockDiagonalCausalWithOffsetPaddedKeysMask,
+    BlockDiagonalGappyKeysMask,
+    BlockDiagonalMask,
+    BlockDiagonalPaddedKeysMask,
+    LocalAttentionFromBottomRightMask,
+    LowerTriangularFromBottomRightLocalAttentionMask,
+    LowerTriangularFromBottomRightMask,
+    LowerTriangularMask,
+    LowerTriangularMaskWithTensorBias,
+    PagedBlockDiagonalCausalWithOffsetPaddedKeysMask,
+    PagedBlockDiagonalGappyKeysMask,
+    PagedBlockDiagonalPaddedKeysMask,
+    _get_key_ranges,
+)
+from .common import AttentionBwOpBase, AttentionFwOpBase, Context, Gradients, Inputs
+
+
+def _get_tensor_bias(
+    attn_bias: Optional[Union[torch.Tensor, AttentionBias]]
+) -> Optional[torch.Tensor]:
+    """
+    Returns the additive bias (if any) in shape [B, G, H, Mq, Mkv]
+    (possibly with broadcasted dimensions)
+    """
+    if isinstance(attn_bias, LowerTriangularMaskWithTensorBias):
+        bias = attn_bias._subtensor
+    elif isinstance(attn_bias, torch.Tensor) and not isinstance(
+        attn_bias, LowerTriangularMask
+    ):
+        bias = attn_bias
+    else:
+        return None
+    while bias.ndim < 4:
+        bias = bias.unsqueeze(0)
+    if bias.ndim == 4:
+        bias = bias.unsqueeze(1)
+    return bias
+
+
+class _TiledAttention:
+    """
+    Iterates over tiles of the attention matrix, and computes the
+    (masked and scaled) attention scores for each tile in float32.
+    Tiles where all keys are masked for all queries are skipped.
+    """
+
+    def __init__(self, inp: Inputs, block_m: int, block_n: int) -> None:
+        query, key, value = inp.get_qkv_in_bmghk()
+        self.num_queries = query.shape[1]
+        self.key_ranges = _get_key_ranges(
+            inp.attn_bias, self.num_queries, key.shape[1], query.device
+        )
+        self.num_keys = key.shape[1]
+        self.key_index: Optional[torch.Tensor] = None
+        if self.key_ranges is not None:
+            self.key_index = self.key_ranges[2]
+            if self.key_index is not None:
+                self.num_keys = self.key_index.shape[0]
+        self.tensor_bias = _get_tensor_bias(inp.attn_bias)
+        self.scale = inp.scale_float
+        self.block_m = block_m
+        self.block_n = block_n
+        # [B, G, H, M, K]
+        self.query = query.permute(0, 2, 3, 1, 4)
+        self.key = key.permute(0, 2, 3, 1, 4)
+        self.value = value.permute(0, 2, 3, 1, 4)
+
+    def query_tiles(self) -> Iterable[Tuple[int, int]]:
+        for q_start in range(0, self.num_queries, self.block_m):
+            yield q_start, min(q_start + self.block_m, self.num_queries)
+
+    def key_tiles(self, q_start: int, q_end: int) -> Iterable[Tuple[int, int]]:
+        k_min, k_max = 0, self.num_keys
+        if self.key_ranges is not None:
+            k_min = int(self.key_ranges[0][q_start:q_end].min())
+            k_max = int(self.key_ranges[1][q_start:q_end].max())
+        for k_start in range(k_min, k_max, self.block_n):
+            yield k_start, min(k_start + self.block_n, k_max)
+
+    def physical_keys(self, k_start: int, k_end: int) -> Union[slice, torch.Tensor]:
+        if self.key_index is None:
+            return slice(k_start, k_end)
+        return self.key_index[k_start:k_end]
+
+    def mask(
+        self, q_start: int, q_end: int, k_start: int, k_end: int
+    ) -> Optional[torch.Tensor]:
+        """Which keys of the tile are masked for each query, if any"""
+        if self.key_ranges is None:
+            return None
+        k_range_start, k_range_end, _ = self.key_ranges
+        keys = torch.arange(k_start, k_end, device=k_range_start.device)
+        return (keys < k_range_start[q_start:q_end, None]) | (
+            keys >= k_range_end[q_start:q_end, None]
+        )
+
+    def load(
+        self,
+        x: torch.Tensor,
+        k_start: int,
+        k_end: int,
+        masked: Optional[torch.Tensor],
+    ) -> torch.Tensor:
+        keys = self.physical_keys(k_start, k_end)
+        if isinstance(keys, slice):
+            x = x[:, :, :, keys].float()
+        else:
+            x = x.index_select(3, keys).float()
+        if masked is not None:
+            # Keys attended by no query of the tile (eg the padding) may hold
+            # garbage, which would leak through the products with a 0 probability
+            unused = masked.all(0)
+            if unused.any():
+                x = x.masked_fill(unused[:, None], 0.0)
+        return x
+
+    def scores(
+        self,
+        q: torch.Tensor,
+        k: torch.Tensor,
+        q_start: int,
+        k_start: int,
+        masked: Optional[torch.Tensor],
+    ) -> torch.Tensor:
+        q_end, k_end = q_start + q.shape[-2], k_start + k.shape[-2]
+        attn = (q @ k.transpose(-2, -1)).mul_(self.scale)
+        if self.tensor_bias is not None:
+            attn += self.tensor_bias[..., q_start:q_end, k_start:k_end].float()
+        if masked is not None:
+            attn.masked_fill_(masked, -math.inf)
+        return attn
+
+
+def _attention_forward(
+    inp: Inputs, block_m: int, block_n: int
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    tiles = _TiledAttention(inp, block_m, block_n)
+    B, G, H, Mq, _ = tiles.query.shape
+    Kv = tiles.value.shape[-1]
+    out = torch.empty(
+        [B, Mq, G, H, Kv], dtype=inp.get_output_dtype(), device=inp.query.device
+    )
+    lse = torch.empty([B, G, H, Mq], dtype=torch.float, device=inp.query.device)
+    for q_start, q_end in tiles.query_tiles():
+        q = tiles.query[:, :, :, q_start:q_end].float()
+        row_max = torch.full(q.shape[:-1], -math.inf, device=q.device)
+        row_sum = torch.zeros(q.shape[:-1], device=q.device)
+        acc = torch.zeros([*q.shape[:-1], Kv], device=q.device)
+        for k_start, k_end in tiles.key_tiles(q_start, q_end):
+            masked = tiles.mask(q_start, q_end, k_start, k_end)
+            k = tiles.load(tiles.key, k_start, k_end, masked)
+            v = tiles.load(tiles.value, k_start, k_end, masked)
+            attn = tiles.scores(q, k, q_start, k_start, masked)
+            new_max = torch.maximum(row_max, attn.amax(-1))
+            # Avoid `(-inf) - (-inf)` for rows where everything is masked so far
+            new_max_safe = new_max.masked_fill(new_max == -math.inf, 0.0)
+            attn = torch.exp(attn.sub_(new_max_safe[..., None]))
+            correction = torch.exp(row_max - new_max_safe)
+            row_sum = row_sum * correction + attn.sum(-1)
+            acc = acc * correction[..., None] + attn @ v
+            row_max = new_max
+        row_max = row_max.masked_fill(row_max == -math.inf, 0.0)
+        empty_rows = row_sum == 0
+        acc /= row_sum.masked_fill(empty_rows, 1.0)[..., None]
+        out[:, q_start:q_end] = acc.permute(0, 3, 1, 2, 4)
+        lse[..., q_start:q_end] = (row_max + row_sum.log()).masked_fill(
+            empty_rows, -math.inf
+        )
+    return out, lse
+
+
+def _attention_backward(
+    inp: Inputs,
+    out: torch.Tensor,
+    lse: torch.Tensor,
+    grad: torch.Tensor,
+    block_m: int,
+    block_n: int,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    tiles = _TiledAttention(inp, block_m, block_n)
+    B, G, H, Mq, _ = tiles.query.shape
+    # [B, M, G, H, K] -> [B, G, H, M, K]
+    grad = grad.permute(0, 2, 3, 1, 4)
+    out = out.permute(0, 2, 3, 1, 4)
+    lse = lse[..., :Mq].float()
+    lse = lse.masked_fill(lse == -math.inf, math.inf)
+
+    dq = torch.zeros(tiles.query.shape, device=grad.device)
+    dk = torch.zeros(tiles.key.shape, device=grad.device)
+    dv = torch.zeros(tiles.value.shape, device=grad.device)
+    for q_start, q_end in tiles.query_tiles():
+        q = tiles.query[:, :, :, q_start:q_end].float()
+        do = grad[:, :, :, q_start:q_end].float()
+        delta = (do * out[:, :, :, q_start:q_end].float()).sum(-1, keepdim=True)
+        tile_lse = lse[..., q_start:q_end, None]
+        for k_start, k_end in tiles.key_tiles(q_start, q_end):
+            masked = tiles.mask(q_start, q_end, k_start, k_end)
+            k = tiles.load(tiles.key, k_start, k_end, masked)
+            v = tiles.load(tiles.value, k_start, k_end, masked)
+            p = torch.exp(tiles.scores(q, k, q_start, k_start, masked).sub_(tile_lse))
+            dp = do @ v.transpose(-2, -1)
+            ds = p * (dp - delta) * tiles.scale
+            dq[:, :, :, q_start:q_end] += ds @ k
+            keys = tiles.physical_keys(k_start, k_end)
+            if isinstance(keys, slice):
+                dk[:, :, :, keys] += ds.transpose(-2, -1) @ q
+                dv[:, :, :, keys] += p.transpose(-2, -1) @ do
+            else:
+                dk.index_add_(3, keys, ds.transpose(-2, -1) @ q)
+                dv.index_add_(3, keys, p.transpose(-2, -1) @ do)
+    return tuple(  # type: ignore
+        x.permute(0, 3, 1, 2, 4).to(inp.query.dtype) for x in (dq, dk, dv)
+    )
+
+
+@register_operator
+class FwOp(AttentionFwOpBase):
+    """Pure PyTorch implementation for CPU tensors, in the style of Flash-Attention.
+
+    The attention matrix is computed tile-by-tile with an online softmax, so
+    the full ``[Mq, Mkv]`` attention matrix is never materialized.
+    Tiles which are fully masked by the bias are skipped.
+    """
+
+    OPERATOR = _attention_forward
+    SUPPORTED_DEVICES: Set[str] = {"cpu"}
+    SUPPORTED_DTYPES: Set[torch.dtype] = {torch.float, torch.half}
+    SUPPORTED_MAX_K = math.inf
+    SUPPORTED_ATTN_BIAS_TYPES: Iterable[Any] = (
+        type(None),
+        torch.Tensor,
+        LowerTriangularMask,
+        LowerTriangularMaskWithTensorBias,
+        LowerTriangularFromBottomRightMask,
+        LowerTriangularFromBottomRightLocalAttentionMask,
+        LocalAttentionFromBottomRightMask,
+        BlockDiagonalMask,
+        BlockDiagonalCausalMask,
+        BlockDiagonalCausalFromBottomRightMask,
+        BlockDiagonalCausalLocalAttentionMask,
+        BlockDiagonalCausalLocalAttentionFromBottomRightMask,
+        BlockDiagonalPaddedKeysMask,
+        BlockDiagonalCausalWithOffsetPaddedKeysMask,
+        BlockDiagonalCausalLocalAttentionPaddedKeysMask,
+        BlockDiagonalGappyKeysMask,
+        BlockDiagonalCausalWithOffsetGappyKeysMask,
+        PagedBlockDiagonalPaddedKeysMask,
+        PagedBlockDiagonalCausalWithOffsetPaddedKeysMask,
+        PagedBlockDiagonalGappyKeysMask,
+    )
+    SUPPORTS_DROPOUT = False
+    SUPPORTS_CUSTOM_SCALE = True
+    SUPPORTS_DIFFERENT_VALUE_EMBED = True
+    SUPPORTS_OUTPUT_DTYPE = True
+    SUPPORTS_PARTIAL = True
+    SUPPORTS_BMGHK = True
+    NAME = "cpuF"
+
+    # Tile sizes along the queries / keys dimensions
+    BLOCK_M = 128
+    BLOCK_N = 256
+
+    _TEST_BATCH_SIZES: List[int] = [1, 7]
+
+    @classmethod
+    def not_supported_reasons(cls, d: Inputs) -> List[str]:
+        reasons = super(FwOp, cls).not_supported_reasons(d)
+        if d.key.dtype != d.query.dtype or d.value.dtype != d.query.dtype:
+            reasons.append("query/key/value must have the same dtype")
+        return reasons
+
+    @classmethod
+    def apply(
+        cls, inp: Inputs, needs_gradient: bool
+    ) -> Tuple[torch.Tensor, Optional[Context]]:
+        if type(inp.attn_bias) not in FwOp.SUPPORTED_ATTN_BIAS_TYPES:
+            raise NotImplementedError("Unsupported attn_bias type")
+        out, lse = cls.OPERATOR(inp, cls.BLOCK_M, cls.BLOCK_N)
+        if inp.query.ndim == 4:
+            out, lse = out[:, :, 0], lse[:, 0]
+        ctx: Optional[Context] = None
+        if needs_gradient:
+            ctx = Context(out=out, lse=lse)
+        return out, ctx
+
+
+@register_operator
+class BwOp(AttentionBwOpBase):
+    __doc__ = FwOp.__doc__
+
+    OPERATOR = _attention_backward
+    SUPPORTED_DEVICES = FwOp.SUPPORTED_DEVICES
+    SUPPORTED_DTYPES = FwOp.SUPPORTED_DTYPES
+    SUPPORTED_MAX_K = FwOp.SUPPORTED_MAX_K
+    SUPPORTED_ATTN_BIAS_TYPES = FwOp.SUPPORTED_ATTN_BIAS_TYPES
+    SUPPORTS_DROPOUT = FwOp.SUPPORTS_DROPOUT
+    SUPPORTS_CUSTOM_SCALE = FwOp.SUPPORTS_CUSTOM_SCALE
+    SUPPORTS_DIFFERENT_VALUE_EMBED = FwOp.SUPPORTS_DIFFERENT_VALUE_EMBED
+    SUPPORTS_BMGHK = FwOp.SUPPORTS_BMGHK
+    NAME = "cpuB"
+
+    BLOCK_M = FwOp.BLOCK_M
+    BLOCK_N = FwOp.BLOCK_N
+
+    _TEST_BATCH_SIZES: List[int] = FwOp._TEST_BATCH_SIZES
+
+    @classmethod
+    def apply(cls, ctx: Context, inp: Inputs, grad: torch.Tensor) -> Gradients:
+        if type(inp.attn_bias) not in BwOp.SUPPORTED_ATTN_BIAS_TYPES:
+            raise NotImplementedError("Unsupported attn_bias type")
+        out, lse = ctx.out, ctx.lse
+        if inp.query.ndim == 4:
+            out, lse, grad = out.unsqueeze(2), lse.unsqueeze(1), grad.unsqueeze(2)
+        dq, dk, dv = cls.OPERATOR(inp, out, lse, grad, cls.BLOCK_M, cls.BLOCK_N)
+        if inp.query.ndim == 4:
+            dq, dk, dv = dq[:, :, 0], dk[:, :, 0], dv[:, :, 0]
+        return Gradients(dq=dq, dk=dk, dv=dv)
@@ -4,13 +4,26 @@
 # LICENSE file in the root directory of this source tree.
 
 
+import dataclasses
 import textwrap
-from collections import deque
-from typing import Any, List, Optional, Sequence, Tuple, Type, TypeVar
+from collections import OrderedDict, deque
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
 import torch
 
-from . import attn_bias, ck, cutlass, flash, flash3, triton_splitk
+from . import attn_bias, ck, cpu, cutlass, flash, flash3, triton_splitk
 from .common import AttentionBwOpBase, AttentionFwOpBase, Inputs
 
 T = TypeVar("T", Type[AttentionFwOpBase], Type[AttentionBwOpBase])
@@ -22,6 +35,8 @@ _USE_FLASH_ATTENTION_3 = False
 def _set_use_fa3(use_flash_attention3: bool) -> None:
     global _USE_FLASH_ATTENTION_3
     _USE_FLASH_ATTENTION_3 = use_flash_attention3
+    # Changes the priority lists
+    _clear_dispatch_cache()
 
 
 def _get_use_fa3() -> bool:
@@ -29,6 +44,139 @@ def _get_use_fa3() -> bool:
     return _USE_FLASH_ATTENTION_3
 
 
+class DispatchCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+# Operator selection only depends on a few properties of the inputs
+# (shapes, strides, dtypes, device, type of bias...), which are usually
+# the same from one call to the next - eg when decoding, or for every
+# layer of a model. We remember the operator chosen for the last
+# `_DISPATCH_CACHE_MAXSIZE` signatures so that we don't have to go through
+# every `not_supported_reasons` on each call.
+_DISPATCH_CACHE_MAXSIZE = 256
+_dispatch_cache: "OrderedDict[Hashable, Any]" = OrderedDict()
+_dispatch_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def _set_dispatch_cache_maxsize(maxsize: int) -> None:
+    """
+    Sets the number of dispatch decisions that are remembered.
+    Setting it to 0 disables the cache.
+    """
+    global _DISPATCH_CACHE_MAXSIZE
+    if maxsize < 0:
+        raise ValueError(f"Invalid cache size: {maxsize}")
+    _DISPATCH_CACHE_MAXSIZE = maxsize
+    while len(_dispatch_cache) > maxsize:
+        _dispatch_cache.popitem(last=False)
+
+
+def _get_dispatch_cache_info() -> DispatchCacheInfo:
+    return DispatchCacheInfo(
+        hits=_dispatch_cache_stats["hits"],
+        misses=_dispatch_cache_stats["misses"],
+        maxsize=_DISPATCH_CACHE_MAXSIZE,
+        currsize=len(_dispatch_cache),
+    )
+
+
+def _clear_dispatch_cache() -> None:
+    """
+    Forgets all the dispatch decisions. This needs to be called whenever
+    something that is not part of the inputs changes which operator
+    would be selected.
+    """
+    _dispatch_cache.clear()
+    _dispatch_cache_stats["hits"] = 0
+    _dispatch_cache_stats["misses"] = 0
+
+
+def _tensor_signature(x: torch.Tensor) -> Tuple[Any, ...]:
+    return (tuple(x.shape), x.stride(), x.dtype)
+
+
+def _attn_bias_signature(bias: Any) -> Tuple[Any, ...]:
+    signature: List[Any] = [type(bias)]
+    if isinstance(bias, attn_bias.AttentionBiasSubTensor):
+        bias = bias._subtensor if bias.HOLDS_DENSE_TENSOR else None
+    if isinstance(bias, torch.Tensor):
+        signature += [*_tensor_signature(bias), bias.requires_grad]
+    elif dataclasses.is_dataclass(bias):
+        for field in dataclasses.fields(bias):
+            value = getattr(bias, field.name)
+            if isinstance(
+                value, (attn_bias._PaddedSeqLenInfo, attn_bias._GappySeqInfo)
+            ):
+                # Per-sequence lengths of padded/gappy keys never affect the
+                # choice, and change at every step when decoding
+                signature.append((type(value), value.seqstart.shape[0]))
+            elif isinstance(value, attn_bias._SeqLenInfo):
+                # Avoids computing `seqstart_py` when it's not needed
+                signature.append(
+                    (
+                        type(value),
+                        value.seqstart.shape[0],
+                        value.min_seqlen,
+                        value.max_seqlen,
+                    )
+                )
+            elif isinstance(value, (bool, int, float)):
+                # page_size, window sizes...
+                signature.append(value)
+        if isinstance(bias, attn_bias.BlockDiagonalMask):
+            # Some operators need queries and keys to be aligned
+            signature.append(_seqinfos_aligned(bias.q_seqinfo, bias.k_seqinfo))
+    return tuple(signature)
+
+
+def _seqinfos_aligned(
+    q_seqinfo: attn_bias._SeqLenInfo, k_seqinfo: attn_bias._SeqLenInfo
+) -> bool:
+    if q_seqinfo is k_seqinfo:
+        return True
+    if q_seqinfo.seqstart.shape != k_seqinfo.seqstart.shape:
+        return False
+    # Read on the host once, and kept for the operators which need it
+    return q_seqinfo.seqstart_py == k_seqinfo.seqstart_py
+
+
+def _dispatch_cache_key(inp: Inputs, *extra: Hashable) -> Hashable:
+    return (
+        _tensor_signature(inp.query),
+        _tensor_signature(inp.key),
+        _tensor_signature(inp.value),
+        inp.query.device,
+        _attn_bias_signature(inp.attn_bias),
+        inp.p != 0.0,
+        inp.scale is not None,
+        inp.is_partial,
+        inp.output_dtype,
+        torch.are_deterministic_algorithms_enabled(),
+        *extra,
+    )
+
+
+def _cached_dispatch(key: Hashable, dispatch_fn: Callable[[], T]) -> T:
+    if _DISPATCH_CACHE_MAXSIZE == 0:
+        return dispatch_fn()
+    op = _dispatch_cache.get(key)
+    if op is not None:
+        _dispatch_cache_stats["hits"] += 1
+        _dispatch_cache.move_to_end(key)
+        return op
+    _dispatch_cache_stats["misses"] += 1
+    # Failures are not cached, so that we raise with the full error message
+    op = dispatch_fn()
+    _dispatch_cache[key] = op
+    if len(_dispatch_cache) > _DISPATCH_CACHE_MAXSIZE:
+        _dispatch_cache.popitem(last=False)
+    return op
+
+
 def _format_inputs_description(inp: Inputs) -> str:
     return f"""query       : shape={tuple(inp.query.shape)} ({inp.query.dtype})
 key         : shape={tuple(inp.key.shape)} ({inp.key.dtype})
@@ -119,6 +267,8 @@ def _dispatch_fw_priority_list(
                         priority_list_ops.remove(flash3.FwOp)
                     priority_list_ops.remove(flash.FwOp)
                     priority_list_ops.appendleft(flash.FwOp)
+    # Pure PyTorch fallback for CPU tensors
+    priority_list_ops.append(cpu.FwOp)
 
     return priority_list_ops
 
@@ -132,10 +282,13 @@ def _dispatch_fw(inp: Inputs, needs_gradient: bool) -> Type[AttentionFwOpBase]:
     Returns:
         AttentionOp: The best operator for the configuration
     """
-    return _run_priority_list(
-        "memory_efficient_attention_forward",
-        _dispatch_fw_priority_list(inp, needs_gradient),
-        inp,
+    return _cached_dispatch(
+        _dispatch_cache_key(inp, "fw", needs_gradient),
+        lambda: _run_priority_list(
+            "memory_efficient_attention_forward",
+            _dispatch_fw_priority_list(inp, needs_gradient),
+            inp,
+        ),
     )
 
 
@@ -145,6 +298,15 @@ def _is_cutlassB_faster_than_flash(inp: Inputs) -> bool:
 
 def _dispatch_bw(
     inp: Inputs, varlen_lse_packed: Optional[bool]
+) -> Type[AttentionBwOpBase]:
+    return _cached_dispatch(
+        _dispatch_cache_key(inp, "bw", varlen_lse_packed),
+        lambda: _dispatch_bw_uncached(inp, varlen_lse_packed),
+    )
+
+
+def _dispatch_bw_uncached(
+    inp: Inputs, varlen_lse_packed: Optional[bool]
 ) -> Type[AttentionBwOpBase]:
     if torch.version.cuda:
         priority_list_ops: List[Type[AttentionBwOpBase]] = [
@@ -155,6 +317,7 @@ def _dispatch_bw(
         priority_list_ops = [
             ck.BwOp,
         ]
+    priority_list_ops.append(cpu.BwOp)
 
     # NOTE: If we have a variable seqlen `attn_bias`, we need to get a BW pass
     # that supports the LSE format
@@ -0,0 +1,334 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple, Type, Union
+
+import torch
+
+from .fmha.attn_bias import (
+    PagedBlockDiagonalCausalWithOffsetPaddedKeysMask,
+    PagedBlockDiagonalGappyKeysMask,
+    PagedBlockDiagonalPaddedKeysMask,
+)
+
+PagedAttentionBias = Union[
+    PagedBlockDiagonalPaddedKeysMask, PagedBlockDiagonalGappyKeysMask
+]
+
+
+class _Sequence:
+    __slots__ = ("pages", "length")
+
+    def __init__(self, pages: List[int], length: int) -> None:
+        self.pages = pages
+        self.length = length
+
+
+class PagedKVCache:
+    """
+    Manages a paged K/V cache shared by many sequences, in the layout
+    expected by :attr:`xformers.ops.fmha.attn_bias.PagedBlockDiagonalPaddedKeysMask`
+    and :attr:`xformers.ops.fmha.attn_bias.PagedBlockDiagonalGappyKeysMask`.
+
+    Keys and values live in two preallocated pools ``cache_k`` and ``cache_v``
+    of shape ``[1, num_pages * page_size, num_heads, head_dim]``. Pages are
+    handed out from a free list, and each sequence owns a list of pages (its
+    row of the block tables). Pages can be shared between sequences
+    (for instance a common prompt) with :attr:`fork`: they are refcounted,
+    and a shared page is copied the first time one of its owners writes into it.
+
+    Example:
+
+    .. code-block:: python
+
+        cache = PagedKVCache(num_pages=1024, page_size=256, num_heads=8, head_dim=128)
+        cache.add_sequence("a")
+        cache.append("a", k_prompt, v_prompt)  # [n_tokens, num_heads, head_dim]
+        cache.fork("a", "b")  # "b" shares the prompt of "a"
+        cache.append("a", k_a, v_a)
+        cache.append("b", k_b, v_b)
+        attn_bias = cache.make_attn_bias(["a", "b"], q_seqlen=[1, 1])
+        out = memory_efficient_attention_forward(
+            q, cache.cache_k, cache.cache_v, attn_bias
+        )
+
+    All the bookkeeping is done on the host, so none of these methods
+    synchronize with the device.
+
+    :Note:
+
+        This is experimental.
+    """
+
+    def __init__(
+        self,
+        num_pages: int,
+        page_size: int,
+        num_heads: int,
+        head_dim: int,
+        *,
+        max_pages_per_seq: Optional[int] = None,
+        dtype: Optional[torch.dtype] = None,
+        device: Optional[Union[str, torch.device]] = None,
+    ) -> None:
+        """
+        Args:
+            num_pages: Total number of pages in the pool
+            page_size: Number of tokens per page
+            num_heads: Number of K/V heads
+            head_dim: Dimension of each K/V head
+            max_pages_per_seq: Width of the block tables of the emitted
+                biases. Keeping it fixed keeps the shapes of the biases
+                constant across calls (eg for CUDA graphs).
+                Defaults to the number of pages used by the longest sequence
+            dtype: dtype of the K/V pools
+            device: device of the K/V pools
+        """
+        if num_pages <= 0 or page_size <= 0:
+            raise ValueError(
+                f"Invalid cache size: num_pages={num_pages}, page_size={page_size}"
+            )
+        self.num_pages = num_pages
+        self.page_size = page_size
+        self.max_pages_per_seq = max_pages_per_seq
+        self.cache_k = torch.empty(
+            [1, num_pages * page_size, num_heads, head_dim], dtype=dtype, device=device
+        )
+        self.cache_v = torch.empty_like(self.cache_k)
+        # Popping from the end hands out the lowest page indices first
+        self._free_pages: List[int] = list(range(num_pages - 1, -1, -1))
+        self._refcounts: List[int] = [0] * num_pages
+        self._sequences: Dict[Hashable, _Sequence] = {}
+
+    @property
+    def device(self) -> torch.device:
+        return self.cache_k.device
+
+    @property
+    def num_free_pages(self) -> int:
+        return len(self._free_pages)
+
+    def __contains__(self, seq_id: Hashable) -> bool:
+        return seq_id in self._sequences
+
+    def __len__(self) -> int:
+        return len(self._sequences)
+
+    def seqlen(self, seq_id: Hashable) -> int:
+        """Number of tokens stored for the sequence"""
+        return self._sequences[seq_id].length
+
+    def block_table(self, seq_id: Hashable) -> List[int]:
+        """Indices of the pages used by the sequence, in order"""
+        return list(self._sequences[seq_id].pages)
+
+    def _allocate_pages(self, n: int) -> List[int]:
+        if n > len(self._free_pages):
+            raise RuntimeError(
+                f"Out of pages in the K/V cache: {n} pages requested "
+                f"but only {len(self._free_pages)} are free"
+            )
+        pages = [self._free_pages.pop() for _ in range(n)]
+        for page in pages:
+            self._refcounts[page] = 1
+        return pages
+
+    def _release_pages(self, pages: Sequence[int]) -> None:
+        for page in pages:
+            self._refcounts[page] -= 1
+            if self._refcounts[page] == 0:
+                self._free_pages.append(page)
+
+    def _copy_pages(self, src: Sequence[int], dst: Sequence[int]) -> None:
+        if not src:
+            return
+        src_t = torch.tensor(src, dtype=torch.int64).to(self.device, non_blocking=True)
+        dst_t = torch.tensor(dst, dtype=torch.int64).to(self.device, non_blocking=True)
+        for pool in (self.cache_k, self.cache_v):
+            pages = pool.view(self.num_pages, self.page_size, *pool.shape[2:])
+            pages.index_copy_(0, dst_t, pages.index_select(0, src_t))
+
+    def add_sequence(self, seq_id: Hashable) -> None:
+        """Registers a new empty sequence"""
+        if seq_id in self._sequences:
+            raise ValueError(f"Sequence {seq_id!r} already exists")
+        self._sequences[seq_id] = _Sequence([], 0)
+
+    def fork(
+        self, src_id: Hashable, dst_id: Hashable, num_tokens: Optional[int] = None
+    ) -> None:
+        """
+        Creates the sequence ``dst_id`` whose first ``num_tokens`` tokens
+        (by default all of them) are the ones of ``src_id``.
+        No data is copied: the pages are shared until one of the sequences
+        writes into a page that is shared.
+        """
+        if dst_id in self._sequences:
+            raise ValueError(f"Sequence {dst_id!r} already exists")
+        src = self._sequences[src_id]
+        if num_tokens is None:
+            num_tokens = src.length
+        if not 0 <= num_tokens <= src.length:
+            raise ValueError(
+                f"Cannot fork {num_tokens} tokens from a sequence of length {src.length}"
+            )
+        pages = src.pages[: (num_tokens + self.page_size - 1) // self.page_size]
+        for page in pages:
+            self._refcounts[page] += 1
+        self._sequences[dst_id] = _Sequence(list(pages), num_tokens)
+
+    def free_sequence(self, seq_id: Hashable) -> None:
+        """Removes the sequence, and frees the pages nobody else uses"""
+        seq = self._sequences.pop(seq_id)
+        self._release_pages(seq.pages)
+
+    def reserve(self, seq_id: Hashable, num_tokens: int) -> None:
+        """
+        Makes sure the next ``num_tokens`` tokens of the sequence can be
+        written without allocating: the pages are allocated, and the last
+        page is made private to the sequence if it is shared.
+        Call this before :attr:`make_attn_bias` if the bias is then updated
+        with ``advance``.
+        """
+        seq = self._sequences[seq_id]
+        new_length = seq.length + num_tokens
+        n_new_pages = (new_length + self.page_size - 1) // self.page_size - len(
+            seq.pages
+        )
+        # Only the partially filled page can be shared and written to
+        last = seq.length // self.page_size
+        copy_last = (
+            num_tokens > 0
+            and seq.length % self.page_size != 0
+            and self._refcounts[seq.pages[last]] > 1
+        )
+        new_pages = self._allocate_pages(max(n_new_pages, 0) + int(copy_last))
+        if copy_last:
+            private = new_pages.pop()
+            self._copy_pages([seq.pages[last]], [private])
+            self._release_pages([seq.pages[last]])
+            seq.pages[last] = private
+        seq.pages.extend(new_pages)
+
+    def slot_indices(self, seq_id: Hashable, start: int, end: int) -> torch.Tensor:
+        """
+        Returns the indices in the second dimension of the K/V pools
+        of the tokens ``start:end`` of the sequence
+        """
+        seq = self._sequences[seq_id]
+        if not 0 <= start <= end <= len(seq.pages) * self.page_size:
+            raise ValueError(f"Invalid token range [{start}, {end}) for {seq_id!r}")
+        pos = torch.arange(start, end)
+        pages = torch.tensor(seq.pages, dtype=torch.int64)
+        slots = pages[pos // self.page_size] * self.page_size + pos % self.page_size
+        return slots.to(self.device, non_blocking=True)
+
+    def append(self, seq_id: Hashable, key: torch.Tensor, value: torch.Tensor) -> None:
+        """
+        Appends ``key`` and ``value``, of shape ``[num_tokens, num_heads, head_dim]``,
+        at the end of the sequence.
+        """
+        if key.shape != value.shape or key.shape[1:] != self.cache_k.shape[2:]:
+            raise ValueError(
+                f"Invalid shapes: key={tuple(key.shape)}, value={tuple(value.shape)} "
+                f"for a cache of shape {tuple(self.cache_k.shape)}"
+            )
+        seq = self._sequences[seq_id]
+        num_tokens = key.shape[0]
+        self.reserve(seq_id, num_tokens)
+        slots = self.slot_indices(seq_id, seq.length, seq.length + num_tokens)
+        self.cache_k[0].index_copy_(0, slots, key.to(self.cache_k.dtype))
+        self.cache_v[0].index_copy_(0, slots, value.to(self.cache_v.dtype))
+        seq.length += num_tokens
+
+    def get_kv(self, seq_id: Hashable) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns the keys and values of a sequence as contiguous tensors of shape
+        ``[seqlen, num_heads, head_dim]``
+        """
+        slots = self.slot_indices(seq_id, 0, self._sequences[seq_id].length)
+        return self.cache_k[0, slots], self.cache_v[0, slots]
+
+    def compact(self) -> Dict[int, int]:
+        """
+        Moves the pages in use to the beginning of the pool, so that the
+        free pages form a contiguous range at the end of the pool.
+        Returns the pages that were moved, as a ``{old_index: new_index}`` dict.
+        Biases created before the compaction are invalidated.
+        """
+        num_used = self.num_pages - len(self._free_pages)
+        src = [p for p in range(num_used, self.num_pages) if self._refcounts[p] > 0]
+        dst = [p for p in range(num_used) if self._refcounts[p] == 0]
+        moved = dict(zip(src, dst))
+        self._copy_pages(src, dst)
+        for old, new in moved.items():
+            self._refcounts[new] = self._refcounts[old]
+            self._refcounts[old] = 0
+        for seq in self._sequences.values():
+            seq.pages = [moved.get(p, p) for p in seq.pages]
+        self._free_pages = list(range(self.num_pages - 1, num_used - 1, -1))
+        return moved
+
+    def make_attn_bias(
+        self,
+        seq_ids: Sequence[Hashable],
+        q_seqlen: Union[Sequence[int], torch.Tensor],
+        bias_type: Type[
+            PagedAttentionBias
+        ] = PagedBlockDiagonalCausalWithOffsetPaddedKeysMask,
+        *,
+        kv_seqstarts: Optional[Sequence[int]] = None,
+    ) -> PagedAttentionBias:
+        """
+        Creates the attention bias for a batch of queries attending to
+        the sequences ``seq_ids`` of the cache, to be used with
+        :attr:`cache_k` and :attr:`cache_v` as keys and values.
+        The keys of each sequence are all the tokens appended so far,
+        so the keys for the queries should be appended first.
+
+        Args:
+            seq_ids: Sequences of the batch
+            q_seqlen: Number of queries for each sequence
+            bias_type: One of the ``PagedBlockDiagonal*`` biases
+            kv_seqstarts: For gappy biases only, position of the first
+                key attended to in each sequence (defaults to 0). The tokens
+                before are ignored, eg for sliding window attention
+        """
+        seqs = [self._sequences[seq_id] for seq_id in seq_ids]
+        width = self.max_pages_per_seq
+        if width is None:
+            width = max([len(seq.pages) for seq in seqs] + [1])
+        block_tables = torch.zeros([len(seqs), width], dtype=torch.int32)
+        for i, seq in enumerate(seqs):
+            if len(seq.pages) > width:
+                raise ValueError(
+                    f"Sequence {seq_ids[i]!r} uses {len(seq.pages)} pages, "
+                    f"more than max_pages_per_seq={width}"
+                )
+            block_tables[i, : len(seq.pages)] = torch.tensor(
+                seq.pages, dtype=torch.int32
+            )
+        block_tables = block_tables.to(self.device, non_blocking=True)
+        kv_seqlen = [seq.length for seq in seqs]
+        if issubclass(bias_type, PagedBlockDiagonalGappyKeysMask):
+            if kv_seqstarts is None:
+                kv_seqstarts = [0] * len(seqs)
+            return bias_type.from_seqlens(
+                q_seqlen=q_seqlen,
+                kv_seqstarts=kv_seqstarts,
+                kv_seqlen=[n - s for n, s in zip(kv_seqlen, kv_seqstarts)],
+                block_tables=block_tables,
+                page_size=self.page_size,
+                device=self.device,
+            )
+        if kv_seqstarts is not None:
+            raise ValueError(f"kv_seqstarts is not supported by {bias_type.__name__}")
+        return bias_type.from_seqlens(
+            q_seqlen=q_seqlen,
+            kv_seqlen=kv_seqlen,
+            block_tables=block_tables,
+            page_size=self.page_size,
+            device=self.device,
+        )
@@ -2,7 +2,7 @@
 #
 # This source code is licensed under the BSD license found in the
 # LICENSE file in the root directory of this source tree.
-from typing import Optional
+from typing import Optional, Tuple
 
 import torch
 from torch import nn
@@ -10,6 +10,103 @@ from torch import nn
 from .. import _is_triton_available
 
 
+def _use_triton(x: torch.Tensor) -> bool:
+    return x.is_cuda and _is_triton_available()
+
+
+def _rms_norm_rstd(x: torch.Tensor, eps: float) -> torch.Tensor:
+    # Inverse RMS in (at least) float32, from a single reduction over the last dimension
+    norm = torch.linalg.vector_norm(
+        x, dim=-1, keepdim=True, dtype=torch.promote_types(x.dtype, torch.float32)
+    )
+    return norm.square_().div_(x.shape[-1]).add_(eps).rsqrt_()
+
+
+def _rms_norm_pytorch(
+    x: torch.Tensor, weight: Optional[torch.Tensor], eps: float
+) -> torch.Tensor:
+    out = x * _rms_norm_rstd(x, eps)
+    if weight is not None:
+        out.mul_(weight)
+    return out.to(x.dtype)
+
+
+def _rms_norm_forward(
+    x: torch.Tensor, weight: Optional[torch.Tensor], eps: float
+) -> torch.Tensor:
+    if _use_triton(x):
+        from ._triton.rmsnorm_kernels import _rms_norm_forward as _triton_forward
+
+        return _triton_forward(x, weight, eps)
+    return _rms_norm_pytorch(x, weight, eps)
+
+
+def _rms_norm_backward(
+    grad: torch.Tensor, x: torch.Tensor, weight: Optional[torch.Tensor], eps: float
+) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """
+    Gradients of `rms_norm` w.r.t. `x` and `weight`. The inverse RMS is recomputed
+    from `x`, so that the forward only saves its input
+    """
+    rstd = _rms_norm_rstd(x, eps)
+    x_hat = x * rstd
+    grad = grad.float()
+
+    grad_weight: Optional[torch.Tensor] = None
+    if weight is not None:
+        grad_weight = (
+            (grad * x_hat).flatten(0, -2).sum(0).to(weight.dtype)
+            if x.dim() > 1
+            else (grad * x_hat).to(weight.dtype)
+        )
+        grad = grad * weight
+
+    # d(x * rstd) = rstd * (grad - x_hat * mean(grad * x_hat))
+    grad_x_hat_mean = (grad * x_hat).mean(-1, keepdim=True)
+    grad_x = (grad - x_hat.mul_(grad_x_hat_mean)).mul_(rstd)
+    return grad_x.to(x.dtype), grad_weight
+
+
+class _RMSNormFunc(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, x, weight, eps):
+        ctx.save_for_backward(x, weight)
+        ctx.eps = eps
+        return _rms_norm_forward(x, weight, eps)
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        x, weight = ctx.saved_tensors
+        grad_x, grad_weight = _rms_norm_backward(grad_out, x, weight, ctx.eps)
+        return grad_x, grad_weight, None
+
+
+class _RMSNormAddFunc(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, x, y, weight, eps):
+        if _use_triton(x):
+            from ._triton.rmsnorm_kernels import _rms_norm_add_forward
+
+            out = _rms_norm_add_forward(x, y, weight, eps)
+        else:
+            out = _rms_norm_pytorch(x.add_(y), weight, eps)
+
+        # `x` now holds `x + y`, which is all the backward needs
+        ctx.mark_dirty(x)
+        ctx.save_for_backward(x, weight)
+        ctx.eps = eps
+        return x, out
+
+    @staticmethod
+    def backward(ctx, grad_sum, grad_out):
+        x, weight = ctx.saved_tensors
+        grad_x, grad_weight = _rms_norm_backward(grad_out, x, weight, ctx.eps)
+        if grad_sum is not None:
+            grad_x += grad_sum
+        grad_y = grad_x.clone() if ctx.needs_input_grad[1] else None
+        return grad_x, grad_y, grad_weight, None
+
+
 def rms_norm(x, weight: Optional[torch.Tensor], eps: float = 1e-6):
     """
     RMS Normalization along the last dimension.
@@ -25,18 +122,14 @@ def rms_norm(x, weight: Optional[torch.Tensor], eps: float = 1e-6):
     If weights are included, they are a contiguous parameter of length dim
     which multiplies the result.
 
+    Uses a Triton kernel on GPU if available, and PyTorch otherwise.
+    Gradients are supported, the backward recomputes the inverse RMS
+    instead of saving the normalized output.
+
     This functionality is experimental. Its API might be changed without warnings.
     Use it at your own risk.
     """
-    assert _is_triton_available()
-    from ._triton.rmsnorm_kernels import _rms_norm_forward
-
-    if torch.is_grad_enabled() and (
-        x.requires_grad or (weight is not None and weight.requires_grad)
-    ):
-        raise ValueError("Gradients not supported.")
-
-    return _rms_norm_forward(x, weight, eps)
+    return _RMSNormFunc.apply(x, weight, eps)
 
 
 def rms_norm_add(
@@ -54,19 +147,14 @@ def rms_norm_add(
 
     where x, y and z are all contiguous.
 
+    Uses a Triton kernel on GPU if available, and PyTorch otherwise.
+    Gradients are supported, `x` being modified in-place like for any
+    in-place operation.
+
     This functionality is experimental. Its API might be changed without warnings.
     Use it at your own risk.
     """
-    if torch.is_grad_enabled() and (
-        x.requires_grad
-        or y.requires_grad
-        or (weight is not None and weight.requires_grad)
-    ):
-        raise ValueError("Gradients not supported.")
-    assert _is_triton_available()
-    from ._triton.rmsnorm_kernels import _rms_norm_add_forward
-
-    return _rms_norm_add_forward(x, y, weight, eps)
+    return _RMSNormAddFunc.apply(x, y, weight, eps)[1]
 
 
 class RMSNorm(torch.nn.Module):
@@ -170,6 +170,93 @@ class _SwiGLUFusedFunc(torch.autograd.Function):
         return (dx, dw1, db1, dw2, db2, dw3, db3)
 
 
+class _SwiGLUPackedCPUFunc(torch.autograd.Function):
+    """
+    SwiGLU for CPU, with the packed ``w1w2`` weights: a single GEMM computes
+    ``x1`` and ``x2`` side by side, SiLU and the product are applied in place,
+    and the tokens are processed by chunks of ``CHUNK_ROWS`` rows, so that
+    the hidden activations never take more than ``[CHUNK_ROWS, 2 * hidden]``.
+
+    The backward recomputes the hidden activations chunk by chunk instead of
+    saving them, which costs one more GEMM but only saves the inputs.
+    """
+
+    NAME = "cpu.packed"
+    CHUNK_ROWS = 512
+
+    @classmethod
+    def forward(cls, ctx, x, w1w2, b1b2, w3, b3):
+        w12 = w1w2.view([-1, w1w2.shape[-1]])
+        b12 = b1b2.view([-1]) if b1b2 is not None else None
+        hidden_features = w1w2.shape[1]
+
+        out = x.new_empty([x.shape[0], w3.shape[0]])
+        for start in range(0, x.shape[0], cls.CHUNK_ROWS):
+            end = start + cls.CHUNK_ROWS
+            x12 = F.linear(x[start:end], w12, b12)
+            x1, x2 = x12[:, :hidden_features], x12[:, hidden_features:]
+            hidden = F.silu(x1, inplace=True).mul_(x2)
+            if b3 is not None:
+                torch.addmm(b3, hidden, w3.t(), out=out[start:end])
+            else:
+                torch.mm(hidden, w3.t(), out=out[start:end])
+
+        ctx.save_for_backward(x, w1w2, b1b2, w3)
+        ctx.bias3 = b3 is not None
+        return out
+
+    @classmethod
+    def backward(cls, ctx, dout):
+        x, w1w2, b1b2, w3 = ctx.saved_tensors
+        w12 = w1w2.view([-1, w1w2.shape[-1]])
+        b12 = b1b2.view([-1]) if b1b2 is not None else None
+        hidden_features = w1w2.shape[1]
+
+        dx = torch.empty_like(x) if ctx.needs_input_grad[0] else None
+        dw12 = torch.zeros_like(w12)
+        dw3 = torch.zeros_like(w3)
+        db12 = torch.zeros_like(b12) if b12 is not None else None
+        db3 = dout.new_zeros([w3.shape[0]]) if ctx.bias3 else None
+
+        for start in range(0, x.shape[0], cls.CHUNK_ROWS):
+            end = start + cls.CHUNK_ROWS
+            x_chunk, dout_chunk = x[start:end], dout[start:end]
+
+            # Recompute the hidden activations of the chunk
+            x12 = F.linear(x_chunk, w12, b12)
+            x1, x2 = x12[:, :hidden_features], x12[:, hidden_features:]
+            sigm = torch.sigmoid(x1)
+            silu = x1 * sigm
+            hidden = silu * x2
+
+            dw3.addmm_(dout_chunk.t(), hidden)
+            if db3 is not None:
+                db3 += dout_chunk.sum(0)
+            dhidden = dout_chunk @ w3
+            del hidden
+
+            # dx12 overwrites x12: [d(silu(x1)) * x2, dhidden * silu(x1)]
+            dx1 = x12[:, :hidden_features]
+            dx1.mul_(sigm.neg().add_(1)).add_(1).mul_(sigm).mul_(dhidden).mul_(x2)
+            x12[:, hidden_features:] = dhidden.mul_(silu)
+            dx12 = x12
+            del sigm, silu, dhidden
+
+            dw12.addmm_(dx12.t(), x_chunk)
+            if db12 is not None:
+                db12 += dx12.sum(0)
+            if dx is not None:
+                torch.mm(dx12, w12, out=dx[start:end])
+
+        return (
+            dx,
+            dw12.view_as(w1w2),
+            db12.view_as(b1b2) if db12 is not None else None,
+            dw3,
+            db3,
+        )
+
+
 class SwiGLUOp:
     """Base class for any swiglu operator in :attr:`xformers.ops.swiglu`"""
 
@@ -212,11 +299,11 @@ class _ForwardToFunc(SwiGLUOp):
 def _eager_functional_swiglu(
     x: torch.Tensor,
     w1: torch.Tensor,
-    b1: torch.Tensor,
+    b1: Optional[torch.Tensor],
     w2: torch.Tensor,
-    b2: torch.Tensor,
+    b2: Optional[torch.Tensor],
     w3: torch.Tensor,
-    b3: torch.Tensor,
+    b3: Optional[torch.Tensor],
 ) -> torch.Tensor:
     x1 = F.linear(x, w1, b1)
     x2 = F.linear(x, w2, b2)
@@ -246,6 +333,7 @@ class SwiGLUOpDispatch:
         priorities: Sequence[SwiGLUOp] = [
             SwiGLUPackedFusedOp,
             SwiGLUFusedOp,
+            SwiGLUPackedCPUOp,
         ]
         for op in priorities:
             if op.supports(self):
@@ -262,10 +350,19 @@ class SwiGLUOpDispatch:
         w3: torch.Tensor,
         b3: Optional[torch.Tensor],
     ) -> "SwiGLUOpDispatch":
+        # The packed operators also need packed biases, if any
+        packed_weights = stack_or_none((w1, w2), dim=0) is not None and (
+            (b1 is None and b2 is None)
+            or (
+                b1 is not None
+                and b2 is not None
+                and stack_or_none((b1, b2), dim=0) is not None
+            )
+        )
         return SwiGLUOpDispatch(
             device=x.device,
             dtype=x.dtype,
-            packed_weights=stack_or_none((w1, w2), dim=0) is not None,
+            packed_weights=packed_weights,
             dtype_autocast_gpu=torch.get_autocast_gpu_dtype()
             if torch.is_autocast_enabled()
             else w1.dtype,
@@ -278,6 +375,11 @@ def _only_sm80(op: SwiGLUOpDispatch) -> bool:
     return device_type == "cuda" and torch.cuda.get_device_capability(op.device)[0] >= 8
 
 
+def _only_cpu(op: SwiGLUOpDispatch) -> bool:
+    device_type = op.device if isinstance(op.device, str) else op.device.type
+    return device_type == "cpu" and not torch.is_autocast_cpu_enabled()
+
+
 def _only_half_or_autocast(op: SwiGLUOpDispatch) -> bool:
     HALF_DTYPES = [torch.half, torch.bfloat16]
     return op.dtype in HALF_DTYPES or (
@@ -301,6 +403,9 @@ SwiGLUPackedFusedOp = _ForwardToFunc(
     "fused.p.cpp",
     constraints=[_only_sm80, _only_half_or_autocast],
 )
+SwiGLUPackedCPUOp = _ForwardToPythonAutogradFunc(
+    _SwiGLUPackedCPUFunc, True, "cpu.packed", constraints=[_only_cpu]
+)
 SwiGLUEagerOp = _ForwardToFunc(
     _eager_functional_swiglu,
     False,
@@ -351,8 +456,8 @@ def swiglu(
     :Supported hardware:
 
     This operator is only optimized on A100+ on ``torch.half`` or ``torch.bfloat16`` \
-        (autocast is supported), and will fallback to a functional pytorch \
-        implementation otherwise.
+        (autocast is supported), and on CPU with packed weights, \
+        and will fallback to a functional pytorch implementation otherwise.
     """
 
     batch_shape = x.shape[:-1]
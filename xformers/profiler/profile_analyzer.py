@@ -4,12 +4,35 @@
 # LICENSE file in the root directory of this source tree.
 
 import math
+import re
 from collections import defaultdict
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Sequence, cast
 
 import torch
 
+from ..ops.fmha.common import ATTENTION_FLOPS_EVENT
+
+# NOTE: A single torch.dtype per number of bits
+# (eg so we map bf16 --> b16)
+ATEN_DTYPES = [
+    ("double", torch.float64),
+    ("float", torch.float),
+    ("c10::Half", torch.float16),
+    ("c10::BFloat16", torch.float16),
+    ("c10::Int8", torch.int8),
+]
+_ATTENTION_FLOPS_RE = re.compile(
+    re.escape(ATTENTION_FLOPS_EVENT) + r"\((\d+), torch\.(\w+)\)"
+)
+_ATEN_DTYPE_NAMES = {
+    torch.float64: "double",
+    torch.float: "float",
+    torch.float16: "c10::Half",
+    torch.bfloat16: "c10::BFloat16",
+    torch.int8: "c10::Int8",
+}
+
 
 class FakeKinetoEvent:
     def __init__(self, e: torch._C._autograd._KinetoEvent) -> None:
@@ -61,6 +84,18 @@ def _replace_if_needed(
     op_name = e.name()
     flops = None
 
+    # Attention calls recorded by xFormers, with the exact number of operations
+    # given by the attention bias. These events contain the attention kernels,
+    # so they are counted instead of them.
+    match = _ATTENTION_FLOPS_RE.fullmatch(op_name)
+    if match is not None:
+        attn_flops = int(match.group(1))
+        dtype_names = [_ATEN_DTYPE_NAMES.get(getattr(torch, match.group(2)), "")]
+        new_e = FakeKinetoEvent(e)
+        new_e.flops = lambda: attn_flops  # type: ignore
+        new_e.dtypes = lambda: dtype_names  # type: ignore
+        return cast(torch._C._autograd._KinetoEvent, new_e)
+
     FMT_BMHK = dict(fmt="BMHK")
     ATTN_OPS = {
         getattr(lib, op).default.name(): (getattr(lib, op), is_bwd, kwargs)
@@ -200,15 +235,6 @@ class AnalyzedTrace:
         # We detect BW pass ops based on their thread id
         all_bw_threads = {e.start_thread_id() for e in events if e.fwd_thread_id() > 0}
         # Find total dt
-        ATEN_DTYPES = [
-            # NOTE: A single torch.dtype per number of bits
-            # (eg so we map bf16 --> b16)
-            ("double", torch.float64),
-            ("float", torch.float),
-            ("c10::Half", torch.float16),
-            ("c10::BFloat16", torch.float16),
-            ("c10::Int8", torch.int8),
-        ]
         begin_ns, end_ns = math.inf, 0
         for op in root_ops:
             dtype = None
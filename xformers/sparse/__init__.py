@@ -3,5 +3,6 @@
 # This source code is licensed under the BSD license found in the
 # LICENSE file in the root directory of this source tree.
 
+from .blocksparse_attention import blocksparse_attention  # noqa: F401
 from .blocksparse_tensor import BlockSparseTensor  # noqa: F401
 from .csr_tensor import SparseCSRTensor  # noqa: F401
@@ -4,11 +4,95 @@
 # LICENSE file in the root directory of this source tree.
 
 
+import warnings
+
 import torch
 
+from xformers import _has_cpp_library
+
 from .utils import _csr_to_coo, _transpose_with_info
 
 
+def _use_torch_kernels(x: torch.Tensor) -> bool:
+    # The sputnik kernels are only used on CUDA, and might not be built
+    return not (_has_cpp_library and x.is_cuda)
+
+
+def _torch_csr(row_offsets, column_indices, values, shape):
+    with warnings.catch_warnings():
+        # "Sparse CSR tensor support is in beta state"
+        warnings.simplefilter("ignore", UserWarning)
+        return torch.sparse_csr_tensor(
+            row_offsets, column_indices.to(row_offsets.dtype), values, shape
+        )
+
+
+def _compute_dtype(x: torch.Tensor) -> torch.dtype:
+    # PyTorch's CSR kernels are not implemented for half-precision on CPU
+    if x.dtype in (torch.float32, torch.float64):
+        return x.dtype
+    return torch.float32
+
+
+def _sddmm_torch(a, b, row_offsets, column_indices):
+    """
+    Pure PyTorch sampled dense-dense matmul: `(a @ b.T)` at the positions of the
+    CSR `row_offsets` and `column_indices`, for each element of the batch
+    """
+    B, m, _ = a.shape
+    n = b.shape[1]
+    dtype_in, dtype = a.dtype, _compute_dtype(a)
+    a, b = a.to(dtype), b.to(dtype)
+    mask = _torch_csr(
+        row_offsets, column_indices, a.new_zeros(()).expand(len(column_indices)), (m, n)
+    )
+    out = a.new_empty([B, len(column_indices)])
+    for i in range(B):
+        out[i] = torch.sparse.sampled_addmm(
+            mask, a[i], b[i].transpose(0, 1), beta=0
+        ).values()
+    return out.to(dtype_in)
+
+
+def _spmm_torch(b, values, row_offsets, column_indices, m):
+    """
+    Pure PyTorch sparse-dense matmul, between the CSR matrices of `values` and `b`
+    """
+    B, n, k = b.shape
+    dtype = _compute_dtype(values)
+    out = b.new_empty([B, m, k], dtype=dtype)
+    for i in range(B):
+        sparse = _torch_csr(row_offsets, column_indices, values[i].to(dtype), (m, n))
+        torch.mm(sparse, b[i].to(dtype), out=out[i])
+    return out.to(values.dtype)
+
+
+def _csr_rows(m, row_offsets, column_indices):
+    row_coo, _ = _csr_to_coo(m, None, row_offsets, column_indices)
+    return row_coo.long()
+
+
+def _sparse_softmax_torch(m, values, row_offsets, column_indices):
+    """
+    Pure PyTorch softmax over the nonzero elements of each row, with segment reductions
+    """
+    B = values.shape[0]
+    rows = _csr_rows(m, row_offsets, column_indices)
+    row_max = values.new_full([B, m], float("-inf")).scatter_reduce_(
+        1, rows.expand(B, -1), values, "amax"
+    )
+    out = (values - row_max[:, rows]).exp_()
+    row_sum = values.new_zeros([B, m]).index_add_(1, rows, out)
+    return out.div_(row_sum[:, rows])
+
+
+def _sparse_softmax_backward_torch(m, out, grad, row_offsets, column_indices):
+    B = out.shape[0]
+    rows = _csr_rows(m, row_offsets, column_indices)
+    dot = out.new_zeros([B, m]).index_add_(1, rows, out * grad)
+    return out * (grad - dot[:, rows])
+
+
 def _should_use_coo(a, sparsity):
     if not a.is_cuda:
         return False
@@ -33,6 +117,8 @@ def _should_use_csr_ge(a, sparsity):
 
 
 def _sddmm_func(a, b, row_indices, row_offsets, column_indices):
+    if _use_torch_kernels(a):
+        return _sddmm_torch(a, b, row_offsets, column_indices)
     sparsity = 1 - column_indices.shape[0] / (a.shape[1] * b.shape[1])
     if _should_use_coo(a, sparsity):
         m = a.shape[-2]
@@ -50,12 +136,23 @@ def _sddmm_func(a, b, row_indices, row_offsets, column_indices):
     )
 
 
+def _spmm_func(b, row_indices, values, row_offsets, column_indices, m):
+    if _use_torch_kernels(b):
+        return _spmm_torch(b, values, row_offsets, column_indices, m)
+    return torch.ops.xformers.spmm_sputnik(
+        b, row_indices, values, row_offsets, column_indices, m
+    )
+
+
 class _SparseSoftmax(torch.autograd.Function):
     @staticmethod
     def forward(ctx, m, n, row_indices, values, row_offsets, column_indices):
-        out = torch.ops.xformers.sparse_softmax_sputnik(
-            m, n, row_indices, values, row_offsets, column_indices
-        )
+        if _use_torch_kernels(values):
+            out = _sparse_softmax_torch(m, values, row_offsets, column_indices)
+        else:
+            out = torch.ops.xformers.sparse_softmax_sputnik(
+                m, n, row_indices, values, row_offsets, column_indices
+            )
         # note: save out and not values, as an optimization step
         ctx.save_for_backward(row_indices, out, row_offsets, column_indices)
         ctx.size = (m, n)
@@ -68,9 +165,14 @@ class _SparseSoftmax(torch.autograd.Function):
 
         # gradients w.r.t. values
         grad = grad.contiguous()
-        ga = torch.ops.xformers.sparse_softmax_backward_sputnik(
-            m, n, row_indices, out, grad, row_offsets, column_indices
-        )
+        if _use_torch_kernels(grad):
+            ga = _sparse_softmax_backward_torch(
+                m, out, grad, row_offsets, column_indices
+            )
+        else:
+            ga = torch.ops.xformers.sparse_softmax_backward_sputnik(
+                m, n, row_indices, out, grad, row_offsets, column_indices
+            )
 
         return None, None, None, ga, None, None
 
@@ -102,9 +204,7 @@ class _sddmm(torch.autograd.Function):
         a = a.contiguous()
         b = b.contiguous()
 
-        a_grad = torch.ops.xformers.spmm_sputnik(
-            b, row_indices, grad, row_offsets, column_indices, m
-        )
+        a_grad = _spmm_func(b, row_indices, grad, row_offsets, column_indices, m)
 
         (
             row_indices_t,
@@ -113,7 +213,7 @@ class _sddmm(torch.autograd.Function):
             column_indices_t,
         ) = _transpose_with_info(grad, _transp_info)
 
-        b_grad = torch.ops.xformers.spmm_sputnik(
+        b_grad = _spmm_func(
             a, row_indices_t, grad_t, row_offsets_t, column_indices_t, n
         )
 
@@ -126,9 +226,7 @@ class _spmm(torch.autograd.Function):
         ctx, b, row_indices, values, row_offsets, column_indices, m, _transp_info
     ):
         b = b.contiguous()
-        out = torch.ops.xformers.spmm_sputnik(
-            b, row_indices, values, row_offsets, column_indices, m
-        )
+        out = _spmm_func(b, row_indices, values, row_offsets, column_indices, m)
 
         ctx.save_for_backward(
             b, row_indices, values, row_offsets, column_indices, *_transp_info
@@ -159,7 +257,7 @@ class _spmm(torch.autograd.Function):
             column_indices_t,
         ) = _transpose_with_info(values, _transp_info)
 
-        grad_dense = torch.ops.xformers.spmm_sputnik(
+        grad_dense = _spmm_func(
             grad, row_indices_t, values_t, row_offsets_t, column_indices_t, k
         )
 
@@ -0,0 +1,181 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All rights reserved.
+#
+# This source code is licensed under the BSD license found in the
+# LICENSE file in the root directory of this source tree.
+
+import math
+from typing import List, NamedTuple, Optional
+
+import torch
+
+
+class _BlockRows(NamedTuple):
+    # (head, block row) of the block rows with at least one block,
+    # by decreasing number of blocks
+    heads: torch.Tensor
+    rows: torch.Tensor
+    # [num_block_rows, max_blocks_per_row] block column of the t-th block of each row
+    columns: torch.Tensor
+    # number of block rows with more than `t` blocks, which are the first ones
+    num_rows: List[int]
+
+
+def _block_rows(layout: torch.Tensor, causal: bool) -> _BlockRows:
+    H, blocks_i, blocks_j = layout.shape
+    layout = layout.bool()
+    if causal:
+        layout = layout.tril()
+    counts = layout.sum(-1).flatten()
+    order = counts.argsort(descending=True, stable=True)
+    order = order[counts[order] > 0]
+    counts = counts[order]
+    max_count = int(counts[0]) if len(counts) else 0
+    # Sort the columns of each row so that the active ones come first
+    columns = (~layout.flatten(0, 1)[order]).sort(dim=1, stable=True).indices
+    steps = torch.arange(max_count, device=layout.device)
+    num_rows = (counts[None] > steps[:, None]).sum(1).tolist()
+    return _BlockRows(
+        order // blocks_i, order % blocks_i, columns[:, :max_count], num_rows
+    )
+
+
+def _block_scores(q, k, scale, causal, rows, columns):
+    s = (q @ k.transpose(-2, -1)) * scale
+    if causal:
+        block_size = s.shape[-1]
+        upper = torch.ones(
+            block_size, block_size, dtype=torch.bool, device=s.device
+        ).triu(1)
+        diagonal = (rows == columns)[:, None, None]
+        s = s.masked_fill(diagonal & upper, float("-inf"))
+    return s
+
+
+class _BlockSparseAttention(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, q, k, v, layout, causal, scale):
+        B, H, M, K = q.shape
+        N, Kv = k.shape[2], v.shape[3]
+        blocks_i, blocks_j = layout.shape[1:]
+        block_size = M // blocks_i
+        assert block_size * blocks_i == M and block_size * blocks_j == N
+        dtype = torch.promote_types(q.dtype, torch.float32)
+
+        plan = _block_rows(layout.to(q.device), causal)
+        heads, rows, columns = plan.heads, plan.rows, plan.columns
+        R = len(heads)
+        q_rows = q.reshape(B, H, blocks_i, block_size, K)[:, heads, rows].to(dtype)
+        k_blocks = k.reshape(B, H, blocks_j, block_size, K)
+        v_blocks = v.reshape(B, H, blocks_j, block_size, Kv)
+
+        # Online softmax over the blocks of each row
+        acc = q.new_zeros([B, R, block_size, Kv], dtype=dtype)
+        row_max = q.new_full([B, R, block_size], float("-inf"), dtype=dtype)
+        row_sum = q.new_zeros([B, R, block_size], dtype=dtype)
+        for t, n in enumerate(plan.num_rows):
+            cols = columns[:n, t]
+            kt = k_blocks[:, heads[:n], cols].to(dtype)
+            vt = v_blocks[:, heads[:n], cols].to(dtype)
+            s = _block_scores(q_rows[:, :n], kt, scale, causal, rows[:n], cols)
+            new_max = torch.maximum(row_max[:, :n], s.amax(-1))
+            new_max = new_max.masked_fill(new_max == float("-inf"), 0.0)
+            alpha = (row_max[:, :n] - new_max).exp()
+            p = (s - new_max[..., None]).exp()
+            row_sum[:, :n] = row_sum[:, :n] * alpha + p.sum(-1)
+            acc[:, :n] = acc[:, :n] * alpha[..., None] + p @ vt
+            row_max[:, :n] = new_max
+
+        # Queries which do not attend to any key get zeros
+        out_rows = acc / row_sum.clamp_min(torch.finfo(dtype).tiny)[..., None]
+        lse = row_max + row_sum.log()
+        out = q.new_zeros([B, H, blocks_i, block_size, Kv])
+        out[:, heads, rows] = out_rows.to(q.dtype)
+
+        ctx.save_for_backward(q, k, v, out, lse)
+        ctx.plan = plan
+        ctx.causal = causal
+        ctx.scale = scale
+        return out.reshape(B, H, M, Kv)
+
+    @staticmethod
+    def backward(ctx, grad):
+        q, k, v, out, lse = ctx.saved_tensors
+        plan = ctx.plan
+        heads, rows, columns = plan.heads, plan.rows, plan.columns
+        scale = ctx.scale
+        B, H, blocks_i, block_size, Kv = out.shape
+        K = q.shape[3]
+        blocks_j = k.shape[2] // block_size
+        dtype = lse.dtype
+
+        q_rows = q.reshape(B, H, blocks_i, block_size, K)[:, heads, rows].to(dtype)
+        k_blocks = k.reshape(B, H, blocks_j, block_size, K)
+        v_blocks = v.reshape(B, H, blocks_j, block_size, Kv)
+        grad_rows = grad.reshape(out.shape)[:, heads, rows].to(dtype)
+        delta = (grad_rows * out[:, heads, rows].to(dtype)).sum(-1)
+        lse = lse.masked_fill(lse == float("-inf"), float("inf"))
+
+        grad_q_rows = torch.zeros_like(q_rows)
+        grad_k = k.new_zeros([B, H * blocks_j, block_size, K], dtype=dtype)
+        grad_v = v.new_zeros([B, H * blocks_j, block_size, Kv], dtype=dtype)
+        for t, n in enumerate(plan.num_rows):
+            cols = columns[:n, t]
+            kt = k_blocks[:, heads[:n], cols].to(dtype)
+            vt = v_blocks[:, heads[:n], cols].to(dtype)
+            s = _block_scores(q_rows[:, :n], kt, scale, ctx.causal, rows[:n], cols)
+            p = (s - lse[:, :n, :, None]).exp()
+            index = heads[:n] * blocks_j + cols
+            grad_v.index_add_(1, index, p.transpose(-2, -1) @ grad_rows[:, :n])
+            grad_s = p * (
+                grad_rows[:, :n] @ vt.transpose(-2, -1) - delta[:, :n, :, None]
+            )
+            grad_q_rows[:, :n] += (grad_s @ kt) * scale
+            grad_k.index_add_(
+                1, index, (grad_s.transpose(-2, -1) @ q_rows[:, :n]) * scale
+            )
+
+        grad_q = q.new_zeros([B, H, blocks_i, block_size, K])
+        grad_q[:, heads, rows] = grad_q_rows.to(q.dtype)
+        return (
+            grad_q.reshape(q.shape),
+            grad_k.reshape(k.shape).to(k.dtype),
+            grad_v.reshape(v.shape).to(v.dtype),
+            None,
+            None,
+            None,
+        )
+
+
+def blocksparse_attention(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    layout: torch.Tensor,
+    causal: bool = False,
+    scale: Optional[float] = None,
+) -> torch.Tensor:
+    """
+    Attention restricted to the blocks of a block-sparse `layout`, in pure PyTorch.
+
+    Unlike the `BlockSparseTensor` path (`masked_matmul`, softmax and matmul), the
+    attention scores of all the blocks are never stored: the blocks are processed
+    one block column at a time for all block rows, with an online softmax, and the
+    backward pass recomputes the scores.
+    This is meant for CPUs, or GPUs without Triton.
+
+    :param q: queries, of shape `[B, H, M, K]`
+    :param k: keys, of shape `[B, H, N, K]`
+    :param v: values, of shape `[B, H, N, Kv]`
+    :param layout: `[H, M // block_size, N // block_size]` tensor, non-zero for
+        the blocks of queries and keys which attend to each other
+    :param causal: queries also do not attend to the keys after them
+        (blocks above the diagonal of the layout are ignored)
+    :param scale: scale of the scores, defaults to `1 / sqrt(K)`
+    :return: the attention output, of shape `[B, H, M, Kv]`. Queries which do not
+        attend to any key get zeros
+    """
+    assert q.ndim == k.ndim == v.ndim == 4
+    assert layout.ndim == 3 and layout.shape[0] == q.shape[1]
+    if scale is None:
+        scale = 1.0 / math.sqrt(q.shape[-1])
+    return _BlockSparseAttention.apply(q, k, v, layout, causal, scale)
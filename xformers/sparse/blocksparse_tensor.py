@@ -189,10 +189,10 @@ class BlockSparseTensor(torch.Tensor):
 
         out_r = out.reshape(
             arg0.shape[0], arg0.shape[1], blocks_i, block_size, blocks_j, block_size
-        )
+        ).transpose(3, 4)
 
-        for idx, (h, i, j) in enumerate(zip(*layout.nonzero(as_tuple=True))):
-            out_r[:, h, i, :, j, :] = values[:, idx, :, :]
+        h, i, j = layout.nonzero(as_tuple=True)
+        out_r[:, h, i, j] = values
 
         return out
 
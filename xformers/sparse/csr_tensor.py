@@ -9,10 +9,9 @@ import torch
 from xformers.ops import masked_matmul
 from xformers.sparse import _csr_ops
 from xformers.sparse.utils import (
+    _csr_structure_cache,
     _csr_to_coo,
     _dense3d_to_sparse,
-    _diffsort,
-    _get_transpose_info,
     _transpose_with_info,
 )
 
@@ -33,18 +32,15 @@ class SparseCSRTensor(torch.Tensor):
         assert column_indices.ndim == 1
         assert values.ndim == 2
 
-        self.__row_offsets = row_offsets.contiguous()
-        self.__row_indices = _diffsort(row_offsets).to(row_offsets.dtype)
-        self.__column_indices = column_indices.contiguous()
-        self.__values = values.contiguous()
-
-        self.__transp_info = _get_transpose_info(
-            self.shape[1],
-            self.shape[2],
-            self.__row_indices,
-            self.__row_offsets,
-            self.__column_indices,
+        # The indices are shared with the other matrices with the same pattern
+        structure = _csr_structure_cache.get(
+            self.shape[1], self.shape[2], row_offsets, column_indices
         )
+        self.__row_offsets = structure.row_offsets
+        self.__row_indices = structure.row_indices
+        self.__column_indices = structure.column_indices
+        self.__values = values.contiguous()
+        self.__transp_info = structure.transp_info
 
     def __repr__(self):
         return f"sparse_csr_tensor(shape={self.shape}, values={self.__values})"
@@ -155,22 +151,22 @@ class SparseCSRTensor(torch.Tensor):
         values = arg0.__values
 
         (
-            output_row_indices,
+            _,
             output_values,
             output_row_offsets,
             output_column_indices,
         ) = _transpose_with_info(values, arg0.__transp_info)
-        new_transp_info = _get_transpose_info(
-            n, m, output_row_indices, output_row_offsets, output_column_indices
+        structure = _csr_structure_cache.get(
+            n, m, output_row_offsets, output_column_indices
         )
 
         return cls._wrap(
             (B, n, m),
             output_values,
-            output_row_indices,
-            output_row_offsets,
-            output_column_indices,
-            new_transp_info,
+            structure.row_indices,
+            structure.row_offsets,
+            structure.column_indices,
+            structure.transp_info,
         )
 
     @classmethod
@@ -206,13 +202,17 @@ class SparseCSRTensor(torch.Tensor):
         if isinstance(device, str):
             device = torch.device(device)
         assert isinstance(device, torch.device)
+        _, m, n = arg0.shape
+        structure = _csr_structure_cache.get(
+            m, n, arg0.__row_offsets, arg0.__column_indices, device
+        )
         return cls._wrap(
             arg0.shape,
             arg0.__values.to(device=device),
-            arg0.__row_indices.to(device=device),
-            arg0.__row_offsets.to(device=device),
-            arg0.__column_indices.to(device=device),
-            tuple(t.to(device=device) for t in arg0.__transp_info),
+            structure.row_indices,
+            structure.row_offsets,
+            structure.column_indices,
+            structure.transp_info,
         )
 
     @classmethod
@@ -222,14 +222,15 @@ class SparseCSRTensor(torch.Tensor):
         assert arg0.shape == arg1.shape
         av0, av1 = arg0.__values, arg1.__values
         av0.resize_as_(av1).copy_(av1)
-        av0, av1 = arg0.__row_indices, arg1.__row_indices
-        av0.resize_as_(av1).copy_(av1)
-        av0, av1 = arg0.__row_offsets, arg1.__row_offsets
-        av0.resize_as_(av1).copy_(av1)
-        av0, av1 = arg0.__column_indices, arg1.__column_indices
-        av0.resize_as_(av1).copy_(av1)
-        for v0, v1 in zip(arg0.__transp_info, arg1.__transp_info):
-            v0.resize_as_(v1).copy_(v1)
+        # The indices can be shared with other matrices, so they are not modified in-place
+        _, m, n = arg0.shape
+        structure = _csr_structure_cache.get(
+            m, n, arg1.__row_offsets, arg1.__column_indices, arg0.device
+        )
+        arg0.__row_indices = structure.row_indices
+        arg0.__row_offsets = structure.row_offsets
+        arg0.__column_indices = structure.column_indices
+        arg0.__transp_info = structure.transp_info
         return arg0
 
     @classmethod
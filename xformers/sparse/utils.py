@@ -3,6 +3,9 @@
 # This source code is licensed under the BSD license found in the
 # LICENSE file in the root directory of this source tree.
 
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, NamedTuple, Optional, Tuple
 
 import torch
 
@@ -58,6 +61,195 @@ def _transpose(m, n, row_indices, values, row_offsets, column_indices):
     return _transpose_with_info(values, _transpose_info)
 
 
+class _CSRStructure(NamedTuple):
+    row_indices: torch.Tensor
+    row_offsets: torch.Tensor
+    column_indices: torch.Tensor
+    transp_info: Tuple[torch.Tensor, ...]
+
+    def tensors(self):
+        return (self.row_indices, self.row_offsets, self.column_indices) + tuple(
+            self.transp_info
+        )
+
+    def to(self, device: torch.device) -> "_CSRStructure":
+        return _CSRStructure(
+            self.row_indices.to(device),
+            self.row_offsets.to(device),
+            self.column_indices.to(device),
+            tuple(t.to(device) for t in self.transp_info),
+        )
+
+
+def _make_csr_structure(m, n, row_offsets, column_indices) -> _CSRStructure:
+    row_offsets = row_offsets.contiguous()
+    column_indices = column_indices.contiguous()
+    row_indices = _diffsort(row_offsets).to(row_offsets.dtype)
+    transp_info = _get_transpose_info(m, n, row_indices, row_offsets, column_indices)
+    return _CSRStructure(row_indices, row_offsets, column_indices, transp_info)
+
+
+def _normalize_device(device) -> torch.device:
+    device = torch.device(device)
+    if device.type == "cuda" and device.index is None:
+        device = torch.device("cuda", torch.cuda.current_device())
+    return device
+
+
+class _CSRStructureCache:
+    """
+    Interns the index tensors of CSR matrices (row offsets, column indices, and the
+    row indices and transposition info derived from them), so that sparse matrices
+    with the same sparsity pattern share them instead of recomputing them,
+    e.g. the masks of all the layers of a model.
+    Structures are deduplicated by content, with one copy per device,
+    and the least recently used ones are dropped above `max_bytes`.
+    The interned tensors are shared, and must not be modified in-place.
+    The cache can be used from several threads.
+    """
+
+    # Number of random linear hashes of the indices
+    _NUM_HASHES = 2
+    # Their coefficients are drawn by blocks, so that they do not
+    # depend on the length of the largest indices seen
+    _HASH_BLOCK = 2**16
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._structures: "OrderedDict[Hashable, Dict[torch.device, _CSRStructure]]" = (
+            OrderedDict()
+        )
+        # id(row_offsets) of the interned structures -> (m, n, key),
+        # to skip hashing them again
+        self._keys: Dict[int, Tuple[int, int, Hashable]] = {}
+        # Per device, the coefficients of the hashes
+        self._hash_weights: Dict[torch.device, torch.Tensor] = {}
+        self._lock = threading.Lock()
+
+    def _get_hash_weights(self, length: int, device: torch.device) -> torch.Tensor:
+        weights = self._hash_weights.get(device)
+        num_blocks = 0 if weights is None else weights.shape[1] // self._HASH_BLOCK
+        if num_blocks * self._HASH_BLOCK < length:
+            # Drawn on the host with fixed seeds, so that the hashes
+            # are the same on every device
+            blocks = [
+                torch.randint(
+                    -(2**62),
+                    2**62,
+                    [self._NUM_HASHES, self._HASH_BLOCK],
+                    dtype=torch.long,
+                    generator=torch.Generator().manual_seed(i),
+                )
+                for i in range(
+                    num_blocks, max(-(-length // self._HASH_BLOCK), 2 * num_blocks)
+                )
+            ]
+            new_weights = torch.cat(blocks, dim=1).to(device)
+            weights = (
+                new_weights
+                if weights is None
+                else torch.cat([weights, new_weights], dim=1)
+            )
+            self._hash_weights[device] = weights
+        assert weights is not None
+        return weights[:, :length]
+
+    def _hash(self, m, n, row_offsets, column_indices) -> Hashable:
+        # The indices are hashed on their device, and only the hashes
+        # are copied to the host
+        hashes = [
+            (
+                t.detach().reshape(-1).long()
+                * self._get_hash_weights(t.numel(), _normalize_device(t.device))
+            ).sum(-1)
+            for t in (row_offsets, column_indices)
+        ]
+        return (
+            m,
+            n,
+            row_offsets.dtype,
+            column_indices.dtype,
+            column_indices.numel(),
+            *torch.cat(hashes).tolist(),
+        )
+
+    def _find_key(self, m, n, row_offsets, column_indices) -> Hashable:
+        m_n_key = self._keys.get(id(row_offsets))
+        if m_n_key is not None and m_n_key[:2] == (m, n):
+            key = m_n_key[2]
+            for structure in self._structures[key].values():
+                if (
+                    structure.row_offsets is row_offsets
+                    and structure.column_indices is column_indices
+                ):
+                    return key
+        return self._hash(m, n, row_offsets, column_indices)
+
+    def _add(
+        self,
+        m: int,
+        n: int,
+        key: Hashable,
+        device: torch.device,
+        structure: _CSRStructure,
+    ) -> None:
+        nbytes = sum(t.numel() * t.element_size() for t in structure.tensors())
+        if nbytes > self.max_bytes:
+            return
+        self._structures.setdefault(key, {})[device] = structure
+        self._keys[id(structure.row_offsets)] = (m, n, key)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            self._evict(next(iter(self._structures)))
+
+    def _evict(self, key: Hashable) -> None:
+        for structure in self._structures.pop(key).values():
+            self._keys.pop(id(structure.row_offsets), None)
+            self.nbytes -= sum(
+                t.numel() * t.element_size() for t in structure.tensors()
+            )
+
+    def get(
+        self,
+        m: int,
+        n: int,
+        row_offsets: torch.Tensor,
+        column_indices: torch.Tensor,
+        device: Optional[torch.device] = None,
+    ) -> _CSRStructure:
+        """
+        Returns the interned structure of the `m x n` CSR matrix with the given
+        `row_offsets` and `column_indices`, on `device` (defaults to their device)
+        """
+        device = _normalize_device(row_offsets.device if device is None else device)
+        with self._lock:
+            key = self._find_key(m, n, row_offsets, column_indices)
+            copies = self._structures.get(key)
+            if copies is None:
+                structure = _make_csr_structure(
+                    m, n, row_offsets.to(device), column_indices.to(device)
+                )
+            elif device in copies:
+                self._structures.move_to_end(key)
+                return copies[device]
+            else:
+                self._structures.move_to_end(key)
+                structure = next(iter(copies.values())).to(device)
+            self._add(m, n, key, device, structure)
+            return structure
+
+    def clear(self) -> None:
+        with self._lock:
+            self._structures.clear()
+            self._keys.clear()
+            self.nbytes = 0
+
+
+_CSR_STRUCTURE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+_csr_structure_cache = _CSRStructureCache(_CSR_STRUCTURE_CACHE_MAX_BYTES)
+
+
 def _nonzero_mask_to_sparse_csr_indices(mask, device):
     """Converts dense 2d matrix to a csr sparse matrix."""
 
@@ -68,16 +260,14 @@ def _nonzero_mask_to_sparse_csr_indices(mask, device):
     row_offsets = mask.sum(dim=-1, dtype=index_dtype).cumsum(dim=-1, dtype=index_dtype)
     row_offsets = torch.nn.functional.pad(row_offsets, (1, 0))
 
-    # Create the row indices and sort them.
-    row_indices = _diffsort(row_offsets).to(index_dtype)
-
     # Extract the column indices for the nonzero values.
     column_indices = torch.where(mask)[1].to(index_dtype).contiguous()
 
-    row_indices = row_indices.to(device)
-    row_offsets = row_offsets.to(device)
-    column_indices = column_indices.to(device)
-    return row_indices, row_offsets, column_indices
+    # Reuse the indices (and the sorted row indices) of the same pattern if we have seen it
+    structure = _csr_structure_cache.get(
+        mask.shape[0], mask.shape[1], row_offsets, column_indices, device
+    )
+    return structure.row_indices, structure.row_offsets, structure.column_indices
 
 
 def _dense_to_sparse(matrix, device):
@@ -107,17 +297,27 @@ def _round_nnz(mask, divisible_by=4):
 
 def _dense3d_to_sparse(matrix, device):
     assert len(matrix.shape) == 3
+    B, m, n = matrix.shape
     mask = matrix != 0
-    if not torch.all(mask == mask[0]):
+    if B > 1 and not torch.all(mask == mask[0]):
         raise ValueError("Expected the same sparsity pattern over the batch dimension")
 
     # for now, our kernels assume that we have the number of
-    # nnz to be divisible by 4
-    mask = _round_nnz(mask[0], divisible_by=4)
-    mask = mask[None].expand(matrix.shape)
+    # nnz to be divisible by 4 (same as `_round_nnz`)
+    rows, cols = mask[0].nonzero(as_tuple=True)
+    nnz = rows.shape[0] - rows.shape[0] % 4
+    rows, cols = rows[:nnz], cols[:nnz]
 
-    values = matrix[mask].reshape(matrix.shape[0], -1).to(device)
-    row_indices, row_offsets, column_indices = _nonzero_mask_to_sparse_csr_indices(
-        mask[0], device
+    values = matrix[:, rows, cols].to(device)
+    index_dtype = torch.int32
+    row_offsets = rows.bincount(minlength=m).cumsum(0, dtype=index_dtype)
+    row_offsets = torch.nn.functional.pad(row_offsets, (1, 0))
+    structure = _csr_structure_cache.get(
+        m, n, row_offsets, cols.to(index_dtype), device
+    )
+    return (
+        values,
+        structure.row_indices,
+        structure.row_offsets,
+        structure.column_indices,
     )
-    return values, row_indices, row_offsets, column_indices